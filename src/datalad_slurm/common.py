@@ -1,12 +1,20 @@
 __docformat__ = "restructuredtext"
 
+import bisect
+import fnmatch
+import hashlib
 import json
+import logging
 import os.path as op
 import re
 import sqlite3
+import subprocess
 
+from datalad.core.local.run import _create_record
 from datalad.support.json_py import load_stream
 
+lgr = logging.getLogger("datalad.slurm.common")
+
 
 def get_finish_info(dset, message):
     """
@@ -59,11 +67,784 @@ def get_finish_info(dset, message):
             )
         recs = load_stream(record_path, compressed=True)
         runinfo = next(recs)
-    if "cmd" not in runinfo:
+    if isinstance(runinfo, list):
+        # several jobs finished in one commit
+        if not runinfo or any(
+            not isinstance(info, dict) or "cmd" not in info for info in runinfo
+        ):
+            raise ValueError("Looks like a finish commit but does not have a command")
+    elif "cmd" not in runinfo:
         raise ValueError("Looks like a finish commit but does not have a command")
     return rec_msg.rstrip(), runinfo
 
 
+def split_finish_info(rec_msg, runinfo):
+    """
+    Split the information from `get_finish_info` into one entry per job.
+
+    A commit of several finished jobs has one 'Slurm job <id>: <status>' line
+    per job, followed by the common message, and a list of run records which
+    carry the schedule messages of the jobs as 'run_message'. For each job,
+    this returns the message and run record as if it had been committed on
+    its own.
+
+    Parameters
+    ----------
+    rec_msg : str
+        The commit message part from `get_finish_info`.
+    runinfo : dict or list of dict
+        The run record(s) from `get_finish_info`.
+
+    Returns
+    -------
+    list of tuple
+        (str, dict) The message and run record of each job.
+    """
+    if isinstance(runinfo, dict):
+        return [(rec_msg, runinfo)]
+
+    status_lines = {}
+    lines = rec_msg.split("\n")
+    n = 0
+    for n, line in enumerate(lines):
+        match = re.match(r"Slurm job (\S+): ", line)
+        if not match:
+            break
+        status_lines[match.group(1)] = line
+    else:
+        n = len(lines)
+    common_msg = "\n".join(lines[n:]).strip()
+
+    infos = []
+    for info in runinfo:
+        info = dict(info)
+        job_msg = status_lines.get(str(info.get("slurm_job_id")), "")
+        for part in (common_msg, info.pop("run_message", None)):
+            if part:
+                job_msg += f"\n\n{part}"
+        infos.append((job_msg.strip(), info))
+    return infos
+
+
+def parse_job_status(text):
+    # Find the first line that starts with "Slurm job"
+    for line in text.split('\n'):
+        if line.startswith('Slurm job'):
+            # Split by colon and get everything after it
+            status = line.split(':')[1].strip()
+            if status == "Completed":
+                return False
+            else:
+                return True
+    
+    # Return None if no matching line is found
+    return None
+
+
+def iter_commits(dset, revrange, exclude=()):
+    """
+    Read the commits of a revision range with a single git process.
+
+    The commits are parsed while `git log` writes them, so the first commit
+    is available right away and the range is never held in memory as a
+    whole.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset object containing the repository.
+    revrange : str
+        The revision range to read, oldest commit first.
+    exclude : list of str, optional
+        Commits whose history is left out of the range.
+
+    Yields
+    ------
+    tuple
+        The commit hash, the list of parent hashes and the commit message.
+
+    Raises
+    ------
+    ValueError
+        If git cannot read the revision range.
+    """
+    proc = subprocess.Popen(
+        [
+            "git",
+            "log",
+            "-z",
+            "--reverse",
+            "--topo-order",
+            "--format=%H%x00%P%x00%B",
+            revrange,
+        ]
+        + (["--not"] + list(exclude) if exclude else [])
+        + ["--"],
+        cwd=dset.path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        # with -z, all fields and the commits themselves are separated by NUL
+        fields = []
+        tail = b""
+        while True:
+            chunk = proc.stdout.read(1 << 16)
+            if not chunk:
+                break
+            parts = (tail + chunk).split(b"\0")
+            tail = parts.pop()
+            for part in parts:
+                fields.append(part)
+                if len(fields) == 3:
+                    yield _parse_commit_fields(fields)
+                    fields = []
+        if tail or fields:
+            fields.append(tail)
+            yield _parse_commit_fields(fields)
+
+        stderr = proc.stderr.read().decode(errors="replace")
+        if proc.wait() != 0:
+            if "does not have any commits" in stderr:
+                return
+            raise ValueError(
+                "Cannot read revision range {}: {}".format(revrange, stderr.strip())
+            )
+    finally:
+        if proc.poll() is None:
+            # the caller stopped early
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def _parse_commit_fields(fields):
+    rev, parents, msg = (field.decode(errors="replace") for field in fields)
+    return rev, parents.split(), msg
+
+
+def iter_revisions(dset, revrange):
+    """
+    Read the commit hashes of a revision range, oldest commit first.
+
+    Like `iter_commits`, but without the commit messages.
+
+    Raises
+    ------
+    ValueError
+        If git cannot read the revision range.
+    """
+    proc = subprocess.Popen(
+        ["git", "rev-list", "--reverse", "--topo-order", revrange, "--"],
+        cwd=dset.path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        for line in proc.stdout:
+            yield line.strip()
+        stderr = proc.stderr.read()
+        if proc.wait() != 0:
+            raise ValueError(
+                "Cannot read revision range {}: {}".format(revrange, stderr.strip())
+            )
+    finally:
+        if proc.poll() is None:
+            # the caller stopped early
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+_RUN_MESSAGE = """\
+[DATALAD SLURM RUN] {}
+
+=== Do not change lines below ===
+{}
+^^^ Do not change lines above ^^^
+        """
+
+
+def format_run_message(dset, message_entry, records):
+    """
+    Return the message of a `[DATALAD SLURM RUN]` commit.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset.
+    message_entry : str
+        The message above the run record(s), starting with the
+        'Slurm job <id>: <status>' line(s).
+    records : dict or list of dict
+        The run record, or the run records of several jobs.
+    """
+    # create the run record, either as a string, or written to a file
+    # depending on the config/request
+    # TODO sidecar param
+    record, record_path = _create_record(records, False, dset)
+    return _RUN_MESSAGE.format(
+        message_entry,
+        '"{}"'.format(record) if record_path else record,
+    )
+
+
+def get_spool_dir(dset):
+    """
+    Return the directory in which jobs leave their completion markers.
+
+    This is the `datalad.slurm.spool-dir` config, relative to the dataset
+    root, by default `.git/datalad-slurm/markers`. It has to be accessible
+    from the compute nodes.
+    """
+    spool_dir = dset.config.get(
+        "datalad.slurm.spool-dir", op.join(".git", "datalad-slurm", "markers")
+    )
+    return op.join(dset.path, op.expanduser(spool_dir))
+
+
+def get_input_ids(dset, jobs):
+    """
+    Return content identities of the inputs of jobs.
+
+    The identity of an input is a digest over the mode, blob id and path of
+    every file in the index that it matches. For annexed files the blob is
+    the symlink or pointer file, which contains the annex key, so it changes
+    with the content as well. The index and the status of the worktree are
+    read with a single `git ls-files` for all jobs.
+
+    An input has no identity (None) if its content is not known from the
+    index: if it matches nothing in the index, or a file which is modified,
+    deleted or untracked in the worktree, or a subdataset, or is in a
+    subdataset or outside of the dataset. Such an input has to be taken as
+    changed.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset.
+    jobs : list of tuple
+        For each job, the directory its inputs are relative to (relative to
+        the dataset root) and its list of inputs.
+
+    Returns
+    -------
+    list of dict
+        For each job, a mapping of each input to its identity or None.
+    """
+    specs = []
+    for pwd, inputs in jobs:
+        job = []
+        for inp in inputs:
+            path = op.relpath(
+                op.normpath(op.join(dset.path, pwd or op.curdir, inp)), dset.path
+            )
+            # files outside of the dataset have no identity
+            job.append((inp, None if path.startswith(op.pardir) else path))
+        specs.append(job)
+    pathspecs = list(
+        dict.fromkeys(path for job in specs for _, path in job if path is not None)
+    )
+    in_subdataset = set()
+    # path -> index entry, and the paths which differ in the worktree
+    entries, unknown = {}, set()
+    while pathspecs:
+        # tagged as H(cached), C(hanged), R(emoved) or ?(untracked)
+        proc = subprocess.run(
+            ["git", "ls-files", "-z", "-t", "-s", "-c", "-m", "-d", "-o"]
+            + ["--exclude-standard", "--"]
+            + pathspecs,
+            cwd=dset.path,
+            capture_output=True,
+        )
+        match = re.search(
+            r"[Pp]athspec '(.*)' is in submodule", proc.stderr.decode(errors="replace")
+        )
+        if proc.returncode and match and match.group(1) in pathspecs:
+            in_subdataset.add(match.group(1))
+            pathspecs.remove(match.group(1))
+            continue
+        if proc.returncode:
+            raise subprocess.CalledProcessError(
+                proc.returncode, proc.args, proc.stdout, proc.stderr
+            )
+        for line in proc.stdout.split(b"\0"):
+            if not line:
+                continue
+            tag, entry = line.split(b" ", 1)
+            path = entry.split(b"\t", 1)[-1].decode(errors="replace")
+            # neither is the content of a subdataset or a merge conflict
+            if tag == b"H" and re.match(rb"(?!160000 )\d+ \w+ 0\t", entry):
+                entries[path] = entry
+            else:
+                unknown.add(path)
+        break
+    paths = sorted(entries)
+    unknown_paths = sorted(unknown)
+
+    def matching(spec, sorted_paths):
+        if spec == op.curdir:
+            return sorted_paths
+        magic = re.search(r"[*?[]", spec)
+        prefix = spec[: magic.start()] if magic else spec
+        candidates = sorted_paths[
+            bisect.bisect_left(sorted_paths, prefix) : bisect.bisect_left(
+                sorted_paths, prefix + "\U0010ffff"
+            )
+        ]
+        if magic:
+            # like the default git pathspec, '*' also matches '/'
+            return [path for path in candidates if fnmatch.fnmatchcase(path, spec)]
+        return [
+            path
+            for path in candidates
+            if path == spec or path.startswith(spec + "/")
+        ]
+
+    ids = {}
+    for spec in {spec for job in specs for _, spec in job}:
+        if (
+            spec is None
+            or spec in in_subdataset
+            or matching(spec, unknown_paths)
+        ):
+            ids[spec] = None
+            continue
+        matched = matching(spec, paths)
+        if not matched:
+            ids[spec] = None
+            continue
+        digest = hashlib.sha1()
+        for path in matched:
+            digest.update(entries[path] + b"\0")
+        ids[spec] = digest.hexdigest()
+    return [{inp: ids[spec] for inp, spec in job} for job in specs]
+
+
+def update_run_index(dset, rev="HEAD"):
+    """
+    Add the run records committed since the last update to the run index.
+
+    Errors are only logged, the index is a cache of the history and can be
+    brought up to date by a later call.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset.
+    rev : str, optional
+        The commit whose history is indexed, default HEAD.
+    """
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return
+    try:
+        _update_run_index(dset, con, rev)
+    except (sqlite3.Error, ValueError) as e:
+        lgr.debug("Cannot update the run index: %s", e)
+    finally:
+        con.close()
+
+
+def _update_run_index(dset, con, rev):
+    """
+    Index the history of `rev` that was not indexed yet.
+
+    The index remembers the tips of the histories it covers. Only the
+    commits which are not reachable from any of them are read, in one pass,
+    and the tips are then reduced to the ones which are not reachable from
+    the others. Since commits never change, the run records of a commit stay
+    valid when a branch moves away from it.
+
+    The update runs in a single exclusive transaction, so that concurrent
+    processes neither number their records alike nor drop each other's tips.
+
+    Returns
+    -------
+    str or None
+        The commit `rev` resolves to, None if it does not resolve to one.
+    """
+    sha = _rev_parse(dset, rev)
+    if not sha:
+        return None
+    if con.execute("SELECT 1 FROM run_index_tips WHERE tip = ?", (sha,)).fetchone():
+        return sha
+
+    isolation_level = con.isolation_level
+    con.isolation_level = None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            _index_history(dset, con, sha)
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+    finally:
+        con.isolation_level = isolation_level
+    return sha
+
+
+def _index_history(dset, con, sha):
+    """Index the commits of the history of `sha` which are not indexed yet."""
+    # another process might have indexed them in the meantime
+    tips = [row[0] for row in con.execute("SELECT tip FROM run_index_tips")]
+    if sha in tips:
+        return
+    if tips:
+        # tips might have been garbage collected, e.g. after a rebase
+        out = subprocess.run(
+            ["git", "cat-file", "--batch-check=%(objectname) %(objecttype)"],
+            cwd=dset.path,
+            input="\n".join(tips) + "\n",
+            capture_output=True,
+            text=True,
+        ).stdout
+        tips = [line.split()[0] for line in out.splitlines() if line.endswith(" commit")]
+
+    seq = con.execute("SELECT COALESCE(MAX(seq), 0) FROM run_records").fetchone()[0]
+    records = []
+    outputs = []
+    for commit, parents, msg in iter_commits(dset, sha, exclude=tips):
+        for job_index, rec in enumerate(_get_run_records(dset, commit, parents, msg)):
+            seq += 1
+            info = rec["slurm_run_info"] or {}
+            records.append(
+                (
+                    commit,
+                    job_index,
+                    seq,
+                    json.dumps(parents),
+                    # a reused result has the job id of the run it reused
+                    None if info.get("reused_from") else info.get("slurm_job_id"),
+                    rec["run_message"],
+                    None if rec["job_failed"] is None else int(rec["job_failed"]),
+                    info.get("cmd"),
+                    json.dumps(info.get("inputs") or []),
+                    json.dumps(info.get("outputs") or []),
+                    info.get("cache_key"),
+                    None if rec["error"] else json.dumps(info),
+                    rec["error"],
+                )
+            )
+            pwd = info.get("pwd") or op.curdir
+            outputs.extend(
+                (_normalize_output(pwd, output), commit, job_index)
+                for output in info.get("outputs") or []
+            )
+
+    con.executemany(
+        "INSERT OR REPLACE INTO run_records (commit_sha, job_index, seq, parents, "
+        "slurm_job_id, run_message, job_failed, cmd, inputs, outputs, cache_key, "
+        "record, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        records,
+    )
+    con.executemany(
+        "INSERT OR IGNORE INTO run_record_outputs (path, commit_sha, job_index) "
+        "VALUES (?, ?, ?)",
+        outputs,
+    )
+    tips = subprocess.run(
+        ["git", "merge-base", "--independent", sha] + tips,
+        cwd=dset.path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    con.execute("DELETE FROM run_index_tips")
+    con.executemany("INSERT INTO run_index_tips (tip) VALUES (?)", [(t,) for t in tips])
+
+
+def _get_run_records(dset, commit, parents, msg):
+    """Return the run records in the message of a commit, see `iter_run_records`."""
+    try:
+        rec_msg, info = get_finish_info(dset, msg)
+    except ValueError as e:
+        # the error is reported when the record is needed
+        return [
+            dict(
+                commit=commit,
+                parents=parents,
+                run_message=None,
+                job_failed=None,
+                slurm_run_info=None,
+                error=str(e),
+            )
+        ]
+    if info is None:
+        return []
+    return [
+        dict(
+            commit=commit,
+            parents=parents,
+            run_message=job_msg,
+            job_failed=parse_job_status(job_msg),
+            slurm_run_info=job_info,
+            error=None,
+        )
+        for job_msg, job_info in split_finish_info(rec_msg, info)
+    ]
+
+
+def _rev_parse(dset, rev):
+    return subprocess.run(
+        ["git", "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}"],
+        cwd=dset.path,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def _normalize_output(pwd, output):
+    # outputs relative to the dataset root, "." for the whole dataset
+    return op.normpath(op.join(pwd, output)).replace(op.sep, "/")
+
+
+def _get_ancestors(dset, commits, rev):
+    """Return those of the `commits` which are in the history of `rev`.
+
+    A single `git rev-list` walks the history, until all of them are found.
+    """
+    wanted = set(commits)
+    found = set()
+    if not wanted:
+        return found
+    with subprocess.Popen(
+        ["git", "rev-list", rev],
+        cwd=dset.path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    ) as proc:
+        for line in proc.stdout:
+            if line.strip() in wanted:
+                found.add(line.strip())
+                if found == wanted:
+                    break
+        if proc.poll() is None:
+            proc.kill()
+    return found
+
+
+def _row_to_record(row):
+    commit, parents, run_message, job_failed, record, error = row
+    return dict(
+        commit=commit,
+        parents=json.loads(parents),
+        run_message=run_message,
+        job_failed=None if job_failed is None else bool(job_failed),
+        slurm_run_info=None if record is None else json.loads(record),
+        error=error,
+    )
+
+
+_RECORD_FIELDS = "r.commit_sha, r.parents, r.run_message, r.job_failed, r.record, r.error"
+
+
+def iter_run_records(dset, revrange, rev):
+    """
+    Read the run records of a revision range from the run index.
+
+    The index is brought up to date with the history of `rev` first, which
+    has to contain the whole range. Only the list of commits in the range is
+    then read from git, the run records come from the index. Without the
+    database, the run records are read from the commit messages instead.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset.
+    revrange : str
+        The revision range to read, oldest commit first.
+    rev : str
+        The commit the range ends at.
+
+    Yields
+    ------
+    dict
+        Per job of each finish commit in the range: the 'commit', its
+        'parents', the 'run_message' and 'slurm_run_info' of the job and
+        whether the job failed ('job_failed', None if unknown). If the run
+        record of a commit cannot be read, a single entry with an 'error'
+        message and without 'slurm_run_info' is yielded for it.
+
+    Raises
+    ------
+    ValueError
+        If git cannot read the revision range.
+    """
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        # read the run records from the history itself
+        for commit, parents, msg in iter_commits(dset, revrange):
+            yield from _get_run_records(dset, commit, parents, msg)
+        return
+    try:
+        if not _update_run_index(dset, con, rev):
+            return
+        run_commits = {
+            row[0] for row in con.execute("SELECT DISTINCT commit_sha FROM run_records")
+        }
+        for commit in iter_revisions(dset, revrange):
+            if commit not in run_commits:
+                continue
+            records = [
+                _row_to_record(row)
+                for row in con.execute(
+                    f"SELECT {_RECORD_FIELDS} FROM run_records r "
+                    "WHERE commit_sha = ? ORDER BY job_index",
+                    (commit,),
+                ).fetchall()
+            ]
+            if records[0]["error"]:
+                # e.g. a missing sidecar file of the run record might have
+                # been restored in the meantime, read the message again
+                msg = subprocess.run(
+                    ["git", "show", "-s", "--format=%B", commit],
+                    cwd=dset.path,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                records = _get_run_records(dset, commit, records[0]["parents"], msg)
+            yield from records
+    finally:
+        con.close()
+
+
+def find_run_records(dset, path=None, slurm_job_id=None, rev="HEAD"):
+    """
+    Look up the run records of the jobs which wrote a path or had a job id.
+
+    Both lookups are indexed queries on the run index, which is brought up
+    to date with the history of `rev` first.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset.
+    path : str, optional
+        A path relative to the dataset root. Jobs with this path or one of
+        its parent directories among their outputs are found.
+    slurm_job_id : int or str, optional
+        A Slurm job id. Only the run of the job is found, not later runs
+        which reused its result (see `--reuse` of `slurm-schedule`).
+    rev : str, optional
+        Only jobs in the history of this commit are found, default HEAD.
+
+    Returns
+    -------
+    list of dict
+        The records as yielded by `iter_run_records`, latest job first.
+    """
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return []
+    try:
+        sha = _update_run_index(dset, con, rev)
+        if not sha:
+            return []
+        query = f"SELECT {_RECORD_FIELDS} FROM run_records r"
+        where, args = [], []
+        if path is not None:
+            # the path itself and all of its parent directories
+            candidates = [op.curdir]
+            parts = _normalize_output(op.curdir, path).split("/")
+            candidates += ["/".join(parts[: n + 1]) for n in range(len(parts))]
+            query += (
+                " JOIN run_record_outputs o ON o.commit_sha = r.commit_sha "
+                "AND o.job_index = r.job_index"
+            )
+            where.append(
+                "o.path IN ({})".format(", ".join("?" * len(candidates)))
+            )
+            args += candidates
+        if slurm_job_id is not None:
+            where.append("r.slurm_job_id = ?")
+            args.append(int(slurm_job_id))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        rows = con.execute(query + " ORDER BY r.seq DESC", args).fetchall()
+    finally:
+        con.close()
+    ancestors = _get_ancestors(dset, [row[0] for row in rows], sha)
+    return [_row_to_record(row) for row in rows if row[0] in ancestors]
+
+
+def lookup_result_cache(dset, cache_key):
+    """
+    Find the latest successful run of a job with the given cache key.
+
+    The run index is brought up to date with the history of HEAD first (see
+    `update_run_index`), and only runs in that history are considered.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset.
+    cache_key : str
+        The 'cache_key' of a run record.
+
+    Returns
+    -------
+    tuple or None
+        The commit and the run record of the run, or None if there is none or
+        the database cannot be opened.
+    """
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return None
+    try:
+        head = _update_run_index(dset, con, "HEAD")
+        rows = con.execute(
+            "SELECT commit_sha, record FROM run_records "
+            "WHERE cache_key = ? AND job_failed = 0 "
+            "AND json_array_length(parents) = 1 ORDER BY seq DESC",
+            (cache_key,),
+        ).fetchall()
+    finally:
+        con.close()
+    if not head:
+        return None
+    ancestors = _get_ancestors(dset, [commit for commit, _ in rows], head)
+    for commit, record in rows:
+        if commit in ancestors:
+            return commit, json.loads(record)
+    return None
+
+
+# see https://www.sqlite.org/pragma.html#pragma_journal_mode
+_JOURNAL_MODES = ("delete", "truncate", "persist", "memory", "wal", "off")
+
+
+def get_db_busy_timeout(dset):
+    """
+    Return the seconds to wait for a database lock held by another process.
+
+    This is the `datalad.slurm.db-busy-timeout` config, default 60.
+
+    Raises
+    ------
+    ValueError
+        If the config is not a number of seconds.
+    """
+    value = dset.config.get("datalad.slurm.db-busy-timeout", 60)
+    try:
+        busy_timeout = float(value)
+    except (TypeError, ValueError):
+        busy_timeout = None
+    # also rejects NaN
+    if busy_timeout is None or not busy_timeout >= 0:
+        raise ValueError(
+            f"Invalid datalad.slurm.db-busy-timeout {value!r}, use a number of "
+            "seconds"
+        )
+    return busy_timeout
+
+
 def connect_to_database(dset, row_factory=False):
     """
     Connect to sqlite3 database and return the connection and cursor.
@@ -83,16 +864,36 @@ def connect_to_database(dset, row_factory=False):
 
     Notes
     -----
-    Database path is constructed from dataset ID and branch in .git directory
+    Database path is constructed from dataset ID and branch in .git directory.
+    The database is opened with the journal mode from the
+    `datalad.slurm.db-journal-mode` config (default "wal") and waits up to
+    `datalad.slurm.db-busy-timeout` seconds (default 60) for locks held by
+    concurrent datalad-slurm processes. The schema is created or migrated to
+    the current version if necessary.
     """
     # define the database path from the dataset and branch
     ds_repo = dset.repo
     db_name = f"{dset.id}.db"
     db_path = dset.pathobj / ".git" / db_name
 
+    journal_mode = dset.config.get("datalad.slurm.db-journal-mode", "wal")
+    try:
+        busy_timeout = get_db_busy_timeout(dset)
+        if journal_mode.lower() not in _JOURNAL_MODES:
+            raise ValueError(
+                f"Invalid datalad.slurm.db-journal-mode {journal_mode!r}, use one "
+                f"of {', '.join(_JOURNAL_MODES)}"
+            )
+    except ValueError as e:
+        lgr.error("%s", e)
+        return None, None
+
     # try to connect to the database
     try:
-        con = sqlite3.connect(db_path)
+        con = sqlite3.connect(db_path, timeout=busy_timeout)
+        con.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        con.execute(f"PRAGMA journal_mode = {journal_mode}")
+        ensure_schema(con)
         if row_factory:
             con.row_factory = lambda cursor, row: row[0]
         cur = con.cursor()
@@ -100,3 +901,237 @@ def connect_to_database(dset, row_factory=False):
         return None, None
 
     return con, cur
+
+
+def ensure_schema(con):
+    """
+    Create the database schema or migrate it to `SCHEMA_VERSION`.
+
+    The schema version is kept in the `user_version` pragma. Databases from
+    before versioning have version 0, whether they already contain tables
+    or not. Migrations run in a single exclusive transaction, so concurrent
+    processes never see a half migrated database.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+           Connection to the database
+    """
+    if con.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    isolation_level = con.isolation_level
+    con.isolation_level = None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            # another process might have migrated in the meantime
+            version = con.execute("PRAGMA user_version").fetchone()[0]
+            for migrate in _MIGRATIONS[version:SCHEMA_VERSION]:
+                migrate(con)
+            con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+    finally:
+        con.isolation_level = isolation_level
+
+
+def _table_exists(con, table):
+    return bool(
+        con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+    )
+
+
+def _migrate_to_v1(con):
+    """Add primary keys and indexes, keeping the jobs of an unversioned database."""
+    for table in ("open_jobs", "locked_names", "locked_prefixes"):
+        if _table_exists(con, table):
+            con.execute(f"ALTER TABLE {table} RENAME TO {table}_v0")
+
+    con.execute(
+        """
+    CREATE TABLE open_jobs (
+    slurm_job_id INTEGER PRIMARY KEY,
+    message TEXT,
+    chain TEXT CHECK (json_valid(chain)),
+    cmd TEXT,
+    dsid TEXT,
+    inputs TEXT CHECK (json_valid(inputs)),
+    extra_inputs TEXT CHECK (json_valid(extra_inputs)),
+    outputs TEXT CHECK (json_valid(outputs)),
+    slurm_outputs TEXT CHECK (json_valid(slurm_outputs)),
+    pwd TEXT,
+    alt_dir TEXT
+    )
+    """
+    )
+    # the primary keys serve the lookups by job, the extra indexes the
+    # lookups by path in the output conflict check
+    con.execute(
+        """
+    CREATE TABLE locked_names (
+    slurm_job_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (slurm_job_id, name)
+    ) WITHOUT ROWID
+    """
+    )
+    con.execute("CREATE INDEX locked_names_name ON locked_names (name)")
+    con.execute(
+        """
+    CREATE TABLE locked_prefixes (
+    slurm_job_id INTEGER NOT NULL,
+    prefix TEXT NOT NULL,
+    PRIMARY KEY (slurm_job_id, prefix)
+    ) WITHOUT ROWID
+    """
+    )
+    con.execute("CREATE INDEX locked_prefixes_prefix ON locked_prefixes (prefix)")
+
+    if _table_exists(con, "open_jobs_v0"):
+        # older databases might lack some of the columns, e.g. alt_dir
+        columns = ", ".join(
+            row[1] for row in con.execute("PRAGMA table_info(open_jobs_v0)")
+        )
+        con.execute(
+            f"INSERT OR REPLACE INTO open_jobs ({columns}) "
+            f"SELECT {columns} FROM open_jobs_v0"
+        )
+        con.execute("DROP TABLE open_jobs_v0")
+    if _table_exists(con, "locked_names_v0"):
+        con.execute(
+            "INSERT OR IGNORE INTO locked_names SELECT slurm_job_id, name "
+            "FROM locked_names_v0 WHERE name IS NOT NULL"
+        )
+        con.execute("DROP TABLE locked_names_v0")
+    if _table_exists(con, "locked_prefixes_v0"):
+        con.execute(
+            "INSERT OR IGNORE INTO locked_prefixes SELECT slurm_job_id, prefix "
+            "FROM locked_prefixes_v0 WHERE prefix IS NOT NULL"
+        )
+        con.execute("DROP TABLE locked_prefixes_v0")
+
+
+def _migrate_to_v2(con):
+    """Add the output reservations of jobs which are being submitted."""
+    con.execute(
+        """
+    CREATE TABLE reservations (
+    reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    host TEXT,
+    pid INTEGER,
+    created REAL
+    )
+    """
+    )
+
+
+def _migrate_to_v3(con):
+    """Add the sbatch output file patterns of jobs with deferred job info."""
+    con.execute("ALTER TABLE open_jobs ADD COLUMN slurm_output_templates TEXT")
+
+
+def _migrate_to_v4(con):
+    """Add the submission time of jobs, to bound the sacct queries."""
+    con.execute("ALTER TABLE open_jobs ADD COLUMN submit_time REAL")
+
+
+def _migrate_to_v5(con):
+    """Add the cache of the job states reported by Slurm."""
+    con.execute(
+        """
+    CREATE TABLE job_state_cache (
+    slurm_job_id INTEGER PRIMARY KEY,
+    states TEXT NOT NULL CHECK (json_valid(states)),
+    terminal INTEGER NOT NULL,
+    updated REAL NOT NULL
+    )
+    """
+    )
+
+
+def _migrate_to_v6(con):
+    """Add the completion markers which jobs leave in the spool directory."""
+    con.execute(
+        "ALTER TABLE open_jobs ADD COLUMN completion_markers TEXT "
+        "CHECK (completion_markers IS NULL OR json_valid(completion_markers))"
+    )
+
+
+def _migrate_to_v7(con):
+    """Add the run record fields which have no column of their own."""
+    con.execute(
+        "ALTER TABLE open_jobs ADD COLUMN extra_info TEXT "
+        "CHECK (extra_info IS NULL OR json_valid(extra_info))"
+    )
+
+
+def _migrate_to_v8(con):
+    """Add the run index of the history, see `update_run_index`."""
+    con.execute(
+        """
+    CREATE TABLE run_records (
+    commit_sha TEXT NOT NULL,
+    job_index INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    parents TEXT NOT NULL CHECK (json_valid(parents)),
+    slurm_job_id INTEGER,
+    run_message TEXT,
+    job_failed INTEGER,
+    cmd TEXT,
+    inputs TEXT CHECK (inputs IS NULL OR json_valid(inputs)),
+    outputs TEXT CHECK (outputs IS NULL OR json_valid(outputs)),
+    cache_key TEXT,
+    record TEXT CHECK (record IS NULL OR json_valid(record)),
+    error TEXT,
+    PRIMARY KEY (commit_sha, job_index)
+    ) WITHOUT ROWID
+    """
+    )
+    con.execute("CREATE INDEX run_records_slurm_job_id ON run_records (slurm_job_id)")
+    con.execute("CREATE INDEX run_records_cache_key ON run_records (cache_key)")
+    con.execute("CREATE INDEX run_records_seq ON run_records (seq)")
+    # the outputs of the jobs relative to the dataset root
+    con.execute(
+        """
+    CREATE TABLE run_record_outputs (
+    path TEXT NOT NULL,
+    commit_sha TEXT NOT NULL,
+    job_index INTEGER NOT NULL,
+    PRIMARY KEY (path, commit_sha, job_index)
+    ) WITHOUT ROWID
+    """
+    )
+    # the commits whose histories are indexed
+    con.execute(
+        """
+    CREATE TABLE run_index_tips (
+    tip TEXT PRIMARY KEY
+    ) WITHOUT ROWID
+    """
+    )
+
+
+def _migrate_to_v9(con):
+    """Add the stage-out jobs which move the outputs back from an alt-dir."""
+    con.execute("ALTER TABLE open_jobs ADD COLUMN stage_out_job_id INTEGER")
+
+
+# _MIGRATIONS[n] migrates a database from version n to version n + 1
+_MIGRATIONS = [
+    _migrate_to_v1,
+    _migrate_to_v2,
+    _migrate_to_v3,
+    _migrate_to_v4,
+    _migrate_to_v5,
+    _migrate_to_v6,
+    _migrate_to_v7,
+    _migrate_to_v8,
+    _migrate_to_v9,
+]
+
+SCHEMA_VERSION = len(_MIGRATIONS)
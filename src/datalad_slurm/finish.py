@@ -4,8 +4,15 @@ __docformat__ = "restructuredtext"
 
 import json
 import logging
+import os
+import re
+import sqlite3
+import shutil
 import subprocess
+import time
 import os.path as op
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from datalad.core.local.save import Save
 from datalad.distribution.dataset import (
@@ -22,6 +29,7 @@ from datalad.interface.common_opts import (
 )
 from datalad.interface.results import get_status_dict
 from datalad.support.constraints import (
+    EnsureInt,
     EnsureNone,
     EnsureStr,
 )
@@ -32,12 +40,65 @@ from datalad.utils import (
     ensure_list,
 )
 
-from .common import connect_to_database
+from .common import (
+    connect_to_database,
+    format_run_message,
+    get_db_busy_timeout,
+    get_spool_dir,
+    update_run_index,
+)
+from .schedule import (
+    resolve_slurm_output_files,
+    update_open_job,
+)
+from .staging import (
+    MANIFEST_NAME,
+    collect_paths,
+    connect_to_manifest,
+    format_size,
+    release_staging_refs,
+)
 
-from datalad.core.local.run import _create_record, get_command_pwds
+from datalad.core.local.run import get_command_pwds
 
 lgr = logging.getLogger("datalad.slurm.finish")
 
+# columns of the open jobs table which don't go into the run record
+_DB_ONLY_COLUMNS = (
+    "slurm_output_templates",
+    "submit_time",
+    "completion_markers",
+    "stage_out_job_id",
+)
+
+# number of job ids per sacct/squeue call
+_STATUS_QUERY_CHUNK_SIZE = 500
+
+# job states which don't change anymore
+_TERMINAL_STATES = {
+    "BOOT_FAIL",
+    "CANCELLED",
+    "COMPLETED",
+    "DEADLINE",
+    "FAILED",
+    "NODE_FAIL",
+    "OUT_OF_MEMORY",
+    "PREEMPTED",
+    "TIMEOUT",
+}
+
+# seconds between two scans of the spool directory for completion markers
+_SPOOL_SCAN_INTERVAL = 5
+
+# squeue states of jobs which are about to run or still wrapping up
+_SQUEUE_RUNNING_STATES = {
+    "CONFIGURING",
+    "COMPLETING",
+    "RESIZING",
+    "SIGNALING",
+    "STAGE_OUT",
+}
+
 
 class Finish(Interface):
     """Finishes (i.e. saves outputs) a slurm submitted job."""
@@ -110,12 +171,43 @@ class Finish(Interface):
         branches=Parameter(
             args=("--branches",),
             action="store_true",
-            doc="""Commit results of jobs into individual branches.""",
+            doc="""Commit results of jobs into individual branches. The
+            commits are made in a separate worktree, so the checked out
+            branch is never switched.""",
         ),
         octopus=Parameter(
             args=("--octopus",),
             action="store_true",
-            doc="""Commit results of jobs into individual branches and do an octopus merge afterwards.""",
+            doc="""Commit results of jobs into individual branches and do an octopus merge afterwards.
+            Many branches are merged in a tree of merge commits with at most
+            `datalad.slurm.merge-fan-in` (default 16) branches each.""",
+        ),
+        group_size=Parameter(
+            args=("--group-size",),
+            metavar="N",
+            doc="""Commit the outputs of up to N finished jobs together in one
+            commit, whose message lists the run records of all of them. The
+            jobs can still be rescheduled individually. This is much faster
+            than one commit per job when finishing many jobs.""",
+            constraints=EnsureInt() | EnsureNone(),
+        ),
+        single_commit=Parameter(
+            args=("--single-commit",),
+            action="store_true",
+            doc="""Commit the outputs of all finished jobs in a single commit,
+            like --group-size with an unlimited group size.""",
+        ),
+        watch=Parameter(
+            args=("--watch",),
+            action="store_true",
+            doc="""Keep running and finish the open jobs as soon as they end,
+            applying the --close-failed-jobs and --commit-failed-jobs policies.
+            Slurm is polled for all jobs at once, at intervals between
+            `datalad.slurm.watch-min-interval` (default 10) and
+            `datalad.slurm.watch-max-interval` (default 300) seconds, waiting
+            longer while nothing changes. Stops when no open jobs are left,
+            or when the remaining ones can't be finished (failed jobs without
+            --close-failed-jobs, or jobs unknown to Slurm).""",
         ),
         jobs=jobs_opt,
     )
@@ -135,12 +227,47 @@ class Finish(Interface):
         list_open_jobs=False,
         branches=False,
         octopus=False,
+        group_size=None,
+        single_commit=False,
+        watch=False,
         jobs=None,
     ):
         ds = require_dataset(
             dataset, check_installed=True, purpose="finish a SLURM job"
         )
 
+        if (group_size or single_commit) and (branches or octopus or outputs):
+            yield get_status_dict(
+                "slurm-finish",
+                ds=ds,
+                status="impossible",
+                message=(
+                    "--group-size and --single-commit cannot be combined with "
+                    "--branches, --octopus or outputs."
+                ),
+            )
+            return
+        if group_size is not None and group_size < 1:
+            yield get_status_dict(
+                "slurm-finish",
+                ds=ds,
+                status="impossible",
+                message="--group-size must be at least 1.",
+            )
+            return
+
+        if watch and (list_open_jobs or outputs):
+            yield get_status_dict(
+                "slurm-finish",
+                ds=ds,
+                status="impossible",
+                message=(
+                    "--watch cannot be combined with --list-open-jobs "
+                    "or with outputs."
+                ),
+            )
+            return
+
         if outputs and not slurm_job_id:
             yield get_status_dict(
                 "slurm-finish",
@@ -171,48 +298,690 @@ class Finish(Interface):
         # TODO: triple list and multiple prints is a bit ugly, consider refactor
         if list_open_jobs:
             if slurm_job_id_list:
+                jobs_status = get_jobs_status(ds, slurm_job_id_list)
                 print("The following jobs are open: \n")
                 print(f"{'slurm-job-id':<14} {'slurm-job-status'}")
                 for i, slurm_job_id in enumerate(slurm_job_id_list):
-                    job_status = get_job_status(slurm_job_id)[1]
+                    job_status = jobs_status.get(str(slurm_job_id), (None, "UNKNOWN"))[1]
                     print(f"{slurm_job_id:<10} {job_status}")
             return
 
-        all_new_branches= []
+        finish_args = dict(
+            dataset=dataset,
+            message=message,
+            outputs=outputs,
+            explicit=explicit,
+            close_failed_jobs=close_failed_jobs,
+            commit_failed_jobs=commit_failed_jobs,
+            branches=branches,
+            octopus=octopus,
+            group_size=0 if single_commit else group_size,
+            jobs=jobs,
+        )
+
+        if watch:
+            results = watch_jobs(
+                ds, None if slurm_job_id is None else [slurm_job_id], **finish_args
+            )
+        else:
+            # look up the states of all jobs at once
+            jobs_status = get_jobs_status(ds, slurm_job_id_list)
+            results = _finish_jobs(ds, slurm_job_id_list, jobs_status, **finish_args)
+        for r in results:
+            yield r
+
+        # keep the run index in step with the new commits
+        update_run_index(ds)
+
+
+def _finish_jobs(
+    ds,
+    slurm_job_id_list,
+    jobs_status,
+    dataset=None,
+    message=None,
+    outputs=None,
+    explicit=True,
+    close_failed_jobs=False,
+    commit_failed_jobs=False,
+    branches=False,
+    octopus=False,
+    group_size=None,
+    jobs=None,
+):
+    """Finish the given jobs, see `Finish` for the parameters.
+
+    The jobs are prepared for their commits (see `prepare_finish`) by a pool
+    of `jobs` threads, while they are committed one after another in the
+    given order. A `group_size` of 0 commits all jobs together.
+    """
+    if not explicit:
+        yield _explicit_required_result(ds)
+        return
+
+    prepared_jobs = _prepare_jobs(
+        ds,
+        slurm_job_id_list,
+        jobs_status,
+        pool_size=_get_pool_size(jobs),
+        message=message,
+        close_failed_jobs=close_failed_jobs,
+        commit_failed_jobs=commit_failed_jobs,
+    )
+
+    if group_size is not None:
+        group = []
+        for slurm_job_id, results, prepared in prepared_jobs:
+            for r in results:
+                yield r
+            if prepared is None:
+                continue
+            group.append(prepared)
+            if len(group) == group_size:
+                for r in save_finished(ds, group, dataset=dataset, message=message):
+                    yield r
+                group = []
+        if group:
+            for r in save_finished(ds, group, dataset=dataset, message=message):
+                yield r
+        return
+
+    all_new_branches = []
+
+    for slurm_job_id, results, prepared in prepared_jobs:
+        for r in results:
+            yield r
+        if prepared is None:
+            continue
+
+        new_branch = None
+        if branches or octopus:
+            new_branch = f"slurm-job-branch-{slurm_job_id}"
+            all_new_branches.append(new_branch)
+
+        for r in save_finished(ds, [prepared], dataset=dataset, branch=new_branch):
+            yield r
+
+    if octopus and all_new_branches:
+
+        # Filter the branches in 'all_new_branches' against all existing branches because some may not exist
+        # ... they don't get created when finish_cmd() finds the job invalid
+        existing_branches = set(ds.repo.get_branches())
+        all_new_branches = [b for b in all_new_branches if b in existing_branches]
+        if not all_new_branches:
+            return
+
+        fan_in = int(ds.config.get("datalad.slurm.merge-fan-in", 16))
+        try:
+            merge_job_branches(ds, all_new_branches, fan_in)
+        except (RuntimeError, subprocess.CalledProcessError) as e:
+            yield get_status_dict(
+                "slurm-finish",
+                ds=ds,
+                status="error",
+                message=(
+                    "Cannot merge the branches of the finished jobs, "
+                    "they are kept: %s",
+                    getattr(e, "stderr", None) or e,
+                ),
+            )
+            return
+        delete_branches(ds, all_new_branches)
+
+
+def merge_job_branches(ds, branches, fan_in=16):
+    """
+    Merge the branches of finished jobs into the current branch.
+
+    Git's octopus merge does not cope with many heads, so the branches are
+    merged in a tree of merge commits with at most `fan_in` parents each (see
+    `_plan_merge_tree`). The job branches start at the current HEAD and
+    change distinct outputs. The tree of each intermediate merge commit is
+    therefore the tree of HEAD with the changes of all its job branches. It
+    is built in a temporary index, without touching the working tree. Only
+    the last merge of at most `fan_in` heads is done with `git merge`.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset.
+    branches : list of str
+        The branch names.
+    fan_in : int, optional
+        The maximum number of parents of a merge commit.
+
+    Raises
+    ------
+    RuntimeError
+        If two branches change the same path differently.
+    subprocess.CalledProcessError
+        If a git command fails.
+    """
+    fan_in = max(2, fan_in)
+    msg = "Merge all branches from finished jobs"
+    base = _git(ds, ["rev-parse", "HEAD"]).strip()
+
+    merges, top = _plan_merge_tree(branches, fan_in)
+    if merges:
+        commits = dict(
+            zip(branches, _git(ds, ["rev-parse"] + branches).split())
+        )
+        changes = _get_branch_changes(ds, base, commits)
+        # the job branches below each merge commit
+        leaves = {branch: [branch] for branch in branches}
+        index_file = op.join(ds.repo.dot_git, "datalad-slurm-merge-index")
+        env = dict(os.environ, GIT_INDEX_FILE=index_file)
+        try:
+            for name, children in merges:
+                leaves[name] = [leaf for child in children for leaf in leaves[child]]
+                _git(ds, ["read-tree", base], env=env)
+                _git(
+                    ds,
+                    ["update-index", "-z", "--index-info"],
+                    input="".join(
+                        changes[leaf] for leaf in leaves[name]
+                    ),
+                    env=env,
+                )
+                tree = _git(ds, ["write-tree"], env=env).strip()
+                parents = [arg for child in children for arg in ("-p", commits[child])]
+                commits[name] = _git(
+                    ds,
+                    ["commit-tree", tree] + parents + ["-m", f"{msg} ({name})"],
+                ).strip()
+        finally:
+            if op.exists(index_file):
+                os.unlink(index_file)
+        top = [commits[name] if name in commits else name for name in top]
+
+    # WORKAROUND the "-q" is a workaround for the current 'merge()' routine
+    # in datalad/datalad/support/gitrepo.py
+    # currently there are only one-way merges allowed if you call it like intended ... but if we
+    # use -q as 'name' and put all the branches into 'options' it will work fow now
+    ds.repo.merge("-q", top, msg=msg)
+
+
+def _plan_merge_tree(branches, fan_in):
+    """
+    Plan a tree of merges with at most `fan_in` parents each.
+
+    Parameters
+    ----------
+    branches : list of str
+        The branches to merge.
+    fan_in : int
+        The maximum number of parents of a merge.
+
+    Returns
+    -------
+    tuple
+        (list, list) The intermediate merges as (name, children) in the
+        order they have to be made, where the children are branches or the
+        names of earlier merges, and the at most `fan_in` heads of the final
+        merge.
+
+    Examples
+    --------
+    >>> _plan_merge_tree(["a", "b", "c", "d", "e"], 2)
+    ([('merge-1-1', ['a', 'b']), ('merge-1-2', ['c', 'd']), \
+('merge-2-1', ['merge-1-1', 'merge-1-2'])], ['merge-2-1', 'e'])
+    """
+    merges = []
+    heads = list(branches)
+    level = 0
+    while len(heads) > fan_in:
+        level += 1
+        next_heads = []
+        # as few merges as possible, a group of one is not merged
+        for n, i in enumerate(range(0, len(heads), fan_in)):
+            group = heads[i : i + fan_in]
+            if len(group) == 1:
+                next_heads.extend(group)
+                continue
+            name = f"merge-{level}-{n + 1}"
+            merges.append((name, group))
+            next_heads.append(name)
+        heads = next_heads
+    return merges, heads
+
+
+def _get_branch_changes(ds, base, commits):
+    """
+    Get the changes of each branch relative to `base` in one diff-tree call.
+
+    Returns
+    -------
+    dict
+        The branch name mapped to its changes in the input format of
+        `git update-index -z --index-info`.
+
+    Raises
+    ------
+    RuntimeError
+        If two branches change the same path differently.
+    """
+    names = {}
+    stdin = []
+    for branch, commit in commits.items():
+        names.setdefault(commit, []).append(branch)
+        stdin.append(f"{commit} {base}\n")
+    out = _git(
+        ds,
+        ["diff-tree", "--stdin", "-r", "-z", "--raw", "--no-renames"],
+        input="".join(stdin),
+    )
+
+    changes = {branch: [] for branch in commits}
+    changed_by = {}
+    current = []
+    fields = iter(out.split("\0"))
+    for field in fields:
+        if not field:
+            continue
+        if not field.startswith(":"):
+            # the commit which the following changes belong to
+            current = names.get(field.strip(), [])
+            continue
+        _, dst_mode, _, dst_sha, status = field[1:].split(" ")
+        path = next(fields)
+        if status == "D":
+            entry = f"0 {'0' * len(dst_sha)}\t{path}\0"
+        else:
+            entry = f"{dst_mode} {dst_sha}\t{path}\0"
+        if changed_by.setdefault(path, entry) != entry:
+            raise RuntimeError(f"'{path}' was changed differently by several jobs")
+        for branch in current:
+            changes[branch].append(entry)
+    return {branch: "".join(entries) for branch, entries in changes.items()}
+
+
+def delete_branches(ds, branches):
+    """Delete the branches in a single `git update-ref --stdin` call."""
+    _git(
+        ds,
+        ["update-ref", "--stdin"],
+        input="".join(f"delete refs/heads/{branch}\n" for branch in branches),
+    )
+
+
+def _git(ds, args, input=None, env=None):
+    """Run a git command in the dataset and return its output."""
+    return subprocess.run(
+        ["git"] + args,
+        cwd=ds.path,
+        input=input,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def _prepare_jobs(ds, slurm_job_id_list, jobs_status, pool_size=1, **kwargs):
+    """
+    Run `prepare_finish` for the jobs in a thread pool.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset with the jobs.
+    slurm_job_id_list : list
+        The Slurm job IDs.
+    jobs_status : dict
+        The known job states, see `get_jobs_status`.
+    pool_size : int, optional
+        The number of threads. With 1, the jobs are prepared one by one when
+        they are requested.
+    **kwargs
+        Passed on to `prepare_finish`.
 
+    Yields
+    ------
+    tuple
+        (job id, list of result records, prepared job or None), in the order
+        of `slurm_job_id_list`.
+    """
+    # the committer may change the working directory while jobs are prepared
+    pwd = os.getcwd()
+
+    def prepare(slurm_job_id):
+        gen = prepare_finish(
+            ds,
+            slurm_job_id,
+            job_status=jobs_status.get(str(slurm_job_id)),
+            pwd=pwd,
+            **kwargs,
+        )
+        results = []
+        while True:
+            try:
+                results.append(next(gen))
+            except StopIteration as stop:
+                return slurm_job_id, results, stop.value
+
+    if pool_size <= 1:
         for slurm_job_id in slurm_job_id_list:
+            yield prepare(slurm_job_id)
+        return
 
-            new_branch= None
-            if branches or octopus:
-                new_branch= f"slurm-job-branch-{slurm_job_id}"
-                all_new_branches.append(new_branch)
+    # keep a bounded number of jobs ahead of the committer
+    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+        pending = deque()
+        try:
+            for slurm_job_id in slurm_job_id_list:
+                pending.append(executor.submit(prepare, slurm_job_id))
+                if len(pending) >= 2 * pool_size:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _get_pool_size(jobs):
+    """Return the number of threads for the `jobs` parameter."""
+    if jobs is None:
+        return 1
+    if jobs == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(jobs))
+
+
+def watch_jobs(ds, slurm_job_ids=None, **finish_args):
+    """
+    Finish jobs as soon as they end, until none are left.
 
-            for r in finish_cmd(
-                slurm_job_id,
-                dataset=dataset,
-                message=message,
-                outputs=outputs,
-                explicit=explicit,
-                close_failed_jobs=close_failed_jobs,
-                commit_failed_jobs=commit_failed_jobs,
-                branch=new_branch,
-                jobs=None,
+    Jobs scheduled with a completion marker are only looked up in Slurm, to
+    confirm their state, once all their markers are in the spool directory,
+    and otherwise every `datalad.slurm.watch-max-interval` seconds in case
+    they were killed before leaving a marker. The other jobs are polled.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset with the open jobs.
+    slurm_job_ids : list, optional
+        The jobs to watch. By default all open jobs, including those which
+        are scheduled while watching.
+    **finish_args
+        Passed on to `_finish_jobs`.
+
+    Yields
+    ------
+    dict
+        Status dictionaries of the finished jobs.
+    """
+    min_interval = float(ds.config.get("datalad.slurm.watch-min-interval", 10))
+    max_interval = float(ds.config.get("datalad.slurm.watch-max-interval", 300))
+    close_failed_jobs = finish_args.get("close_failed_jobs") or finish_args.get(
+        "commit_failed_jobs"
+    )
+
+    # jobs which stay open after an attempt to finish them
+    attempted = set()
+    # when jobs with completion markers were last looked up in Slurm
+    last_lookup = {}
+    spool_watcher = None
+
+    interval = min_interval
+    try:
+        while True:
+            open_job_ids, status_ok = get_scheduled_commits(ds)
+            if not status_ok:
+                yield get_status_dict(
+                    "slurm-finish",
+                    ds=ds,
+                    status="error",
+                    message=("Database connection cannot be established"),
+                )
+                return
+            open_job_ids = [str(job_id) for job_id in open_job_ids]
+            if slurm_job_ids is not None:
+                watched = {str(job_id) for job_id in slurm_job_ids}
+                open_job_ids = [
+                    job_id for job_id in open_job_ids if job_id in watched
+                ]
+            if not open_job_ids:
+                return
+
+            markers = get_completion_markers(ds, open_job_ids)
+            stage_outs = get_stage_out_jobs(ds, open_job_ids)
+            if markers and spool_watcher is None:
+                spool_watcher = _SpoolWatcher(get_spool_dir(ds))
+            present = spool_watcher.scan() if spool_watcher else set()
+            signalled = {
+                job_id
+                for job_id, names in markers.items()
+                if present.issuperset(names)
+            }
+
+            now = time.monotonic()
+            lookup_ids = [
+                job_id
+                for job_id in open_job_ids
+                if job_id not in markers
+                or job_id in signalled
+                or now - last_lookup.get(job_id, -max_interval) >= max_interval
+            ]
+            last_lookup.update((job_id, now) for job_id in lookup_ids)
+
+            # states older than the polling interval are of no use here
+            stage_out_ids = [
+                stage_outs[job_id] for job_id in lookup_ids if job_id in stage_outs
+            ]
+            jobs_status = (
+                get_jobs_status(ds, lookup_ids + stage_out_ids, ttl=0)
+                if lookup_ids
+                else {}
+            )
+
+            ended, stuck = [], []
+            for job_id in lookup_ids:
+                if job_id not in jobs_status or job_id in attempted:
+                    stuck.append(job_id)
+                    continue
+                job_states, _ = jobs_status[job_id]
+                if not all(
+                    state in _TERMINAL_STATES for state in job_states.values()
+                ):
+                    continue
+                # the outputs are still being moved back
+                stage_out_states, _ = jobs_status.get(
+                    stage_outs.get(job_id), ({}, None)
+                )
+                if not all(
+                    state in _TERMINAL_STATES for state in stage_out_states.values()
+                ):
+                    continue
+                if close_failed_jobs or all(
+                    state == "COMPLETED" for state in job_states.values()
+                ):
+                    ended.append(job_id)
+                else:
+                    stuck.append(job_id)
+
+            if ended:
+                attempted.update(ended)
+                for r in _finish_jobs(ds, ended, jobs_status, **finish_args):
+                    yield r
+                interval = min_interval
+                continue
+
+            if len(stuck) == len(open_job_ids):
+                # nothing left which could still be finished
+                for job_id in stuck:
+                    if job_id in attempted:
+                        continue
+                    if job_id in jobs_status:
+                        for r in _finish_jobs(
+                            ds, [job_id], jobs_status, **finish_args
+                        ):
+                            yield r
+                    else:
+                        yield get_status_dict(
+                            "slurm-finish",
+                            ds=ds,
+                            status="impossible",
+                            message=f"Slurm has no information about job {job_id}",
+                        )
+                return
+
+            if signalled.difference(stuck):
+                # Slurm has not caught up with the end of these jobs yet
+                timeout = min_interval
+            elif any(
+                job_id not in markers and job_id not in stuck
+                for job_id in open_job_ids
             ):
-                yield r
+                timeout = interval
+            else:
+                # only jobs which will leave a marker
+                timeout = max_interval
+            lgr.info(
+                "Waiting up to %.0f s for %d open job(s)",
+                timeout,
+                len(open_job_ids) - len(stuck),
+            )
+            if spool_watcher:
+                spool_watcher.wait(timeout, present)
+            else:
+                time.sleep(timeout)
+            interval = min(interval * 2, max_interval)
+    finally:
+        if spool_watcher:
+            spool_watcher.close()
 
-        if octopus:
 
-            # Filter the branches in 'all_new_branches' against all existing branches because some may not exist
-            # ... they don't get created when finish_cmd() finds the job invalid
-            all_new_branches= list(set(all_new_branches) & set(ds.repo.get_branches()))
+class _SpoolWatcher:
+    """Wait for new completion markers in the spool directory.
+
+    inotify (if the optional `inotify_simple` package is available) wakes up
+    the watcher as soon as a marker is written on this host. Markers written
+    by other hosts to a network filesystem don't cause inotify events, so the
+    directory is scanned every `_SPOOL_SCAN_INTERVAL` seconds in any case.
+    """
+
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        self._inotify = None
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            lgr.debug("inotify_simple is not installed, scanning %s", spool_dir)
+            return
+        try:
+            self._inotify = INotify()
+            self._inotify.add_watch(spool_dir, flags.MOVED_TO | flags.CLOSE_WRITE)
+        except OSError as e:
+            lgr.debug("Cannot watch %s with inotify: %s", spool_dir, e)
+            self.close()
+
+    def scan(self):
+        """Return the names of the markers in the spool directory."""
+        try:
+            with os.scandir(self.spool_dir) as entries:
+                return {
+                    entry.name for entry in entries if not entry.name.startswith(".")
+                }
+        except FileNotFoundError:
+            return set()
+
+    def wait(self, timeout, known):
+        """Wait until a marker not in `known` appears, at most `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            step = min(remaining, _SPOOL_SCAN_INTERVAL)
+            if self._inotify is not None:
+                self._inotify.read(timeout=int(step * 1000))
+            else:
+                time.sleep(step)
+            if not self.scan().issubset(known):
+                return
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def get_completion_markers(dset, job_ids):
+    """
+    Return the completion markers the jobs leave in the spool directory.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset with the open jobs database.
+    job_ids : list of str
+        The Slurm job IDs.
+
+    Returns
+    -------
+    dict
+        The job ID mapped to the list of marker file names, for the jobs
+        which were scheduled with --completion-marker.
+    """
+    return {
+        job_id: json.loads(names)
+        for job_id, names in _get_job_info(dset, job_ids, "completion_markers").items()
+    }
+
+
+def get_stage_out_jobs(dset, job_ids):
+    """
+    Return the stage-out jobs which move the outputs back from the alt-dir.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset with the open jobs database.
+    job_ids : list of str
+        The Slurm job IDs.
+
+    Returns
+    -------
+    dict
+        The job ID mapped to the Slurm job ID of its stage-out job, for the
+        jobs which have one.
+    """
+    return {
+        job_id: str(stage_out_job_id)
+        for job_id, stage_out_job_id in _get_job_info(
+            dset, job_ids, "stage_out_job_id"
+        ).items()
+    }
+
+
+def _get_job_info(dset, job_ids, column):
+    """Return the values of a column of the open jobs which have one."""
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return {}
+    values = {}
+    try:
+        for i in range(0, len(job_ids), _STATUS_QUERY_CHUNK_SIZE):
+            chunk = job_ids[i : i + _STATUS_QUERY_CHUNK_SIZE]
+            cur.execute(
+                f"""
+            SELECT slurm_job_id, {column} FROM open_jobs
+            WHERE slurm_job_id IN ({', '.join('?' * len(chunk))})
+            AND {column} IS NOT NULL
+            """,
+                chunk,
+            )
+            for job_id, value in cur.fetchall():
+                values[str(job_id)] = value
+    except sqlite3.Error as e:
+        lgr.debug("Cannot read the %s of the open jobs: %s", column, e)
+    finally:
+        con.close()
+    return values
 
-            # WORKAROUND the "-q" is a workaround for the current 'merge()' routine 
-            # in datalad/datalad/support/gitrepo.py
-            # currently there are only one-way merges allowed if you call it like intended ... but if we
-            # use -q as 'name' and put all the branches into 'options' it will work fow now
-            ds.repo.merge("-q", all_new_branches, msg="Merge all branches from finished jobs")
-            for b in all_new_branches:
-                ds.repo.remove_branch(b)
 
 def get_scheduled_commits(dset):
     """Return the slurm job ids of all open jobs."""
@@ -238,6 +1007,7 @@ def finish_cmd(
     commit_failed_jobs=False,
     branch=None,
     jobs=None,
+    job_status=None,
 ):
     """
     Finalize a SLURM job by saving its outputs to a dataset and making an entry in the git log.
@@ -260,6 +1030,9 @@ def finish_cmd(
         If not None, create a separate branch for the results of this job with this name. Default is None.
     jobs : int, optional
         Number of parallel jobs to use for saving. Default is None.
+    job_status : tuple, optional
+        The state of the job as returned by `get_job_status`, if it is
+        already known. Otherwise, it is looked up.
 
     Yields
     ------
@@ -273,26 +1046,89 @@ def finish_cmd(
     close failed or cancelled jobs.
     """
     ds = require_dataset(dataset, check_installed=True, purpose="finish a SLURM job")
-    ds_repo = ds.repo
 
     lgr.debug("rerunning command output underneath %s", ds)
 
     if not explicit:
-        yield get_status_dict(
-            "slurm-finish",
-            ds=ds,
-            status="impossible",
-            message=(
-                "clean dataset required to detect changes from command; "
-                "use `datalad status` to inspect unsaved changes"
-            ),
-        )
+        yield _explicit_required_result(ds)
+        return
+
+    prepared = yield from prepare_finish(
+        ds,
+        slurm_job_id,
+        message=message,
+        close_failed_jobs=close_failed_jobs,
+        commit_failed_jobs=commit_failed_jobs,
+        job_status=job_status,
+    )
+    if prepared is None:
         return
 
-    ds = require_dataset(
-        dataset, check_installed=True, purpose="track command outcomes"
+    for r in save_finished(ds, [prepared], dataset=dataset, branch=branch, jobs=jobs):
+        yield r
+
+
+def _explicit_required_result(ds):
+    return get_status_dict(
+        "slurm-finish",
+        ds=ds,
+        status="impossible",
+        message=(
+            "clean dataset required to detect changes from command; "
+            "use `datalad status` to inspect unsaved changes"
+        ),
     )
+
+
+def prepare_finish(
+    ds,
+    slurm_job_id,
+    message=None,
+    close_failed_jobs=False,
+    commit_failed_jobs=False,
+    job_status=None,
+    pwd=None,
+):
+    """
+    Prepare the commit of a finished job.
+
+    Reads the job from the database, copies its outputs back from an
+    alternative directory, checks its state and expands its outputs. Jobs
+    which can't be committed are reported, failed jobs which are only closed
+    are removed from the database.
+
+    This is a generator which yields the result records of these steps and
+    returns the job to pass on to `save_finished`, or None if there is
+    nothing to commit.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset with the job.
+    slurm_job_id : str
+        The SLURM job ID to finish.
+    message : str, optional
+        The user message for the commit.
+    close_failed_jobs : bool, optional
+        If True, closes failed or cancelled jobs.
+    commit_failed_jobs : bool, optional
+        If True, commits the outputs of failed or cancelled jobs.
+    job_status : tuple, optional
+        The state of the job as returned by `get_job_status`, if it is
+        already known. Otherwise, it is looked up.
+    pwd : str, optional
+        The directory the output paths are relative to, by default the
+        current directory.
+
+    Returns
+    -------
+    dict or None
+        With the keys 'slurm_run_info', 'run_message', 'message', 'status'
+        and 'outputs'.
+    """
     ds_path = ds.path
+    if pwd is None:
+        pwd = os.getcwd()
 
     # if committing failed jobs, close_failed_jobs must be set to True
     if commit_failed_jobs:
@@ -306,24 +1142,36 @@ def finish_cmd(
             status="error",
             message="Error accessing slurm job {} in database".format(slurm_job_id),
         )
-        return
-
-    # check if there was an alt_dir specified at schedule or reschedule time
-    if 'slurm_run_info' in results and 'alt_dir' in results['slurm_run_info']:
-        alt_dir= results['slurm_run_info']['alt_dir'] 
-        if alt_dir: # not '' and not None
-
-            for o in results['slurm_run_info']['outputs'] + results['slurm_run_info']['slurm_outputs']:
-                dir= op.dirname(o)
-                command=f"cp -r -L -u {alt_dir}/{o} {dir}/"
-                print(f"        copy back from alternative dir: '{command}' in '{ds_path}'")
-                result = subprocess.run(
-                    command, shell=True, capture_output=True, text=True, cwd=ds_path # always run from the root of the repository
-                )
-                # Extract result from copy command
-                #stdout = result.stdout
-                #print("            result: ", result.stdout)
+        return None
 
+    # the slurm log files of jobs scheduled with --defer-job-info are
+    # determined now
+    templates = results["job_info"].get("slurm_output_templates")
+    if templates:
+        slurm_run_info = results["slurm_run_info"]
+        try:
+            slurm_outputs, slurm_env_file = resolve_slurm_output_files(
+                ds_path,
+                slurm_run_info["slurm_job_id"],
+                json.loads(templates),
+                slurm_run_info.get("alt_dir") or pwd,
+            )
+        except (OSError, ValueError) as e:
+            yield get_status_dict(
+                "slurm-finish",
+                status="error",
+                message="Cannot determine the slurm output files of job {}: {}".format(
+                    slurm_job_id, e
+                ),
+            )
+            return None
+        slurm_run_info["slurm_outputs"] = slurm_outputs + [slurm_env_file]
+        update_open_job(
+            ds,
+            slurm_run_info["slurm_job_id"],
+            slurm_outputs=json.dumps(slurm_run_info["slurm_outputs"]),
+            slurm_output_templates=None,
+        )
 
     run_message = results["run_message"]
     slurm_run_info = results["slurm_run_info"]
@@ -334,12 +1182,14 @@ def finish_cmd(
     if not outputs_to_save:
         err_msg = "You must specify which outputs to save from this slurm run."
         yield get_status_dict("slurm-finish", status="impossible", message=err_msg)
-        return
+        return None
 
     slurm_job_id = slurm_run_info["slurm_job_id"]
 
     # get a list of job ids and status (if we have an array job)
-    job_states, job_status_group = get_job_status(slurm_job_id)
+    if job_status is None:
+        job_status = get_job_status(slurm_job_id)
+    job_states, job_status_group = job_status
 
     status_text = "Job ID: Job state \n"
     for job_id, state in job_states.items():
@@ -356,25 +1206,191 @@ def finish_cmd(
         )
         if any(status in ["PENDING", "RUNNING"] for status in job_states.values()):
             yield get_status_dict("slurm-finish", status="impossible", message=message)
-            return
+            return None
         else:
             if not close_failed_jobs:
                 yield get_status_dict("slurm-finish", status="impossible", message=message)
-                return
+                return None
+            elif not (yield from wait_for_stage_out(results["job_info"], slurm_job_id)):
+                return None
             else:
                 if not commit_failed_jobs:
                     # remove the job
                     remove_from_database(ds, slurm_run_info)
                     message = f"Closing failed / cancelled jobs. Statuses: {status_summary}"
                     yield get_status_dict("slurm-finish", status="ok", message=message)
-                    return
+                    return None
+    elif not (yield from wait_for_stage_out(results["job_info"], slurm_job_id)):
+        return None
+
+    # the job has ended, move its outputs back from an alternative directory
+    alt_dir = slurm_run_info.get("alt_dir")
+    if alt_dir and not (yield from collect_outputs(ds, slurm_run_info, alt_dir)):
+        return None
 
     # expand the wildcards
-    globbed_outputs = GlobbedPaths(outputs_to_save, expand=True).paths
+    globbed_outputs = GlobbedPaths(outputs_to_save, pwd=pwd, expand=True).paths
 
     # update the run info with the new outputs
     slurm_run_info["outputs"] = globbed_outputs
 
+    return dict(
+        slurm_run_info=slurm_run_info,
+        run_message=run_message,
+        message=message,
+        status=job_status_group.capitalize(),
+        outputs=globbed_outputs,
+    )
+
+
+def wait_for_stage_out(job_info, slurm_job_id):
+    """
+    Check that the stage-out job of a job has ended, if it has one.
+
+    Whatever the stage-out job did not move back, e.g. because it failed, is
+    moved back by `collect_outputs` afterwards.
+
+    This is a generator which yields a result if the stage-out job has not
+    ended yet, and returns whether it has.
+    """
+    stage_out_job_id = job_info.get("stage_out_job_id")
+    if not stage_out_job_id:
+        return True
+    try:
+        states, _ = get_job_status(stage_out_job_id)
+    except (ValueError, RuntimeError) as e:
+        yield get_status_dict(
+            "slurm-finish",
+            status="impossible",
+            message=(
+                "Cannot look up the stage-out job %s of job %s: %s",
+                stage_out_job_id,
+                slurm_job_id,
+                e,
+            ),
+        )
+        return False
+    if not all(state in _TERMINAL_STATES for state in states.values()):
+        yield get_status_dict(
+            "slurm-finish",
+            status="impossible",
+            message=(
+                "The stage-out job %s of job %s has not ended yet",
+                stage_out_job_id,
+                slurm_job_id,
+            ),
+        )
+        return False
+    if not all(state == "COMPLETED" for state in states.values()):
+        lgr.warning(
+            "The stage-out job %s of job %s did not complete, moving the "
+            "outputs back now",
+            stage_out_job_id,
+            slurm_job_id,
+        )
+    return True
+
+
+def collect_outputs(ds, slurm_run_info, alt_dir):
+    """
+    Move the outputs and Slurm log files of a job back from its alt-dir.
+
+    The transfer is done by `collect_paths`, with `datalad.slurm.staging-jobs`
+    (default: 8) files at a time. The alt-dir copies are removed, unless the
+    `datalad.slurm.copy-back` policy is "copy" instead of "move". Copies are
+    verified by their size, or by their checksum with
+    `datalad.slurm.copy-back-verify` set to "checksum".
+
+    This is a generator which yields an error result if anything could not
+    be transferred, and returns whether all outputs were transferred.
+    """
+    policy = ds.config.get("datalad.slurm.copy-back", "move")
+    if policy not in ("move", "copy"):
+        yield get_status_dict(
+            "slurm-finish",
+            ds=ds,
+            status="impossible",
+            message=(
+                "Unknown datalad.slurm.copy-back policy %r, use 'move' or 'copy'",
+                policy,
+            ),
+        )
+        return False
+    paths = list(
+        dict.fromkeys(
+            ensure_list(slurm_run_info["outputs"])
+            + ensure_list(slurm_run_info["slurm_outputs"])
+        )
+    )
+    try:
+        stats = collect_paths(
+            alt_dir,
+            ds.path,
+            paths,
+            max_workers=int(ds.config.get("datalad.slurm.staging-jobs", 8)),
+            retain=policy == "copy",
+            verify=ds.config.get("datalad.slurm.copy-back-verify", "size"),
+        )
+    except ValueError as e:
+        yield get_status_dict("slurm-finish", ds=ds, status="impossible", message=str(e))
+        return False
+    print(
+        f"        moved {stats['renamed']} paths and copied {stats['files']} files "
+        f"({format_size(stats['bytes'])}) back from alternative dir '{alt_dir}' "
+        f"in {stats['seconds']:.1f}s"
+    )
+    for path in stats["missing"]:
+        lgr.warning(
+            "Output '%s' of job %s not found in alternative dir '%s'",
+            path,
+            slurm_run_info["slurm_job_id"],
+            alt_dir,
+        )
+    if stats["errors"]:
+        yield get_status_dict(
+            "slurm-finish",
+            ds=ds,
+            status="error",
+            message=(
+                "Cannot transfer the outputs of job %s back from alternative "
+                "dir '%s', the job stays open: %s",
+                slurm_run_info["slurm_job_id"],
+                alt_dir,
+                "; ".join(f"{path}: {error}" for path, error in stats["errors"]),
+            ),
+        )
+        return False
+    return True
+
+
+def save_finished(ds, prepared, dataset=None, message=None, branch=None, jobs=None):
+    """
+    Commit the outputs of finished jobs and remove them from the database.
+
+    A single job gets its own `[DATALAD SLURM RUN]` commit. Several jobs are
+    committed together, with one 'Slurm job <id>: <status>' line per job and
+    a list of their run records in the commit message.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset with the jobs.
+    prepared : list of dict
+        The jobs as returned by `prepare_finish`.
+    dataset : str or Dataset, optional
+        The dataset as given by the user, to determine the working directory.
+    message : str, optional
+        The user message for a commit of several jobs.
+    branch : str, optional
+        If not None, commit to a new branch with this name.
+    jobs : int, optional
+        Number of parallel jobs to use for saving.
+
+    Yields
+    ------
+    dict
+        Status dictionaries of the save.
+    """
     # rel_pwd = reslurm_run_info.get('pwd') if reslurm_run_info else None
     rel_pwd = None  # TODO might be able to get this from rerun info
     if rel_pwd and dataset:
@@ -385,34 +1401,45 @@ def finish_cmd(
         pwd, rel_pwd = get_command_pwds(dataset)
 
     do_save = True
-    msg = """\
-[DATALAD SLURM RUN] {}
-
-=== Do not change lines below ===
-{}
-^^^ Do not change lines above ^^^
-        """
-    job_status_group = job_status_group.capitalize()
-    message_entry = f"Slurm job {slurm_job_id}: {job_status_group}"
-
-    # Add the user messages from schedule and finish
-    if message:
-        message_entry += f"\n\n{message}"
-    if run_message:
-        message_entry += f"\n\n{run_message}"
-
-    # create the run record, either as a string, or written to a file
-    # depending on the config/request
-    # TODO sidecar param
-    record, record_path = _create_record(slurm_run_info, False, ds)
-
-    msg = msg.format(
-        message_entry,
-        '"{}"'.format(record) if record_path else record,
-    )
-
-    # remove the job
-    remove_from_database(ds, slurm_run_info)
+    if len(prepared) == 1:
+        job = prepared[0]
+        slurm_run_info = job["slurm_run_info"]
+        message_entry = f"Slurm job {slurm_run_info['slurm_job_id']}: {job['status']}"
+
+        # Add the user messages from schedule and finish
+        if job["message"]:
+            message_entry += f"\n\n{job['message']}"
+        if job["run_message"]:
+            message_entry += f"\n\n{job['run_message']}"
+
+        msg = format_run_message(ds, message_entry, slurm_run_info)
+    else:
+        message_entry = "\n".join(
+            f"Slurm job {job['slurm_run_info']['slurm_job_id']}: {job['status']}"
+            for job in prepared
+        )
+        if message:
+            message_entry += f"\n\n{message}"
+
+        # the schedule messages go into the run records of the jobs
+        records = []
+        for job in prepared:
+            record = dict(job["slurm_run_info"])
+            if job["run_message"]:
+                record["run_message"] = job["run_message"]
+            records.append(record)
+        msg = format_run_message(ds, message_entry, records)
+
+    # remove the jobs
+    for job in prepared:
+        remove_from_database(ds, job["slurm_run_info"])
+
+    paths = list(dict.fromkeys(p for job in prepared for p in job["outputs"]))
+
+    if branch and not _any_in_submodule(ds, paths):
+        for r in _save_on_branch(ds, branch, paths, msg, jobs=jobs):
+            yield r
+        return
 
     start_branch=""
     if branch:
@@ -423,7 +1450,7 @@ def finish_cmd(
         with chpwd(pwd):
             for r in Save.__call__(
                 dataset=ds,
-                path=globbed_outputs,
+                path=paths,
                 recursive=True,
                 message=msg,
                 jobs=jobs,
@@ -440,6 +1467,160 @@ def finish_cmd(
         ds.repo.checkout(f"{start_branch}")
 
 
+def _save_on_branch(ds, branch, paths, message, jobs=None):
+    """
+    Commit outputs to a new branch without switching the working tree.
+
+    The outputs are moved into a side worktree at the current HEAD (see
+    `_get_side_worktree`) and saved there, and the branch is created at the
+    resulting commit. Like after checking out the branch, saving and
+    checking out the previous branch again, the outputs are then only on the
+    branch: new files are gone from the working tree, and files tracked in
+    HEAD are restored to their committed state. If the save fails or there is
+    nothing to commit, the outputs are left in the working tree and no
+    branch is created.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset.
+    branch : str
+        The name of the new branch.
+    paths : list of str
+        The outputs, relative to the dataset root.
+    message : str
+        The commit message.
+    jobs : int, optional
+        Number of parallel jobs to use for saving.
+
+    Yields
+    ------
+    dict
+        Status dictionaries of the save.
+    """
+    head = _git(ds, ["rev-parse", "HEAD"]).strip()
+    try:
+        _git(ds, ["rev-parse", "--verify", "--quiet", f"refs/heads/{branch}"])
+    except subprocess.CalledProcessError:
+        pass
+    else:
+        yield get_status_dict(
+            action="save",
+            status="error",
+            path=ds.path,
+            message=f"Branch {branch} already exists",
+        )
+        return
+    worktree = _get_side_worktree(ds, head)
+
+    moved = []
+    for path in paths:
+        src = op.join(ds.path, path)
+        if not op.lexists(src):
+            continue
+        _move_into(src, op.join(worktree, path))
+        moved.append(path)
+
+    try:
+        for r in Save.__call__(
+            dataset=worktree,
+            path=[op.join(worktree, path) for path in moved],
+            recursive=True,
+            message=message,
+            jobs=jobs,
+            return_type="generator",
+            result_renderer="disabled",
+            on_failure="ignore",
+        ):
+            yield r
+    finally:
+        commit = _git(ds, ["-C", worktree, "rev-parse", "HEAD"]).strip()
+        if commit == head:
+            # nothing was committed, give the outputs back
+            for path in moved:
+                _move_into(op.join(worktree, path), op.join(ds.path, path))
+            moved = []
+        else:
+            _git(ds, ["update-ref", f"refs/heads/{branch}", commit, ""])
+
+        # the outputs tracked in HEAD come back in their committed state
+        if moved:
+            tracked = _git(ds, ["ls-files", "-z", "--"] + moved)
+            if tracked:
+                _git(
+                    ds,
+                    [
+                        "checkout",
+                        head,
+                        "--pathspec-from-file=-",
+                        "--pathspec-file-nul",
+                    ],
+                    input=tracked,
+                )
+
+    if commit == head:
+        yield get_status_dict(
+            action="save",
+            status="error",
+            path=ds.path,
+            message=f"Nothing was committed, branch {branch} is not created",
+        )
+
+
+def _get_side_worktree(ds, commit):
+    """
+    Return the side worktree of the dataset, checked out at `commit`.
+
+    The worktree is created in `.git/datalad-slurm/worktree` on first use
+    and reused afterwards, so that only the files which differ from the last
+    use are updated.
+    """
+    worktree = op.join(ds.repo.dot_git, "datalad-slurm", "worktree")
+    if op.exists(op.join(worktree, ".git")):
+        _git(ds, ["-C", worktree, "checkout", "-q", "--force", "--detach", commit])
+        # left over from an interrupted save
+        _git(ds, ["-C", worktree, "clean", "-q", "-f", "-d"])
+    else:
+        _git(ds, ["worktree", "prune"])
+        _git(ds, ["worktree", "add", "-q", "--detach", worktree, commit])
+    return worktree
+
+
+def _move_into(src, dst):
+    """Move `src` to `dst`, merging directories with existing ones."""
+    if op.isdir(src) and not op.islink(src):
+        if op.lexists(dst) and not (op.isdir(dst) and not op.islink(dst)):
+            os.unlink(dst)
+        os.makedirs(dst, exist_ok=True)
+        with os.scandir(src) as entries:
+            for entry in entries:
+                _move_into(entry.path, op.join(dst, entry.name))
+        os.rmdir(src)
+        return
+    os.makedirs(op.dirname(dst), exist_ok=True)
+    if op.isdir(dst) and not op.islink(dst):
+        shutil.rmtree(dst)
+    os.replace(src, dst)
+
+
+def _any_in_submodule(ds, paths):
+    """Whether any of the paths is in a subdataset, which the side worktree lacks."""
+    try:
+        out = _git(
+            ds, ["config", "--file", ".gitmodules", "--get-regexp", r"\.path$"]
+        )
+    except subprocess.CalledProcessError:
+        # no .gitmodules or no submodules in it
+        return False
+    submodules = [line.split(" ", 1)[1] for line in out.splitlines() if " " in line]
+    return any(
+        op.normpath(path) == submodule
+        or op.normpath(path).startswith(submodule + op.sep)
+        for path in paths
+        for submodule in submodules
+    )
+
+
 def extract_from_db(dset, slurm_job_id):
     """Extract the run info from the database entry."""
     con, cur = connect_to_database(dset)
@@ -469,7 +1650,23 @@ def extract_from_db(dset, slurm_job_id):
     message = slurm_run_info["message"]
     del slurm_run_info["message"]
 
-    res = {"run_message": message, "slurm_run_info": slurm_run_info}
+    # the other fields of the run record, e.g. the input identities
+    extra_info = slurm_run_info.pop("extra_info", None)
+    if extra_info:
+        slurm_run_info.update(json.loads(extra_info))
+
+    # columns which are not part of the run record
+    job_info = {
+        column: slurm_run_info.pop(column)
+        for column in _DB_ONLY_COLUMNS
+        if column in slurm_run_info
+    }
+
+    res = {
+        "run_message": message,
+        "slurm_run_info": slurm_run_info,
+        "job_info": job_info,
+    }
     return dict(res, status="ok")
 
 
@@ -532,29 +1729,253 @@ def get_job_status(job_id):
         job_states = {}
         for line in output.splitlines():
             job_id, state = line.split("|")
-            if "CANCELLED" in state:
-                state = "CANCELLED"
-            job_states[job_id] = state
-
-        unique_statuses = set(job_states.values())
-        if len(unique_statuses) == 1:
-            job_status_group = unique_statuses.pop()  # Get the single status value
-        else:
-            if "COMPLETED" in unique_statuses:
-                job_status_group = "ARRAY FAILED (SOME COMPLETE)"
-            else:
-                job_status_group = "ARRAY FAILED (MULTIPLE CAUSES)"
+            job_states[job_id] = _normalize_state(state)
 
-        return job_states, job_status_group
+        return job_states, _summarize_job_states(job_states)
 
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"Error running sacct command: {e.stderr}")
 
 
+def get_jobs_status(dset, job_ids, ttl=None):
+    """
+    Check the status of many Slurm jobs with as few queries as possible.
+
+    The jobs which are still in the queue are taken from squeue, all others
+    from sacct, in chunks of `_STATUS_QUERY_CHUNK_SIZE` job ids per call.
+    The sacct queries start at the oldest submission time of the open jobs.
+
+    The states are cached in the open jobs database. Slurm is not asked
+    again for jobs which have ended, and for the other jobs only after
+    `datalad.slurm.state-cache-ttl` seconds (default 60).
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset with the open jobs database.
+    job_ids : list
+        The Slurm job IDs.
+    ttl : float, optional
+        Seconds for which cached states of unfinished jobs are used, instead
+        of the configured value.
+
+    Returns
+    -------
+    dict
+        The job ID (as str) mapped to the tuple which `get_job_status` returns
+        for it. Jobs which Slurm doesn't know are missing.
+    """
+    job_ids = [str(job_id) for job_id in job_ids]
+    if ttl is None:
+        ttl = float(dset.config.get("datalad.slurm.state-cache-ttl", 60))
+    cached_states = _read_state_cache(dset, job_ids, ttl)
+    job_ids = [job_id for job_id in job_ids if job_id not in cached_states]
+
+    job_states = {}
+    if job_ids:
+        _query_job_states(
+            ["squeue", "-h", "-o", "%i|%T", "-j"], job_ids, job_states
+        )
+    for states in job_states.values():
+        for task_id, state in states.items():
+            if state in _SQUEUE_RUNNING_STATES:
+                states[task_id] = "RUNNING"
+    remaining = [job_id for job_id in job_ids if job_id not in job_states]
+    if remaining:
+        sacct_cmd = ["sacct", "-n", "-X", "--parsable2", "-o", "JobID,State"]
+        start_time = _get_oldest_submit_time(dset)
+        if start_time is not None:
+            # leave some room for clock differences to the Slurm controller
+            sacct_cmd += [
+                "-S",
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start_time - 3600)),
+            ]
+        _query_job_states(sacct_cmd + ["-j"], remaining, job_states)
+    _write_state_cache(dset, job_states)
+
+    job_states.update(cached_states)
+    return {
+        job_id: (states, _summarize_job_states(states))
+        for job_id, states in job_states.items()
+    }
+
+
+def _read_state_cache(dset, job_ids, ttl):
+    """Return the cached states of the jobs which need no new query."""
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return {}
+    min_updated = time.time() - ttl
+    cached_states = {}
+    try:
+        for i in range(0, len(job_ids), _STATUS_QUERY_CHUNK_SIZE):
+            chunk = job_ids[i : i + _STATUS_QUERY_CHUNK_SIZE]
+            cur.execute(
+                f"""
+            SELECT slurm_job_id, states FROM job_state_cache
+            WHERE slurm_job_id IN ({', '.join('?' * len(chunk))})
+            AND (terminal OR updated >= ?)
+            """,
+                (*chunk, min_updated),
+            )
+            for job_id, states in cur.fetchall():
+                cached_states[str(job_id)] = json.loads(states)
+    except sqlite3.Error as e:
+        lgr.debug("Cannot read the job state cache: %s", e)
+        return {}
+    finally:
+        con.close()
+    return cached_states
+
+
+def _write_state_cache(dset, job_states):
+    """Remember the states of jobs just reported by Slurm."""
+    if not job_states:
+        return
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return
+    now = time.time()
+    try:
+        cur.executemany(
+            """
+        INSERT OR REPLACE INTO job_state_cache (slurm_job_id, states, terminal, updated)
+        VALUES (?, ?, ?, ?)
+        """,
+            [
+                (
+                    job_id,
+                    json.dumps(states),
+                    all(state in _TERMINAL_STATES for state in states.values()),
+                    now,
+                )
+                for job_id, states in job_states.items()
+            ],
+        )
+        con.commit()
+    except sqlite3.Error as e:
+        lgr.debug("Cannot update the job state cache: %s", e)
+    finally:
+        con.close()
+
+
+def _query_job_states(cmd, job_ids, job_states):
+    """Add the states of the jobs from a squeue or sacct call to `job_states`.
+
+    `job_states` maps the job id to the dict of the states of its tasks.
+    """
+    for i in range(0, len(job_ids), _STATUS_QUERY_CHUNK_SIZE):
+        chunk = job_ids[i : i + _STATUS_QUERY_CHUNK_SIZE]
+        # squeue fails if one of the jobs has left the queue already,
+        # but still reports the others
+        result = subprocess.run(
+            cmd + [",".join(chunk)],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode and not result.stdout:
+            lgr.debug("%s failed: %s", cmd[0], result.stderr.strip())
+            continue
+        for line in result.stdout.splitlines():
+            task_id, _, state = line.strip().partition("|")
+            if not state:
+                continue
+            job_id = re.split(r"[_+]", task_id, maxsplit=1)[0]
+            job_states.setdefault(job_id, {})[task_id] = _normalize_state(state)
+
+
+def _get_oldest_submit_time(dset):
+    """Return the submission time of the oldest open job, if known for all."""
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return None
+    try:
+        cur.execute(
+            "SELECT MIN(submit_time), COUNT(*) - COUNT(submit_time) FROM open_jobs"
+        )
+        oldest, unknown = cur.fetchone()
+        # jobs scheduled before submission times were recorded
+        return None if unknown else oldest
+    except sqlite3.Error:
+        return None
+    finally:
+        con.close()
+
+
+def _normalize_state(state):
+    # sacct reports e.g. "CANCELLED by 1234"
+    if "CANCELLED" in state:
+        return "CANCELLED"
+    return state
+
+
+def _summarize_job_states(job_states):
+    """Return the summary status of the tasks of a job, see `get_job_status`."""
+    unique_statuses = set(job_states.values())
+    if len(unique_statuses) == 1:
+        job_status_group = unique_statuses.pop()  # Get the single status value
+    else:
+        if "COMPLETED" in unique_statuses:
+            job_status_group = "ARRAY FAILED (SOME COMPLETE)"
+        else:
+            job_status_group = "ARRAY FAILED (MULTIPLE CAUSES)"
+    return job_status_group
+
+
+def release_staged_inputs(dset, slurm_run_info):
+    """Drop the references of a job to its inputs in its alternative directory.
+
+    With `datalad.slurm.staging-cleanup`, the inputs which no other job uses
+    anymore are removed from the alternative directory.
+    """
+    alt_dir = slurm_run_info.get("alt_dir")
+    if not alt_dir or not op.exists(op.join(alt_dir, MANIFEST_NAME)):
+        return
+    try:
+        con = connect_to_manifest(
+            alt_dir, get_db_busy_timeout(dset)
+        )
+        try:
+            removed = release_staging_refs(
+                alt_dir,
+                con,
+                slurm_run_info["slurm_job_id"],
+                cleanup=dset.config.getbool("datalad.slurm", "staging-cleanup", False),
+            )
+        finally:
+            con.close()
+    except (sqlite3.Error, ValueError) as e:
+        lgr.warning("Cannot update the staging manifest in '%s': %s", alt_dir, e)
+        return
+    if removed:
+        lgr.info(
+            "Removed %d staged inputs from alternative dir '%s'", len(removed), alt_dir
+        )
+
+
 def remove_from_database(dset, slurm_run_info):
-    """Remove a job from the database based on its slurm_job_id."""
+    """Remove a job from the database based on its slurm_job_id.
+
+    The completion markers of the job are removed as well, and its references
+    to its staged inputs (see `release_staged_inputs`).
+    """
+    release_staged_inputs(dset, slurm_run_info)
+
     con, cur = connect_to_database(dset)
 
+    cur.execute(
+        "SELECT completion_markers FROM open_jobs WHERE slurm_job_id = ?",
+        (slurm_run_info["slurm_job_id"],),
+    )
+    row = cur.fetchone()
+    if row and row[0]:
+        spool_dir = get_spool_dir(dset)
+        for name in json.loads(row[0]):
+            try:
+                os.unlink(op.join(spool_dir, name))
+            except FileNotFoundError:
+                pass
+
     # Remove the rows matching the slurm_job_id from all the tables
     cur.execute(
         """
@@ -580,6 +2001,14 @@ def remove_from_database(dset, slurm_run_info):
         (slurm_run_info["slurm_job_id"],),
     )
 
+    cur.execute(
+        """
+    DELETE FROM job_state_cache
+    WHERE slurm_job_id = ?
+    """,
+        (slurm_run_info["slurm_job_id"],),
+    )
+
     con.commit()
     con.close()
     return
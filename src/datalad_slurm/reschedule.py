@@ -12,12 +12,16 @@ __docformat__ = "restructuredtext"
 import logging
 import os.path as op
 import re
+import subprocess
 import sys
 from copy import copy
 from functools import partial
-from itertools import dropwhile
-
-from datalad.consts import PRE_INIT_COMMIT_SHA
+from itertools import (
+    chain,
+    dropwhile,
+    groupby,
+)
+from operator import itemgetter
 
 from datalad.distribution.dataset import (
     EnsureDataset,
@@ -45,9 +49,16 @@ from datalad.core.local.run import (
 )
 
 # from .schedule import _execute_slurm_command
-from .schedule import schedule_cmd
+from .schedule import (
+    get_recorded_inputs,
+    schedule_batch_cmd,
+    schedule_cmd,
+)
 
-from .common import get_finish_info
+from .common import (
+    get_input_ids,
+    iter_run_records,
+)
 
 lgr = logging.getLogger("datalad.local.reschedule")
 
@@ -179,6 +190,27 @@ class Reschedule(Interface):
             but does it if and only if slurm-reschedule is called with --alt-dir.
             """,
         ),
+        only_changed=Parameter(
+            args=("--only-changed",),
+            action="store_true",
+            doc="""Only reschedule jobs whose inputs (including the sbatch
+            script) changed since they were scheduled, or which read the
+            outputs of an earlier job in the revision range that is
+            rescheduled. Jobs recorded without the identities of their
+            inputs, and jobs with inputs whose content is not known from the
+            index (untracked or modified files, subdatasets) are always
+            rescheduled.""",
+        ),
+        parallel=Parameter(
+            args=("--parallel",),
+            action="store_true",
+            doc="""Submit all jobs of the revision range at once instead of one
+            after another. Jobs which read or write the outputs of an earlier
+            job, according to the recorded inputs and outputs, are submitted
+            with an sbatch dependency on it, so that they only start once it
+            completed successfully. All jobs are scheduled on the current
+            HEAD, commits without a job are skipped.""",
+        ),
         jobs=jobs_opt,
     )
 
@@ -209,6 +241,8 @@ class Reschedule(Interface):
         with_failed_jobs=False,
         assume_ready=None,
         alt_dir= None,
+        only_changed=False,
+        parallel=False,
         jobs=None,
     ):
         ds = require_dataset(
@@ -249,87 +283,109 @@ class Reschedule(Interface):
         else:
             revrange = "{}..{}".format(since, revision)
 
-        results = _rerun_as_results(ds, revrange, since, message, rev_branch, with_failed_jobs)
+        # one git process diffs all commits which are rerun, it is only
+        # closed once the last result and its diff were consumed, since
+        # --only-changed reads all results ahead
+        differ = TreeDiffer(ds.path)
+        results = _rerun_as_results(
+            ds,
+            revrange,
+            revision,
+            since,
+            message,
+            rev_branch,
+            with_failed_jobs,
+            differ,
+        )
+        if only_changed:
+            results = _skip_unchanged(ds, results)
         if script:
             handler = _get_script_handler(script, since, revision)
         elif report:
             handler = _report
+        elif parallel:
+            handler = partial(
+                _rerun_parallel, assume_ready=assume_ready, alt_dir=alt_dir, jobs=jobs
+            )
         else:
             handler = partial(
                 _rerun, assume_ready=assume_ready, explicit=True, alt_dir=alt_dir, jobs=jobs
             )
-        for res in handler(ds, results):
-            yield res
+        try:
+            for res in handler(ds, results):
+                yield res
+        finally:
+            differ.close()
 
 
-def _revrange_as_results(dset, revrange):
+def _revrange_as_results(dset, revrange, revision):
     """
     Generate results for a given revision range in a dataset.
 
+    The run records are read from the run index (see `iter_run_records`).
+
     Parameters
     ----------
     dset : Dataset
         The dataset object containing the repository.
     revrange : str
         The revision range to process.
+    revision : str
+        The commit the revision range ends at.
 
     Yields
     ------
     dict
-        A dictionary containing the status and run information for each commit
-        in the revision range. The dictionary includes:
+        A dictionary containing the status and run information for each job
+        finished in the revision range. The dictionary includes:
         - 'status': The status of the operation, always 'ok'.
         - 'ds': The dataset object.
         - 'commit': The commit hash.
         - 'parents': The parent commits of the commit.
-        - 'slurm_run_info': The run information if available.
-        - 'run_message': The run message if available.
+        - 'slurm_run_info': The run information.
+        - 'run_message': The run message.
 
     Raises
     ------
     ValueError
         If there is an error processing the commit message.
     """
-    ds_repo = dset.repo
-    rev_lines = ds_repo.get_revisions(
-        revrange, fmt="%H %P", options=["--reverse", "--topo-order"]
-    )
-    if not rev_lines:
-        return
-
-    for rev_line in rev_lines:
-        # The strip() below is necessary because, with the format above, a
-        # commit without any parent has a trailing space. (We could also use a
-        # custom `rev-list --parents ...` call to avoid this.)
-        fields = rev_line.strip().split(" ")
-        rev, parents = fields[0], fields[1:]
-        res = get_status_dict("slurm-reschedule", ds=dset, commit=rev, parents=parents)
-        full_msg = ds_repo.format_commit("%B", rev)
-        try:
-            msg, info = get_finish_info(dset, full_msg)
-        except ValueError as exc:
+    records = iter_run_records(dset, revrange, revision)
+    for rev, job_records in groupby(records, key=itemgetter("commit")):
+        job_records = list(job_records)
+        parents = job_records[0]["parents"]
+        if job_records[0]["error"]:
             # Recast the error so the message includes the revision.
-            raise ValueError("Error on {}'s message".format(rev)) from exc
-            
-        if msg and info:
-            job_failed = parse_job_status(msg)
-            
-        if info is not None:
-            if len(parents) != 1:
-                lgr.warning(
-                    "%s has run information but is a %s commit; "
-                    "it will not be re-executed",
-                    rev,
-                    "merge" if len(parents) > 1 else "root",
-                )
-                continue
-            res["slurm_run_info"] = info
-            res["run_message"] = msg
-            res["job_failed"] = job_failed
-        yield dict(res, status="ok")
+            raise ValueError("Error on {}'s message".format(rev)) from ValueError(
+                job_records[0]["error"]
+            )
+        if len(parents) != 1:
+            lgr.warning(
+                "%s has run information but is a %s commit; "
+                "it will not be re-executed",
+                rev,
+                "merge" if len(parents) > 1 else "root",
+            )
+            continue
+
+        # a commit of several finished jobs gives one result per job
+        for rec in job_records:
+            yield get_status_dict(
+                "slurm-reschedule",
+                ds=dset,
+                commit=rev,
+                parents=parents,
+                status="ok",
+                slurm_run_info=rec["slurm_run_info"],
+                run_message=rec["run_message"],
+                job_failed=rec["job_failed"],
+                grouped=len(job_records) > 1,
+            )
 
 
-def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jobs):
+def _rerun_as_results(
+    dset, revrange, revision, since, message, rev_branch, with_failed_jobs, differ
+):
     """
     Represent the rerun as result records.
 
@@ -339,6 +395,8 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jo
         The dataset to operate on.
     revrange : str
         The range of revisions to consider for rerunning.
+    revision : str
+        The revision the range ends at.
     since : str
         The starting point for the range of revisions.
     message : str
@@ -347,6 +405,9 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jo
         The branch to use for the rerun commits.
     with_failed_jobs: bool
         Re-schedule those commits where the job (partially) failed.
+    differ : TreeDiffer
+        The differ which computes the diffs of the results when they are
+        consumed. It is left to the caller to close it.
 
     Yields
     ------
@@ -355,8 +416,16 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jo
         specified revision range. Each dictionary contains information about
         the rerun action, status, and any relevant messages or exceptions.
     """
+    # only the commits with a slurm run command are looked at
+    results = _revrange_as_results(dset, revrange, revision)
+    # now drop the results which did not run successfully
+    if not with_failed_jobs:
+        results = (result for result in results if not result["job_failed"])
+
+    # the history is read as it is processed, only look ahead to the first
+    # schedule commit
     try:
-        results = _revrange_as_results(dset, revrange)
+        first = next(results, None)
     except ValueError as exc:
         ce = CapturedException(exc)
         yield get_status_dict(
@@ -364,15 +433,7 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jo
         )
         return
 
-    ds_repo = dset.repo
-    # Drop any leading commits that don't have a slurm run command. These would be
-    # skipped anyways.
-    results = [result for result in results if "slurm_run_info" in result]
-    # now drop the results which did not run successfully
-    if not with_failed_jobs:
-        results = [result for result in results if not result["job_failed"]]
-
-    if not results:
+    if first is None:
         yield get_status_dict(
             "slurm-reschedule",
             status="impossible",
@@ -381,6 +442,13 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jo
         )
         return
 
+    yield from _add_rerun_actions(dset, chain([first], results), message, differ)
+
+
+def _add_rerun_actions(dset, results, message, differ):
+    """Add the rerun action and the lazily computed diff to the results."""
+    ds_repo = dset.repo
+
     def skip_or_pick(hexsha, result, msg):
         result["rerun_action"] = "skip-or-pick"
         shortrev = ds_repo.get_hexsha(hexsha, short=True)
@@ -395,7 +463,12 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jo
                 res["status"] = "impossible"
             else:
                 res["rerun_action"] = "run"
-                res["diff"] = diff_revision(dset, hexsha)
+                res["diff"] = diff_revision(dset, hexsha, differ)
+                if res.get("grouped"):
+                    # the commit also has the outputs of other jobs
+                    res["diff"] = _restrict_diff_to_outputs(
+                        dset, res["diff"], res["slurm_run_info"]
+                    )
                 # This is the overriding message, if any, passed to this rerun.
                 res["rerun_message"] = message
         else:
@@ -406,6 +479,24 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch, with_failed_jo
         yield res
 
 
+def _restrict_diff_to_outputs(dset, diff, slurm_run_info):
+    """Keep the changes of `diff` within the outputs of a run record."""
+    outputs_dir = op.join(dset.path, slurm_run_info.get("pwd") or "")
+    outputs = [
+        op.normpath(op.join(outputs_dir, output))
+        for output in slurm_run_info.get("outputs", [])
+        + slurm_run_info.get("slurm_outputs", [])
+    ]
+    return (
+        d
+        for d in diff
+        if any(
+            d["path"] == output or d["path"].startswith(output + op.sep)
+            for output in outputs
+        )
+    )
+
+
 def _mark_nonrun_result(result, which):
     msg = dict(skip="skipping", pick="cherry picking")[which]
     result["rerun_action"] = which
@@ -450,7 +541,7 @@ def _rerun(dset, results, assume_ready=None, explicit=True, alt_dir=None, jobs=N
     for res in results:
         lgr.info(_get_rerun_log_msg(res))
         rerun_action = res.get("rerun_action")
-        if not rerun_action:
+        if not rerun_action or rerun_action == "skip":
             yield res
             continue
 
@@ -545,47 +636,20 @@ def _rerun(dset, results, assume_ready=None, explicit=True, alt_dir=None, jobs=N
                 _mark_nonrun_result(res, "pick")
                 yield res
         elif rerun_action == "run":
-            slurm_run_info = res["slurm_run_info"]
-            # Keep a "rerun" trail.
-            if "chain" in slurm_run_info:
-                slurm_run_info["chain"].append(res_hexsha)
-            else:
-                slurm_run_info["chain"] = [res_hexsha]
-
-            # now we have to find out what was modified during the last run,
-            # and enable re-modification ideally, we would bring back the
-            # entire state of the tree with #1424, but we limit ourself to file
-            # addition/not-in-place-modification for now
-            auto_outputs = (ap["path"] for ap in new_or_modified(res["diff"]))
-            outputs = slurm_run_info.get("outputs", [])
-            outputs_dir = op.join(dset.path, slurm_run_info["pwd"])
-            auto_outputs = [
-                p
-                for p in auto_outputs
-                # run records outputs relative to the "pwd" field.
-                if op.relpath(p, outputs_dir) not in outputs
-            ]
-
-            # remove the slurm outputs from the previous run from the outputs
-            old_slurm_outputs = slurm_run_info.get("slurm_outputs", [])
-            outputs = [output for output in outputs if output not in old_slurm_outputs]
-
-            message = res["rerun_message"] or res["run_message"]
-            message = check_job_pattern(message)
-
+            spec = _get_rerun_spec(dset, res)
             for r in schedule_cmd(
-                slurm_run_info["cmd"],
+                spec["cmd"],
                 dataset=dset,
-                inputs=slurm_run_info.get("inputs", []),
-                extra_inputs=slurm_run_info.get("extra_inputs", []),
-                outputs=outputs,
+                inputs=spec["inputs"],
+                extra_inputs=spec["extra_inputs"],
+                outputs=spec["outputs"],
                 assume_ready=assume_ready,
                 explicit=explicit,
-                rerun_outputs=auto_outputs,
-                message=message,
+                rerun_outputs=spec["rerun_outputs"],
+                message=spec["message"],
                 alt_dir=alt_dir,
                 jobs=jobs,
-                reslurm_run_info=slurm_run_info,
+                reslurm_run_info=spec["reslurm_run_info"],
             ):
                 yield r
         new_head = ds_repo.get_hexsha()
@@ -600,6 +664,222 @@ def _rerun(dset, results, assume_ready=None, explicit=True, alt_dir=None, jobs=N
         ds_repo.checkout(branch_to_restore)
 
 
+def _skip_unchanged(dset, results):
+    """
+    Skip the run results whose job would produce the same outputs again.
+
+    A job is rerun if the content identities of its inputs, as recorded at
+    schedule time, differ from the current ones, if it has none recorded, if
+    any of them is unknown (see `get_input_ids`), or if an earlier job of the
+    range which it depends on (one writing a path it reads) is rerun.
+    """
+    results = list(results)
+    runs = [res for res in results if res.get("rerun_action") == "run"]
+    infos = [res["slurm_run_info"] for res in runs]
+    current_ids = get_input_ids(
+        dset, [(info.get("pwd"), get_recorded_inputs(info)) for info in infos]
+    )
+    upstream = get_rerun_dependencies(
+        [
+            dict(
+                inputs=info.get("inputs"),
+                extra_inputs=info.get("extra_inputs"),
+                outputs=info.get("outputs"),
+                reslurm_run_info=info,
+            )
+            for info in infos
+        ],
+        upstream_only=True,
+    )
+
+    changed = []
+    for i, (res, info) in enumerate(zip(runs, infos)):
+        changed.append(
+            info.get("input_ids") != current_ids[i]
+            or None in current_ids[i].values()
+            or any(changed[j] for j in upstream[i])
+        )
+        if not changed[i]:
+            res["rerun_action"] = "skip"
+            res["message"] = (
+                "%s inputs did not change; skipping",
+                dset.repo.get_hexsha(res["commit"], short=True),
+            )
+
+    yield from results
+
+
+def _get_rerun_spec(dset, res):
+    """
+    Return what to schedule for a run result of `_rerun_as_results`.
+
+    Returns
+    -------
+    dict
+        The 'cmd', 'inputs', 'extra_inputs', 'outputs', 'rerun_outputs',
+        'message' and 'reslurm_run_info' of the job, as taken by
+        `schedule_cmd` and `schedule_batch_cmd`.
+    """
+    slurm_run_info = res["slurm_run_info"]
+    # Keep a "rerun" trail.
+    if "chain" in slurm_run_info:
+        slurm_run_info["chain"].append(res["commit"])
+    else:
+        slurm_run_info["chain"] = [res["commit"]]
+
+    # now we have to find out what was modified during the last run,
+    # and enable re-modification ideally, we would bring back the
+    # entire state of the tree with #1424, but we limit ourself to file
+    # addition/not-in-place-modification for now
+    auto_outputs = (ap["path"] for ap in new_or_modified(res["diff"]))
+    outputs = slurm_run_info.get("outputs", [])
+    outputs_dir = op.join(dset.path, slurm_run_info["pwd"])
+    auto_outputs = [
+        p
+        for p in auto_outputs
+        # run records outputs relative to the "pwd" field.
+        if op.relpath(p, outputs_dir) not in outputs
+    ]
+
+    # remove the slurm outputs from the previous run from the outputs
+    old_slurm_outputs = slurm_run_info.get("slurm_outputs", [])
+    outputs = [output for output in outputs if output not in old_slurm_outputs]
+
+    message = res["rerun_message"] or res["run_message"]
+    message = check_job_pattern(message)
+
+    return dict(
+        cmd=slurm_run_info["cmd"],
+        inputs=slurm_run_info.get("inputs", []),
+        extra_inputs=slurm_run_info.get("extra_inputs", []),
+        outputs=outputs,
+        rerun_outputs=auto_outputs,
+        message=message,
+        reslurm_run_info=slurm_run_info,
+    )
+
+
+def _rerun_parallel(dset, results, assume_ready=None, alt_dir=None, jobs=None):
+    """
+    Schedule all run results at once, chained by their inputs and outputs.
+
+    A job depends on every earlier job of the range which writes one of its
+    inputs or reads one of its outputs (see `get_rerun_dependencies`). The
+    jobs are scheduled as one batch by `schedule_batch_cmd`, which submits
+    each job with an sbatch dependency on the jobs it depends on.
+
+    Parameters
+    ----------
+    dset : Dataset
+        The dataset on which to rerun the actions.
+    results : iterable of dict
+        The results of `_rerun_as_results`.
+
+    Yields
+    ------
+    dict
+        The results of the skipped commits and of the scheduled jobs.
+    """
+    specs = []
+    for res in results:
+        lgr.info(_get_rerun_log_msg(res))
+        if res.get("rerun_action") == "run":
+            specs.append(_get_rerun_spec(dset, res))
+            continue
+        if res.get("rerun_action") == "skip-or-pick":
+            _mark_nonrun_result(res, "skip")
+        elif res.get("rerun_action"):
+            res["rerun_action"] = "skip"
+        yield res
+
+    if not specs:
+        return
+    for spec, after in zip(specs, get_rerun_dependencies(specs)):
+        spec["after"] = after
+    yield from schedule_batch_cmd(
+        specs, dataset=dset, assume_ready=assume_ready, alt_dir=alt_dir, jobs=jobs
+    )
+
+
+def get_rerun_dependencies(specs, upstream_only=False):
+    """
+    Find the earlier jobs each job has to wait for.
+
+    Job B depends on an earlier job A if A writes a path which B reads or
+    writes, or if A reads a path which B writes. With `upstream_only`, only
+    the first case counts, i.e. B depends on the jobs producing its inputs.
+    Paths overlap if they are
+    equal or one is a directory containing the other. Glob patterns are
+    reduced to the directory before their first wildcard.
+
+    Parameters
+    ----------
+    specs : list of dict
+        Job specifications with 'inputs', 'extra_inputs', 'outputs' and the
+        'reslurm_run_info' with the 'pwd' they are relative to, in the order
+        of the original jobs.
+
+    Returns
+    -------
+    list of list of int
+        For each job, the indices of the earlier jobs it depends on.
+    """
+
+    def paths(spec, keys):
+        pwd = spec["reslurm_run_info"].get("pwd") or op.curdir
+        result = set()
+        for key in keys:
+            for path in spec.get(key) or []:
+                parts = op.normpath(op.join(pwd, path)).split(op.sep)
+                for n, part in enumerate(parts):
+                    if any(c in part for c in "*?["):
+                        parts = parts[:n]
+                        break
+                result.add(op.sep.join(parts) or op.curdir)
+        return result
+
+    def containing(path):
+        # the directories containing a path, up to the dataset root
+        if path == op.curdir:
+            return []
+        parts = path.split(op.sep)
+        return [op.sep.join(parts[:n]) for n in range(1, len(parts))] + [op.curdir]
+
+    def add(index, path, job):
+        exact, below = index
+        exact.setdefault(path, set()).add(job)
+        for parent in containing(path):
+            below.setdefault(parent, set()).add(job)
+
+    def overlapping(index, path):
+        # the jobs with the path itself, a path below it, or a parent of it
+        exact, below = index
+        jobs = exact.get(path, set()) | below.get(path, set())
+        for parent in containing(path):
+            jobs |= exact.get(parent, set())
+        return jobs
+
+    # path -> jobs, once by the exact path and once by its parents, of the
+    # jobs looked at so far
+    read_index, write_index = ({}, {}), ({}, {})
+    dependencies = []
+    for spec in specs:
+        reads = paths(spec, ("inputs", "extra_inputs"))
+        writes = paths(spec, ("outputs",))
+        upstream = set()
+        for path in reads if upstream_only else reads | writes:
+            upstream |= overlapping(write_index, path)
+        if not upstream_only:
+            for path in writes:
+                upstream |= overlapping(read_index, path)
+        dependencies.append(sorted(upstream))
+        for path in reads:
+            add(read_index, path, len(dependencies) - 1)
+        for path in writes:
+            add(write_index, path, len(dependencies) - 1)
+    return dependencies
+
+
 def _get_rerun_log_msg(res):
     "Prepare log message for a rerun to summarize an action about to happen"
     msg = ""
@@ -678,7 +958,7 @@ def _get_script_handler(script, since, revision):
                 yield res
                 return
 
-            if "slurm_run_info" not in res:
+            if "slurm_run_info" not in res or res.get("rerun_action") == "skip":
                 continue
 
             slurm_run_info = res["slurm_run_info"]
@@ -722,39 +1002,177 @@ def _get_script_handler(script, since, revision):
     return fn
 
 
-def diff_revision(dataset, revision="HEAD"):
+def diff_revision(dataset, revision="HEAD", differ=None):
     """Yield files that have been added or modified in `revision`.
 
+    The diff is only computed once the generator is consumed.
+
     Parameters
     ----------
     dataset : Dataset
     revision : string, optional
         Commit-ish of interest.
+    differ : TreeDiffer, optional
+        The differ of the dataset to use. A new one is used if not given.
 
     Returns
     -------
-    Generator that yields AnnotatePaths instances
+    Generator that yields diff result records of the changed files
     """
-    if dataset.repo.commit_exists(revision + "^"):
-        fr = revision + "^"
-    else:
-        # No other commits are reachable from this revision.  Diff
-        # with an empty tree instead.
-        fr = PRE_INIT_COMMIT_SHA
-
-    def changed(res):
-        return res.get("action") == "diff" and res.get("state") != "clean"
-
-    diff = dataset.diff(
-        recursive=True,
-        fr=fr,
-        to=revision,
-        result_filter=changed,
-        return_type="generator",
-        result_renderer="disabled",
-    )
-    for r in diff:
-        yield r
+    if differ is not None:
+        yield from differ.diff(revision)
+        return
+    differ = TreeDiffer(dataset.path)
+    try:
+        yield from differ.diff(revision)
+    finally:
+        differ.close()
+
+
+class TreeDiffer:
+    """
+    Diff commits of a repository with one persistent `git diff-tree`.
+
+    Each commit is written to the standard input of a single
+    `git diff-tree --stdin` process, followed by a line which is not an
+    object name. git echoes such lines and flushes its output, so the echoed
+    line marks the end of the diff of the commit. Changed submodules are
+    diffed by a `TreeDiffer` of the installed subdataset.
+
+    Parameters
+    ----------
+    path : str
+        The path of the repository.
+    """
+
+    _END_MARKER = b"end-of-datalad-slurm-diff"
+
+    _STATES = {
+        "A": "added",
+        "D": "deleted",
+        "M": "modified",
+        "T": "modified",
+    }
+
+    _TYPES = {
+        "100644": "file",
+        "100755": "file",
+        "120000": "symlink",
+        "160000": "dataset",
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._proc = None
+        self._subdiffers = {}
+
+    def diff(self, commit, base=None):
+        """
+        Return the changes of `commit` against its parent or against `base`.
+
+        Root commits are compared with the empty tree.
+
+        Returns
+        -------
+        list of dict
+            Diff results with the absolute `path`, the `type` and the
+            `state` of every changed file, like those of `datalad diff`.
+        """
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(
+                [
+                    "git",
+                    "diff-tree",
+                    "--stdin",
+                    "-r",
+                    "--raw",
+                    "-z",
+                    "--root",
+                    "--no-commit-id",
+                ],
+                cwd=self.path,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        line = self._resolve(commit)
+        if base is not None:
+            line += " " + self._resolve(base)
+        self._proc.stdin.write(line.encode() + b"\n" + self._END_MARKER + b"\n")
+        self._proc.stdin.flush()
+
+        end = self._END_MARKER + b"\n"
+        chunks = []
+        # the end of the output read so far, enough to find the end marker
+        tail = b""
+        while not (tail == end or tail.endswith(b"\0" + end)):
+            chunk = self._proc.stdout.read1(1 << 16)
+            if not chunk:
+                raise ValueError(f"Cannot diff {commit} in {self.path}")
+            chunks.append(chunk)
+            tail = (tail + chunk)[-len(end) - 1 :]
+        out = b"".join(chunks)
+
+        # entries are ":<mode> <mode> <sha> <sha> <status>\0<path>\0"
+        fields = out[: -len(end)].split(b"\0")[:-1]
+        results = []
+        for meta, path in zip(fields[::2], fields[1::2]):
+            old_mode, new_mode, old_sha, new_sha, status = meta.decode()[1:].split(" ")
+            path = op.join(self.path, path.decode(errors="replace"))
+            state = self._STATES.get(status[0], "modified")
+            mode = old_mode if state == "deleted" else new_mode
+            res = dict(
+                action="diff",
+                status="ok",
+                path=path,
+                type=self._TYPES.get(mode, "file"),
+                state=state,
+                gitshasum=new_sha,
+                prev_gitshasum=old_sha,
+            )
+            results.append(res)
+            if res["type"] == "dataset" and state != "deleted":
+                results.extend(self._diff_subdataset(path, old_sha, new_sha))
+        return results
+
+    def _resolve(self, rev):
+        # git only reads object names from the standard input
+        if re.fullmatch(r"[0-9a-f]{40}|[0-9a-f]{64}", rev):
+            return rev
+        hexsha = subprocess.run(
+            ["git", "rev-parse", "--verify", "--quiet", rev + "^{commit}"],
+            cwd=self.path,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        if not hexsha:
+            raise ValueError(f"Cannot diff {rev} in {self.path}")
+        return hexsha
+
+    def _diff_subdataset(self, path, old_sha, new_sha):
+        # like `datalad diff`, only descend into installed subdatasets
+        if not op.exists(op.join(path, ".git")):
+            return []
+        if path not in self._subdiffers:
+            self._subdiffers[path] = TreeDiffer(path)
+        base = None if set(old_sha) == {"0"} else old_sha
+        try:
+            return self._subdiffers[path].diff(new_sha, base)
+        except ValueError:
+            # the recorded commit is not available in the subdataset
+            lgr.debug("Cannot diff subdataset %s at %s", path, new_sha)
+            return []
+
+    def close(self):
+        """Stop the git processes."""
+        for differ in self._subdiffers.values():
+            differ.close()
+        self._subdiffers = {}
+        if self._proc is not None:
+            self._proc.stdin.close()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc = None
 
 
 def new_or_modified(diff_results):
@@ -780,17 +1198,3 @@ def check_job_pattern(text):
         return None
 
     return text.replace(match.group(0), "").strip()
-
-def parse_job_status(text):
-    # Find the first line that starts with "Slurm job"
-    for line in text.split('\n'):
-        if line.startswith('Slurm job'):
-            # Split by colon and get everything after it
-            status = line.split(':')[1].strip()
-            if status == "Completed":
-                return False
-            else:
-                return True
-    
-    # Return None if no matching line is found
-    return None
@@ -14,13 +14,23 @@ import logging
 import os
 import subprocess
 import re
+import shlex
+import shutil
+import socket
+import sys
+import time
+import getpass
+import glob
+import hashlib
 import os.path as op
 from argparse import REMAINDER
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import mkdtemp
 import sqlite3
 
 import datalad
+from datalad.core.local.save import Save
 from datalad.distribution.dataset import (
     EnsureDataset,
     datasetmethod,
@@ -58,10 +68,117 @@ from datalad.core.local.run import (
     _get_substitutions,
 )
 
-from .common import connect_to_database
+from .common import (
+    connect_to_database,
+    format_run_message,
+    get_db_busy_timeout,
+    get_input_ids,
+    get_spool_dir,
+    lookup_result_cache,
+)
+from .staging import (
+    add_staging_refs,
+    connect_to_manifest,
+    format_size,
+    get_annex_objects,
+    get_staged,
+    get_staging_target,
+    record_staged,
+    stage_paths,
+)
 
 lgr = logging.getLogger("datalad.slurm.schedule")
 
+# seconds after which an output reservation of an unknown scheduler is stale
+_STALE_RESERVATION_AGE = 24 * 3600
+
+# Slurm's NO_VAL, scontrol shows it as the task id of pending array tasks
+_SLURM_NO_VAL = "4294967294"
+
+# batch script which runs the original one and leaves a completion marker,
+# see write_completion_marker_wrapper
+_COMPLETION_MARKER_WRAPPER = """\
+#!/bin/bash
+{header}
+# generated by 'datalad slurm-schedule --completion-marker'
+
+{script_cmd} "$@" &
+child=$!
+trap 'kill -TERM $child 2>/dev/null' TERM
+wait $child
+rc=$?
+if kill -0 $child 2>/dev/null; then
+    # interrupted by the trap
+    wait $child
+    rc=$?
+fi
+
+job_id=${{SLURM_ARRAY_JOB_ID:-$SLURM_JOB_ID}}
+marker=$job_id${{SLURM_ARRAY_TASK_ID:+_$SLURM_ARRAY_TASK_ID}}.json
+spool_dir={spool_dir}
+printf '{{"job_id": "%s", "array_task_id": "%s", "exit_code": %d, "end_time": %d, "node": "%s"}}\\n' \\
+    "$job_id" "$SLURM_ARRAY_TASK_ID" "$rc" "$(date +%s)" "$(hostname)" \\
+    > "$spool_dir/.$marker.tmp" && mv "$spool_dir/.$marker.tmp" "$spool_dir/$marker"
+exit $rc
+"""
+
+# sbatch options which take a value, and the long names of the short ones
+_SBATCH_SHORT_WITH_VALUE = set("AaBbCcDdeFGiJLMmNnopqStwx")
+_SBATCH_SHORT_NAMES = {
+    "a": "array",
+    "d": "dependency",
+    "D": "chdir",
+    "e": "error",
+    "J": "job-name",
+    "o": "output",
+}
+# long sbatch options which don't take a value unless given with '='
+_SBATCH_LONG_FLAGS = {
+    "contiguous",
+    "exclusive",
+    "get-user-env",
+    "help",
+    "hold",
+    "ignore-pbs",
+    "no-kill",
+    "no-requeue",
+    "nice",
+    "overcommit",
+    "oversubscribe",
+    "parsable",
+    "propagate",
+    "quiet",
+    "reboot",
+    "requeue",
+    "spread-job",
+    "test-only",
+    "usage",
+    "use-min-nodes",
+    "verbose",
+    "version",
+    "wait",
+}
+
+# accounting fields for the job environment file if scontrol can't provide it
+_SACCT_ENV_FIELDS = (
+    "JobName",
+    "Partition",
+    "Account",
+    "QOS",
+    "NNodes",
+    "NCPUS",
+    "ReqMem",
+    "Timelimit",
+    "Submit",
+    "Start",
+    "End",
+    "Elapsed",
+    "State",
+    "ExitCode",
+    "NodeList",
+    "WorkDir",
+)
+
 assume_ready_opt = Parameter(
     args=("--assume-ready",),
     constraints=EnsureChoice(None, "inputs", "outputs", "both"),
@@ -234,12 +351,60 @@ class Schedule(Interface):
             relative dir is the current pwd relative to the repository root.
             Then the job is scheduled there. In the end all output is moved 
             (not copied) back to the relative path inside the repository, 
-            to be added and committed.
+            to be added and committed. Set the datalad.slurm.copy-back config
+            to "copy" to keep the outputs in the alt-dir as well. With the
+            datalad.slurm.transfer-partition config, both transfers run as
+            Slurm jobs on that partition instead, chained to the job.
             This allows to make the Slurm job run on a parallel filesystem
             while the Datalad repository stays on a local filesystem like /tmp/ or
             /scratch/. This reduced the metadata pressure on HPC filesystems.
             """,
         ),
+        from_file=Parameter(
+            args=("--from-file",),
+            metavar="FILE",
+            doc="""Schedule many jobs at once from the job specifications in
+            FILE (or stdin if FILE is '-'). FILE contains one JSON object per
+            line with the keys "cmd" and "outputs" and optionally "inputs",
+            "extra_inputs" and "message". All jobs are checked for output
+            conflicts among each other and against the open jobs in one pass,
+            the worktree is prepared once for all of them and all jobs are
+            recorded in a single database transaction. No COMMAND must be
+            given together with this option.""",
+        ),
+        defer_job_info=Parameter(
+            args=("--defer-job-info",),
+            action="store_true",
+            doc="""Return as soon as the job was submitted. Only the job id
+            and the StdOut/StdErr file name patterns from the sbatch call are
+            recorded, the slurm log files and the job environment file are
+            determined by slurm-finish. This avoids the scontrol queries at
+            submission time, which can be slow when the Slurm controller is
+            busy.""",
+        ),
+        completion_marker=Parameter(
+            args=("--completion-marker",),
+            action="store_true",
+            doc="""Let the job leave a completion marker with its exit code
+            and end time in the spool directory (config
+            `datalad.slurm.spool-dir`, by default `.git/datalad-slurm/markers`)
+            when it ends, so that `slurm-finish --watch` notices the end of
+            the job without polling Slurm. The batch script is run from a
+            generated wrapper script with the same #SBATCH options. Only
+            available for commands of the form 'sbatch [OPTIONS] SCRIPT
+            [ARGS]'.""",
+        ),
+        reuse=Parameter(
+            args=("--reuse",),
+            action="store_true",
+            doc="""Do not submit a job if an identical job ran successfully
+            before. A job is identical if it has the same command, working
+            directory and outputs, its inputs (including the sbatch script)
+            have the same content and the `datalad.run.substitutions` used by
+            the command have the same values. Its outputs are then checked
+            out from the commit of the earlier run and committed with a run
+            record of that job right away.""",
+        ),
         jobs=jobs_opt,
     )
     _params_[
@@ -264,8 +429,53 @@ class Schedule(Interface):
         check_outputs=True,
         dry_run=None,
         alt_dir= None,
+        from_file=None,
+        defer_job_info=False,
+        completion_marker=False,
+        reuse=False,
         jobs=None,
     ):
+        if from_file:
+            ds = require_dataset(
+                dataset, check_installed=True, purpose="schedule slurm jobs"
+            )
+            if cmd or dry_run:
+                yield get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status="impossible",
+                    message=(
+                        "Neither a command nor a dry run can be combined "
+                        "with --from-file."
+                    ),
+                )
+                return
+            try:
+                specs = load_batch_specs(from_file)
+            except (OSError, ValueError) as e:
+                yield get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status="error",
+                    message=("Cannot read job specifications: %s", e),
+                )
+                return
+            for r in schedule_batch_cmd(
+                specs,
+                dataset=dataset,
+                expand=expand,
+                assume_ready=assume_ready,
+                message=message,
+                check_outputs=check_outputs,
+                alt_dir=alt_dir,
+                defer_job_info=defer_job_info,
+                completion_marker=completion_marker,
+                reuse=reuse,
+                jobs=jobs,
+            ):
+                yield r
+            return
+
         for r in schedule_cmd(
             cmd,
             dataset=dataset,
@@ -277,6 +487,9 @@ class Schedule(Interface):
             check_outputs=check_outputs,
             dry_run=dry_run,
             alt_dir=alt_dir,
+            defer_job_info=defer_job_info,
+            completion_marker=completion_marker,
+            reuse=reuse,
             jobs=jobs,
         ):
             yield r
@@ -318,6 +531,121 @@ class Schedule(Interface):
             generic_result_renderer(res)
 
 
+def _submit_slurm_job(ds, command, pwd, completion_marker=False):
+    """Submit a job, wrapped to leave a completion marker if requested.
+
+    Returns the same as `_execute_slurm_command`.
+    """
+    if not completion_marker:
+        return _execute_slurm_command(command, pwd)
+
+    wrapper_parent = op.join(ds.path, ".git", "datalad-slurm")
+    os.makedirs(wrapper_parent, exist_ok=True)
+    wrapper_dir = mkdtemp(prefix="wrapper-", dir=wrapper_parent)
+    try:
+        wrapped_command = write_completion_marker_wrapper(
+            command, pwd, wrapper_dir, get_spool_dir(ds)
+        )
+        # sbatch keeps a copy of the batch script, the wrapper is not needed
+        # after the submission
+        return _execute_slurm_command(wrapped_command, pwd)
+    finally:
+        shutil.rmtree(wrapper_dir, ignore_errors=True)
+
+
+def _is_sbatch_script_command(command):
+    parsed = parse_sbatch_command(command)
+    return bool(parsed) and parsed["script_index"] is not None
+
+
+def write_completion_marker_wrapper(command, pwd, wrapper_dir, spool_dir):
+    """
+    Write a batch script which runs the one of an sbatch command and leaves
+    a completion marker.
+
+    The wrapper has the same #SBATCH options and name as the original batch
+    script, which it runs with the interpreter from its shebang line. When the
+    script has ended, the wrapper writes `<job id>[_<array task id>].json`
+    with the exit code and the end time to `spool_dir`.
+
+    Parameters
+    ----------
+    command : str
+        The sbatch command.
+    pwd : str
+        The directory the command is submitted from.
+    wrapper_dir : str
+        The directory to write the wrapper to.
+    spool_dir : str
+        The directory for the completion markers.
+
+    Returns
+    -------
+    str
+        The sbatch command which submits the wrapper instead of the original
+        batch script.
+
+    Raises
+    ------
+    ValueError
+        If the command is not of the form 'sbatch [OPTIONS] SCRIPT [ARGS]'.
+    """
+    parsed = parse_sbatch_command(command)
+    if not parsed or parsed["script_index"] is None:
+        raise ValueError(f"Cannot wrap '{command}', it is not an sbatch script call")
+    args = parsed["args"]
+    script_index = parsed["script_index"]
+    script = op.abspath(op.join(pwd, args[script_index]))
+
+    interpreter = ["/bin/sh"]
+    header = []
+    with open(script) as f:
+        for n, line in enumerate(f):
+            stripped = line.strip()
+            if n == 0 and stripped.startswith("#!"):
+                interpreter = shlex.split(stripped[2:])
+                continue
+            if stripped and not stripped.startswith("#"):
+                break
+            if stripped.startswith("#SBATCH"):
+                header.append(stripped)
+
+    os.makedirs(spool_dir, exist_ok=True)
+    wrapper = op.join(wrapper_dir, op.basename(script))
+    with open(wrapper, "w") as f:
+        f.write(
+            _COMPLETION_MARKER_WRAPPER.format(
+                header="\n".join(header),
+                script_cmd=shlex.join(interpreter + [script]),
+                spool_dir=shlex.quote(spool_dir),
+            )
+        )
+    os.chmod(wrapper, 0o755)
+
+    return shlex.join(args[:script_index] + [wrapper] + args[script_index + 1 :])
+
+
+def get_completion_marker_names(job_id, array=None):
+    """
+    Return the names of the completion markers of a job.
+
+    Parameters
+    ----------
+    job_id : str
+        The Slurm job ID.
+    array : str, optional
+        The --array specification of an array job.
+
+    Returns
+    -------
+    list of str
+        One marker per array task, or one for the job.
+    """
+    if array:
+        return [f"{name}.json" for name in generate_array_job_names(str(job_id), array)]
+    return [f"{job_id}.json"]
+
+
 def _execute_slurm_command(command, pwd):
     """Execute a Slurm submission command and create a job tracking file.
 
@@ -390,6 +718,9 @@ def schedule_cmd(
     check_outputs=True,
     dry_run=False,
     alt_dir= None,
+    defer_job_info=False,
+    completion_marker=False,
+    reuse=False,
     jobs=None,
     explicit=True,
     extra_info=None,
@@ -507,8 +838,7 @@ def schedule_cmd(
             )
             return
 
-    wildcard_list = ["*", "?", "[", "]", "!", "^", "{", "}"]
-    if any(char in output for char in wildcard_list for output in outputs):
+    if _has_wildcards(outputs):
         yield get_status_dict(
             "slurm-schedule",
             ds=ds,
@@ -522,7 +852,8 @@ def schedule_cmd(
     # everything below expects the string-form of the command
     cmd = normalize_command(cmd)
     # pull substitutions from config
-    cmd_fmt_kwargs = _get_substitutions(ds)
+    substitutions = _get_substitutions(ds)
+    cmd_fmt_kwargs = dict(substitutions)
     # amend with unexpanded dependency/output specifications, which might
     # themselves contain substitution placeholder
     for n, val in specs.items():
@@ -590,12 +921,21 @@ def schedule_cmd(
         )
         return
 
+    if alt_dir:
+        try:
+            _get_staging_mode(ds)
+        except ValueError as e:
+            yield get_status_dict(
+                "slurm-schedule", ds=ds, status="error", message=str(e)
+            )
+            return
+
     if not dry_run:
         yield from _prep_worktree(
             ds_path,
             pwd,
             globbed,
-            assume_ready=assume_ready,
+            assume_ready=_get_prep_assume_ready(ds, alt_dir, assume_ready),
             remove_outputs=remove_outputs,
             rerun_outputs=rerun_outputs,
             jobs=None,
@@ -630,6 +970,19 @@ def schedule_cmd(
         )
         return
 
+    if completion_marker and not _is_sbatch_script_command(cmd_expanded):
+        yield get_status_dict(
+            "slurm-schedule",
+            ds=ds,
+            status="impossible",
+            message=(
+                "--completion-marker needs a command of the form "
+                "'sbatch [OPTIONS] SCRIPT [ARGS]', not: %s",
+                cmd_expanded,
+            ),
+        )
+        return
+
     # amend commit message with `run` info:
     # - pwd if inside the dataset
     # - the command itself
@@ -657,6 +1010,12 @@ def schedule_cmd(
         slurm_run_info["pwd"] = rel_pwd
     if ds.id:
         slurm_run_info["dsid"] = ds.id
+    # to find out later whether the inputs changed since this run
+    slurm_run_info["input_ids"] = get_input_ids(
+        ds, [(rel_pwd, get_recorded_inputs(slurm_run_info))]
+    )[0]
+    # any later job with the same key can reuse the result of this one
+    slurm_run_info["cache_key"] = get_cache_key(slurm_run_info, substitutions)
     if extra_info:
         slurm_run_info.update(extra_info)
 
@@ -686,31 +1045,117 @@ def schedule_cmd(
             )
             return
 
-    target_pwd= pwd
-    if alt_dir:
-        target_pwd= op.join(alt_dir,rel_pwd)
-
-        for inp in [inputs, extra_inputs]:
-            if inp:
-                for i in inp:
-
-                    dirname= op.dirname( i.rstrip("/") ) # remove trailing '/', otherwise dirname() gives the wrong result
-                    source_path= op.join(pwd,i)
-                    target_dir= op.join(alt_dir,rel_pwd,dirname)
-                    os.makedirs( target_dir, exist_ok=True)
+    # lock the outputs before submission, the check above only
+    # avoids preparing the worktree for a job which can't be scheduled
+    reservation_ids, status_ok = reserve_outputs(
+        ds, [(expanded_specs["outputs"], locked_prefixes)], check_outputs=check_outputs
+    )
+    if not status_ok:
+        yield get_status_dict(
+            "slurm-schedule",
+            ds=ds,
+            status="error",
+            message=("Database connection cannot be established"),
+        )
+        return
+    reservation_id = reservation_ids[0]
+    if isinstance(reservation_id, str):
+        yield get_status_dict(
+            "slurm-schedule",
+            ds=ds,
+            status="impossible",
+            message=(
+                "There are conflicting outputs with %s. "
+                "Finish those jobs or adjust output for the current job first.",
+                reservation_id,
+            ),
+        )
+        return
 
-                    command=f"cp -r -L -u {source_path} {target_dir}/"
-                    print(f"        copy to alternative dir: '{command}' in '{pwd}'")
-                    result = subprocess.run(
-                        command, shell=True, capture_output=True, text=True, cwd=pwd
-                    )
-                    # Extract result from copy command
-                    #stdout = result.stdout
-                    #print("            result: ", result.stdout)
+    try:
+        # a reused result overwrites the outputs, so they are locked as well
+        if reuse and (yield from _reuse_cached_result(ds, slurm_run_info, message)):
+            release_reservations(ds, [reservation_id])
+            return
+        try:
+            target_pwd, stage_in_job_ids = _stage_alt_dir_inputs(
+                ds,
+                pwd,
+                rel_pwd,
+                alt_dir,
+                inputs,
+                extra_inputs,
+                input_ids=slurm_run_info["input_ids"],
+            )
+            if stage_in_job_ids:
+                cmd_expanded = add_sbatch_dependency(cmd_expanded, stage_in_job_ids)
+        except (RuntimeError, ValueError) as e:
+            release_reservations(ds, [reservation_id])
+            yield get_status_dict(
+                "slurm-schedule", ds=ds, status="error", message=str(e)
+            )
+            return
 
+        cmd_exitcode, exc, slurm_job_id = _submit_slurm_job(
+            ds, cmd_expanded, target_pwd, completion_marker
+        )
+        if slurm_job_id:
+            _add_staging_refs(
+                ds, alt_dir, slurm_job_id, rel_pwd, inputs, extra_inputs
+            )
+            slurm_run_info["exit"] = cmd_exitcode
+            job_info = _add_slurm_job_info(
+                slurm_run_info,
+                ds_path,
+                slurm_job_id,
+                alt_dir,
+                cmd_expanded,
+                target_pwd,
+                defer_job_info,
+                completion_marker,
+            )
+            slurm_outputs = slurm_run_info["slurm_outputs"]
+
+            # Re-glob to capture any new outputs.
+            #
+            # TODO: If a warning or error is desired when an --output pattern doesn't
+            # have a match, this would be the spot to do it.
+            if explicit or expand in ["outputs", "both"]:
+                # also for explicit mode we have to re-glob to be able to save all
+                # matching outputs
+                globbed["outputs"].expand(refresh=True)
+                if expand in ["outputs", "both"]:
+                    slurm_run_info["outputs"] = globbed["outputs"].paths
+                    # add the slurm outputs and environment files
+                    # these are not captured in the initial globbing
+                    slurm_run_info["outputs"].extend(slurm_outputs)
+
+            _submit_stage_out_job(ds, alt_dir, slurm_run_info, job_info)
+
+            # add extra info for re-scheduled jobs
+            if reslurm_run_info:
+                slurm_id_old = reslurm_run_info["slurm_job_id"]
+                message += f"\n\nRe-submission of job {slurm_id_old}."
+
+            msg = message if message else None
+            msg_path = None
+
+            status_ok = add_to_database(
+                ds,
+                slurm_run_info,
+                msg,
+                expanded_specs["outputs"],
+                locked_prefixes,
+                alt_dir,
+                reservation_id=reservation_id,
+                job_info=job_info,
+            )
+    except BaseException:
+        release_reservations(ds, [reservation_id])
+        raise
 
-    cmd_exitcode, exc, slurm_job_id = _execute_slurm_command(cmd_expanded, target_pwd) # later target_pwd here
     if not slurm_job_id:
+        release_reservations(ds, [reservation_id])
         yield get_status_dict(
             "slurm-schedule",
             ds=ds,
@@ -719,61 +1164,28 @@ def schedule_cmd(
                      "Check your submission script exists and is valid."),
         )
         return
-
-    slurm_run_info["exit"] = cmd_exitcode
-    # TODO: expand these paths
-    slurm_outputs, slurm_env_file = get_slurm_output_files(ds_path,slurm_job_id,alt_dir)
-    #slurm_run_info["outputs"].extend(slurm_outputs) ## TODO don't have slurm outputs twice, in "outputs" and in "slurm_outputs"
-    #slurm_run_info["outputs"].append(slurm_env_file)
-    slurm_run_info["slurm_outputs"] = slurm_outputs
-    slurm_run_info["slurm_outputs"].append(slurm_env_file)
-
-    # add the slurm job id to the run info
-    slurm_run_info["slurm_job_id"] = slurm_job_id
-
-    # Re-glob to capture any new outputs.
-    #
-    # TODO: If a warning or error is desired when an --output pattern doesn't
-    # have a match, this would be the spot to do it.
-    if explicit or expand in ["outputs", "both"]:
-        # also for explicit mode we have to re-glob to be able to save all
-        # matching outputs
-        globbed["outputs"].expand(refresh=True)
-        if expand in ["outputs", "both"]:
-            slurm_run_info["outputs"] = globbed["outputs"].paths
-            # add the slurm outputs and environment files
-            # these are not captured in the initial globbing
-            slurm_run_info["outputs"].extend(slurm_outputs)
+    if not status_ok:
+        release_reservations(ds, [reservation_id])
+        yield get_status_dict(
+            "slurm-schedule",
+            ds=ds,
+            status="error",
+            message=(
+                "Slurm job %s was submitted but cannot be recorded in the database",
+                slurm_job_id,
+            ),
+        )
+        return
 
     # abbreviate version of the command for illustrative purposes
     cmd_shorty = _format_cmd_shorty(cmd_expanded)
 
-    # add extra info for re-scheduled jobs
-    if reslurm_run_info:
-        slurm_id_old = reslurm_run_info["slurm_job_id"]
-        message += f"\n\nRe-submission of job {slurm_id_old}."
-
-    msg = message if message else None
-    msg_path = None
-
     expected_exit = reslurm_run_info.get("exit", 0) if reslurm_run_info else None
     if cmd_exitcode and expected_exit != cmd_exitcode:
         status = "error"
     else:
         status = "ok"
 
-    status_ok = add_to_database(
-        ds, slurm_run_info, msg, expanded_specs["outputs"], locked_prefixes, alt_dir
-    )
-    if not status_ok:
-        yield get_status_dict(
-            "slurm-schedule",
-            ds=ds,
-            status="error",
-            message=("Database connection cannot be established"),
-        )
-        return
-
     run_result = get_status_dict(
         "slurm-schedule",
         ds=ds,
@@ -805,101 +1217,1435 @@ def schedule_cmd(
     yield run_result
 
 
-def check_output_conflict(dset, outputs, output_prefixes):
-    """
-    Check for conflicts between provided outputs and existing outputs in the database.
+def schedule_batch_cmd(
+    specs,
+    dataset=None,
+    expand=None,
+    assume_ready=None,
+    message=None,
+    check_outputs=True,
+    alt_dir=None,
+    defer_job_info=False,
+    completion_marker=False,
+    reuse=False,
+    jobs=None,
+):
+    """Schedule many slurm commands in `dataset` in one go.
+
+    This is the batch counterpart of `schedule_cmd`. The dataset is opened,
+    the substitutions are read, the worktree is prepared and the database is
+    written only once for all job specifications. Output conflicts are checked
+    among the given jobs and against the open jobs in the database in a single
+    pass.
 
     Parameters
     ----------
-    dset : object
-        Dataset object containing repository information.
-    outputs : list of str
-        List of strings representing output paths to check.
+    specs : list of dict
+        Job specifications. Each one needs a 'cmd' and 'outputs' and can have
+        'inputs', 'extra_inputs' and 'message'. 'after' lists the indices of
+        earlier specifications in `specs` whose jobs must complete
+        successfully before this job starts; the job is then submitted with
+        an sbatch dependency on them. 'reslurm_run_info' and 'rerun_outputs'
+        are the `schedule_cmd` parameters of the same name, used by
+        `slurm-reschedule --parallel`.
+    message : str, optional
+        Message for all jobs which don't specify their own.
 
-    Returns
-    -------
-    list
-        List of slurm_job_ids that have conflicting outputs.
-        Empty list if no conflicts or if database error occurs.
+    Yields
+    ------
+    Result records for the scheduled jobs.
     """
-    # Connect to database
-    con, cur = connect_to_database(dset, row_factory=True)
-    if not con or not cur:
-        return None, None
-
-    # Get all existing outputs from database
-    try:
-        # first check the CURRENT NAMES against PRIOR PREFIXES
-        cur.execute("SELECT prefix FROM locked_prefixes")
-        existing_prefixes = cur.fetchall()
-        has_match = bool(set(existing_prefixes) & set(outputs))
-        if has_match:
-            return True, True
-
-        # now check CURRENT PREFIXES and against PRIOR NAMES
-        cur.execute("SELECT name FROM locked_names")
-        existing_names = cur.fetchall()
-        has_match = bool(set(existing_names) & set(output_prefixes))
-        if has_match:
-            return True, True
-
-        # now check CURRENT NAMES and against PRIOR NAMES
-        has_match = bool(set(existing_names) & set(outputs))
-        if has_match:
-            return True, True
+    pwd, rel_pwd = get_command_pwds(dataset)
+    ds = require_dataset(
+        dataset, check_installed=True, purpose="track command outcomes"
+    )
+    ds_path = ds.path
 
-    except sqlite3.Error:
-        return False, True
-    return False, True
+    lgr.debug("tracking batch of %d commands underneath %s", len(specs), ds)
 
+    if alt_dir and not op.isdir(alt_dir):
+        yield get_status_dict(
+            "slurm-schedule",
+            ds=ds,
+            status="error",
+            message=(f"Alternative job directory '{alt_dir}' doesn't exist"),
+        )
+        return
 
-def get_sub_paths(paths):
-    """
-    Extract sub-paths from directories.
+    # the staging mode is checked once, not for each job
+    if alt_dir:
+        try:
+            _get_staging_mode(ds)
+        except ValueError as e:
+            yield get_status_dict(
+                "slurm-schedule", ds=ds, status="error", message=str(e)
+            )
+            return
 
-    Parameters
-    ----------
-    paths : list of str
-        List of directory paths.
+    # outputs are recorded relative to the repository root
+    rel_path = op.relpath(Path.cwd(), ds_path)
+    substitutions = _get_substitutions(ds)
 
-    Returns
-    -------
-    list of str
-        List of sub-paths extracted from the input paths.
+    batch = []
+    for n, spec in enumerate(specs):
+        outputs = ensure_list(spec.get("outputs"))
+        if not spec.get("cmd") or not outputs:
+            yield get_status_dict(
+                "slurm-schedule",
+                ds=ds,
+                status="impossible",
+                message=(
+                    "Job specification %d needs a command and at least one output.",
+                    n,
+                ),
+            )
+            continue
+        if _has_wildcards(outputs):
+            yield get_status_dict(
+                "slurm-schedule",
+                ds=ds,
+                status="impossible",
+                message=(
+                    "Job specification %d: wildcards in output_files are forbidden "
+                    "due to potential conflicts.",
+                    n,
+                ),
+            )
+            continue
 
-    Examples
-    --------
-    >>> get_sub_paths(['/a/b/c/d/'])
-    ['/a', '/a/b', '/a/b/c']
-    """
-    # Set to store unique sub-paths
-    all_sub_paths = set()
+        after = ensure_list(spec.get("after"))
+        if not all(isinstance(i, int) and 0 <= i < n for i in after):
+            yield get_status_dict(
+                "slurm-schedule",
+                ds=ds,
+                status="impossible",
+                message=(
+                    "Job specification %d can only depend on earlier job "
+                    "specifications, not on %s.",
+                    n,
+                    after,
+                ),
+            )
+            continue
 
-    for path in paths:
-        # Remove trailing slash if present
-        path = path.rstrip("/")
+        reslurm_run_info = spec.get("reslurm_run_info")
+        job_pwd, job_rel_pwd = pwd, rel_pwd
+        if reslurm_run_info and reslurm_run_info.get("pwd"):
+            # recording is relative to the dataset
+            job_pwd = op.normpath(op.join(ds_path, reslurm_run_info["pwd"]))
+            job_rel_pwd = op.relpath(job_pwd, ds_path)
 
-        # Split the path into components
-        components = path.split("/")
+        job_specs = {
+            k: ensure_list(spec.get(k)) for k in ("inputs", "extra_inputs", "outputs")
+        }
+        job_specs["outputs"] = [
+            op.join(rel_path, output.rstrip("/")) for output in job_specs["outputs"]
+        ]
+        cmd_fmt_kwargs = dict(substitutions)
+        for k, val in job_specs.items():
+            if val:
+                cmd_fmt_kwargs[k] = val
+        try:
+            expanded_specs = {
+                k: _format_iospecs(v, **cmd_fmt_kwargs) for k, v in job_specs.items()
+            }
+            globbed = {
+                k: GlobbedPaths(
+                    v,
+                    pwd=job_pwd,
+                    expand=expand
+                    in (["both"] + (["outputs"] if k == "outputs" else ["inputs"])),
+                )
+                for k, v in expanded_specs.items()
+            }
+        except KeyError as exc:
+            yield get_status_dict(
+                "slurm-schedule",
+                ds=ds,
+                status="impossible",
+                message=(
+                    "Job specification %d: input/output specification has an "
+                    "unrecognized placeholder: %s",
+                    n,
+                    exc,
+                ),
+            )
+            continue
 
-        # Build sub-paths, excluding the full path
-        current_path = ""
-        for component in components[:-1]:  # Stop before the last component
-            current_path += component + "/"
-            all_sub_paths.add(current_path.rstrip("/"))
+        batch.append(
+            dict(
+                cmd=normalize_command(spec["cmd"]),
+                specs=job_specs,
+                expanded_specs=expanded_specs,
+                globbed=globbed,
+                cmd_fmt_kwargs=cmd_fmt_kwargs,
+                locked_prefixes=get_sub_paths(expanded_specs["outputs"]),
+                message=spec.get("message", message),
+                index=n,
+                after=after,
+                pwd=job_pwd,
+                rel_pwd=job_rel_pwd,
+                reslurm_run_info=reslurm_run_info,
+                rerun_outputs=ensure_list(spec.get("rerun_outputs")),
+            )
+        )
 
-    # Convert set to sorted list for consistent output
-    return sorted(list(all_sub_paths))
+    if not batch:
+        return
 
+    # check and lock the outputs of all jobs in one transaction
+    reservations, status_ok = reserve_outputs(
+        ds,
+        [(job["expanded_specs"]["outputs"], job["locked_prefixes"]) for job in batch],
+        check_outputs=check_outputs,
+    )
+    if not status_ok:
+        yield get_status_dict(
+            "slurm-schedule",
+            ds=ds,
+            status="error",
+            message=("Database connection cannot be established"),
+        )
+        return
 
-def get_slurm_output_files(ds_root, job_id, alt_dir=None):
-    """
-    Get the relative paths to StdOut and StdErr files for a Slurm job.
+    conflicting = []
+    accepted = []
+    for job, reservation in zip(batch, reservations):
+        if isinstance(reservation, str):
+            conflicting.append((job, reservation))
+        else:
+            job["reservation_id"] = reservation
+            accepted.append(job)
+    batch = accepted
 
-    Parameters
-    ----------
-    job_id : str
-        The Slurm job ID.
+    entries = []
+    run_results = []
+    try:
+        for job, conflict_with in conflicting:
+            yield get_status_dict(
+                "slurm-schedule",
+                ds=ds,
+                status="impossible",
+                message=(
+                    "Outputs of '%s' conflict with %s.",
+                    _format_cmd_shorty(job["cmd"]),
+                    conflict_with,
+                ),
+            )
+        if not batch:
+            return
+
+        # prepare the worktree once for the union of all inputs and outputs
+        union_globbed = {
+            k: GlobbedPaths(
+                list(
+                    dict.fromkeys(
+                        p if job["pwd"] == pwd else op.join(job["pwd"], p)
+                        for job in batch
+                        for p in job["expanded_specs"][k] or []
+                    )
+                ),
+                pwd=pwd,
+                expand=expand
+                in (["both"] + (["outputs"] if k == "outputs" else ["inputs"])),
+            )
+            for k in ("inputs", "extra_inputs", "outputs")
+        }
+        yield from _prep_worktree(
+            ds_path,
+            pwd,
+            union_globbed,
+            assume_ready=_get_prep_assume_ready(ds, alt_dir, assume_ready),
+            rerun_outputs=list(
+                dict.fromkeys(p for job in batch for p in job["rerun_outputs"])
+            )
+            or None,
+            jobs=None,
+        )
+
+        to_submit = []
+        for job in batch:
+            cmd = job["cmd"]
+            globbed = job["globbed"]
+            cmd_fmt_kwargs = dict(
+                job["cmd_fmt_kwargs"],
+                pwd=job["pwd"],
+                dspath=ds_path,
+                tmpdir=mkdtemp(prefix="datalad-run-") if "{tmpdir}" in cmd else "",
+                inputs=globbed["inputs"],
+                outputs=globbed["outputs"],
+            )
+            try:
+                cmd_expanded = format_command(ds, cmd, **cmd_fmt_kwargs)
+            except KeyError as exc:
+                yield get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status="impossible",
+                    message=("command has an unrecognized placeholder: %s", exc),
+                )
+                continue
+            if completion_marker and not _is_sbatch_script_command(cmd_expanded):
+                yield get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status="impossible",
+                    message=(
+                        "--completion-marker needs a command of the form "
+                        "'sbatch [OPTIONS] SCRIPT [ARGS]', not: %s",
+                        cmd_expanded,
+                    ),
+                )
+                continue
+            if job["after"] and not parse_sbatch_command(cmd_expanded):
+                yield get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status="impossible",
+                    message=(
+                        "Dependencies on other jobs need an sbatch command, not: %s",
+                        cmd_expanded,
+                    ),
+                )
+                continue
+
+            reslurm_run_info = job["reslurm_run_info"]
+            slurm_run_info = {
+                "cmd": cmd,
+                "chain": reslurm_run_info["chain"] if reslurm_run_info else [],
+            }
+            for k in job["specs"]:
+                slurm_run_info[k] = (
+                    globbed[k].paths
+                    if expand
+                    in ["both"] + (["outputs"] if k == "outputs" else ["inputs"])
+                    else job["expanded_specs"][k]
+                )
+            if job["rel_pwd"] is not None:
+                slurm_run_info["pwd"] = job["rel_pwd"]
+            if ds.id:
+                slurm_run_info["dsid"] = ds.id
+
+            job["cmd_expanded"] = cmd_expanded
+            job["slurm_run_info"] = slurm_run_info
+            to_submit.append(job)
+
+        # to find out later whether the inputs changed since these runs
+        for job, input_ids in zip(
+            to_submit,
+            get_input_ids(
+                ds,
+                [
+                    (job["rel_pwd"], get_recorded_inputs(job["slurm_run_info"]))
+                    for job in to_submit
+                ],
+            ),
+        ):
+            job["slurm_run_info"]["input_ids"] = input_ids
+            job["slurm_run_info"]["cache_key"] = get_cache_key(
+                job["slurm_run_info"], substitutions
+            )
+
+        # jobs reusing cached results count as done for their dependents
+        reused = set()
+        if reuse:
+            for job in list(to_submit):
+                if (
+                    yield from _reuse_cached_result(
+                        ds, job["slurm_run_info"], job["message"]
+                    )
+                ):
+                    reused.add(job["index"])
+                    to_submit.remove(job)
+
+        # inputs shared by several jobs are staged by a single stage-in job
+        stage_in_jobs = {}
+        for job in to_submit:
+            try:
+                job["target_pwd"], job["stage_in_job_ids"] = _stage_alt_dir_inputs(
+                    ds,
+                    job["pwd"],
+                    job["rel_pwd"],
+                    alt_dir,
+                    job["specs"]["inputs"],
+                    job["specs"]["extra_inputs"],
+                    input_ids=job["slurm_run_info"]["input_ids"],
+                    stage_in_jobs=stage_in_jobs,
+                )
+            except (RuntimeError, ValueError) as e:
+                # reported like a failed submission
+                job["target_pwd"], job["stage_in_job_ids"] = None, []
+                job["submission"] = (1, e, None)
+
+        for job in _submit_batch_jobs(
+            ds, to_submit, alt_dir, defer_job_info, completion_marker, reused
+        ):
+            cmd_expanded = job["cmd_expanded"]
+            if job.get("blocked_by"):
+                yield get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status="impossible",
+                    message=(
+                        "'%s' was not submitted, because it depends on jobs "
+                        "which were not submitted: %s",
+                        _format_cmd_shorty(cmd_expanded),
+                        job["blocked_by"],
+                    ),
+                )
+                continue
+            cmd_exitcode, exc, slurm_job_id = job["submission"]
+            if not slurm_job_id:
+                yield get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status="impossible",
+                    message=(
+                        "No job was submitted to slurm for '%s'. "
+                        "Check your submission script exists and is valid.",
+                        _format_cmd_shorty(cmd_expanded),
+                    ),
+                    exception=exc,
+                )
+                continue
+
+            _add_staging_refs(
+                ds,
+                alt_dir,
+                slurm_job_id,
+                job["rel_pwd"],
+                job["specs"]["inputs"],
+                job["specs"]["extra_inputs"],
+            )
+            slurm_run_info = job["slurm_run_info"]
+            globbed = job["globbed"]
+            if expand in ["outputs", "both"]:
+                globbed["outputs"].expand(refresh=True)
+                slurm_run_info["outputs"] = globbed["outputs"].paths
+                slurm_run_info["outputs"].extend(slurm_run_info["slurm_outputs"])
+            _submit_stage_out_job(ds, alt_dir, slurm_run_info, job["job_info"])
+
+            msg = job["message"]
+            reslurm_run_info = job["reslurm_run_info"]
+            if reslurm_run_info:
+                resubmission = (
+                    f"Re-submission of job {reslurm_run_info['slurm_job_id']}."
+                )
+                msg = f"{msg}\n\n{resubmission}" if msg else resubmission
+
+            entries.append(
+                (
+                    slurm_run_info,
+                    msg,
+                    job["expanded_specs"]["outputs"],
+                    job["locked_prefixes"],
+                    alt_dir,
+                    job["job_info"],
+                )
+            )
+            job["recorded"] = True
+            expected_exit = reslurm_run_info.get("exit", 0) if reslurm_run_info else None
+            run_results.append(
+                get_status_dict(
+                    "slurm-schedule",
+                    ds=ds,
+                    status=(
+                        "error"
+                        if cmd_exitcode and expected_exit != cmd_exitcode
+                        else "ok"
+                    ),
+                    message=_format_cmd_shorty(cmd_expanded),
+                    slurm_run_info=slurm_run_info,
+                    exit_code=cmd_exitcode,
+                    exception=exc,
+                )
+            )
+    finally:
+        # record every submitted job, even if the batch was interrupted
+        recorded = [job["reservation_id"] for job in batch if job.get("recorded")]
+        status_ok = (
+            add_jobs_to_database(ds, entries, reservation_ids=recorded)
+            if entries
+            else True
+        )
+        unused = [job["reservation_id"] for job in batch if not job.get("recorded")]
+        if not status_ok:
+            unused += recorded
+        if unused:
+            release_reservations(ds, unused)
+
+    if not status_ok:
+        yield get_status_dict(
+            "slurm-schedule",
+            ds=ds,
+            status="error",
+            message=(
+                "%d submitted jobs cannot be recorded in the database",
+                len(entries),
+            ),
+        )
+        return
+    yield from run_results
+
+
+def _submit_batch_jobs(
+    ds, jobs, alt_dir, defer_job_info, completion_marker, done=()
+):
+    """
+    Submit the jobs of a batch, independent ones concurrently.
+
+    Jobs are submitted in rounds. Each round submits, in a thread pool, all
+    jobs whose dependencies (their 'after' spec indices) were submitted in
+    earlier rounds, with an sbatch dependency on the Slurm job IDs of those
+    and on the stage-in jobs of the job, if any.
+    At most `datalad.slurm.max-parallel-submissions` (default: 8) sbatch
+    calls run at the same time.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset.
+    jobs : list of dict
+        The prepared jobs of `schedule_batch_cmd`.
+    done : set, optional
+        Spec indices of jobs which need not be waited for.
+
+    Returns
+    -------
+    list of dict
+        The jobs in their original order. A submitted job has the
+        'submission' result of `_execute_slurm_command` and its 'job_info'. A
+        job with 'blocked_by' was not submitted because the jobs with these
+        spec indices were not submitted.
+    """
+    pool_size = int(ds.config.get("datalad.slurm.max-parallel-submissions", 8))
+    job_ids = {}  # spec index -> Slurm job ID
+    pending = list(jobs)
+    for job in pending:
+        job["after"] = [i for i in job["after"] if i not in done]
+
+    def submit(job):
+        job["submission"] = _submit_slurm_job(
+            ds, job["cmd_expanded"], job["target_pwd"], completion_marker
+        )
+        cmd_exitcode, _, slurm_job_id = job["submission"]
+        if slurm_job_id:
+            job["slurm_run_info"]["exit"] = cmd_exitcode
+            job["job_info"] = _add_slurm_job_info(
+                job["slurm_run_info"],
+                ds.path,
+                slurm_job_id,
+                alt_dir,
+                job["cmd_expanded"],
+                job["target_pwd"],
+                defer_job_info,
+                completion_marker,
+            )
+        return job
+
+    with ThreadPoolExecutor(max_workers=max(pool_size, 1)) as pool:
+        while pending:
+            submitted = set(job_ids)
+            unresolved = {job["index"] for job in pending}
+            ready, waiting = [], []
+            for job in pending:
+                if any(i in unresolved for i in job["after"]):
+                    waiting.append(job)
+                    continue
+                job["blocked_by"] = [i for i in job["after"] if i not in submitted]
+                if job["blocked_by"] or job.get("submission"):
+                    continue
+                dependencies = [job_ids[i] for i in job["after"]] + job.get(
+                    "stage_in_job_ids", []
+                )
+                if dependencies:
+                    try:
+                        job["cmd_expanded"] = add_sbatch_dependency(
+                            job["cmd_expanded"], dependencies
+                        )
+                    except ValueError as e:
+                        job["submission"] = (1, e, None)
+                        continue
+                ready.append(job)
+            for job in pool.map(submit, ready):
+                if job["submission"][2]:
+                    job_ids[job["index"]] = job["submission"][2]
+            pending = waiting
+
+    return jobs
+
+
+def add_sbatch_dependency(command, job_ids, condition="afterok"):
+    """
+    Make an sbatch command wait for other Slurm jobs.
+
+    The dependency is inserted right after `sbatch`, the rest of the command
+    is kept as it is.
+
+    Parameters
+    ----------
+    command : str
+        The sbatch command.
+    job_ids : list
+        The Slurm job IDs to wait for.
+    condition : str, optional
+        The sbatch dependency type.
+
+    Returns
+    -------
+    str
+        The command with the dependency.
+
+    Raises
+    ------
+    ValueError
+        If the command is not a single sbatch call or already has a
+        dependency, which would take precedence.
+    """
+    parsed = parse_sbatch_command(command)
+    if not parsed:
+        raise ValueError(f"Not an sbatch command: {command}")
+    if "dependency" in parsed["options"]:
+        raise ValueError(f"Command already has a dependency: {command}")
+    dependency = ":".join([condition] + [str(job_id) for job_id in job_ids])
+    end = re.match(r"\s*\S+", command).end()
+    return f"{command[:end]} --dependency={dependency}{command[end:]}"
+
+
+def load_batch_specs(path):
+    """
+    Read job specifications for `schedule_batch_cmd` from a JSON lines file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file, or '-' to read from stdin.
+
+    Returns
+    -------
+    list of dict
+        One job specification per non-empty line.
+
+    Raises
+    ------
+    ValueError
+        If a line is not a JSON object.
+    """
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(path) as f:
+            lines = f.readlines()
+
+    specs = []
+    for lineno, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"line {lineno} is not valid JSON: {e}") from e
+        if not isinstance(spec, dict):
+            raise ValueError(f"line {lineno} is not a JSON object")
+        specs.append(spec)
+    return specs
+
+
+def get_cache_key(slurm_run_info, substitutions):
+    """
+    Return the key of a run record in the result cache.
+
+    Runs with the same key are expected to produce the same outputs: they
+    have the same command, working directory, declared outputs and input
+    identities (see `get_input_ids`), and the same values of the
+    `datalad.run.substitutions` used by the command.
+
+    Parameters
+    ----------
+    slurm_run_info : dict
+        The run record.
+    substitutions : dict
+        The `datalad.run.substitutions`, see `_get_substitutions`.
+
+    Returns
+    -------
+    str or None
+        The key, or None if the record has no input identities or an input
+        has none, e.g. because it is modified in the worktree. Such a run is
+        neither reused nor can it be reused later.
+    """
+    input_ids = slurm_run_info.get("input_ids")
+    if input_ids is None or None in input_ids.values():
+        return None
+    cmd = slurm_run_info["cmd"]
+    key = dict(
+        cmd=cmd,
+        pwd=slurm_run_info.get("pwd"),
+        outputs=sorted(slurm_run_info.get("outputs") or []),
+        input_ids=slurm_run_info["input_ids"],
+        substitutions={
+            name: value
+            for name, value in substitutions.items()
+            if "{" + name + "}" in cmd
+        },
+    )
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _reuse_cached_result(ds, slurm_run_info, message):
+    """
+    Reinstate the outputs of an earlier identical run instead of submitting.
+
+    The outputs are checked out from the commit of the earlier run and
+    committed with a run record of that job, which refers to the commit in
+    'reused_from'.
+
+    Yields the results of the save. The return value of the generator is
+    whether a cached result was used. If the outputs cannot be checked out,
+    it is not, and the job is to be submitted.
+    """
+    cache_key = slurm_run_info.get("cache_key")
+    hit = lookup_result_cache(ds, cache_key) if cache_key else None
+    if not hit:
+        return False
+    commit, record = hit
+
+    pwd = op.join(ds.path, record.get("pwd") or op.curdir)
+    paths = [
+        op.relpath(op.normpath(op.join(pwd, output)), ds.path)
+        for output in record.get("outputs") or []
+    ]
+    # only what is in the commit, outputs might have been removed since
+    tracked = subprocess.run(
+        ["git", "ls-tree", "-r", "-z", "--name-only", commit, "--"] + paths,
+        cwd=ds.path,
+        capture_output=True,
+    )
+    if tracked.returncode or not tracked.stdout:
+        return False
+    checkout = subprocess.run(
+        ["git", "checkout", commit, "--pathspec-from-file=-", "--pathspec-file-nul"],
+        cwd=ds.path,
+        input=tracked.stdout,
+        capture_output=True,
+    )
+    if checkout.returncode:
+        # the job is submitted instead and writes all of its outputs anew
+        lgr.warning(
+            "Cannot check out the outputs of %s, submitting the job instead: %s",
+            commit[:7],
+            checkout.stderr.decode(errors="replace").strip(),
+        )
+        return False
+
+    slurm_run_info.update(
+        slurm_job_id=record["slurm_job_id"],
+        outputs=record.get("outputs", []),
+        slurm_outputs=record.get("slurm_outputs", []),
+        reused_from=commit,
+    )
+    message_entry = f"Slurm job {record['slurm_job_id']}: Completed"
+    if message:
+        message_entry += f"\n\n{message}"
+    message_entry += f"\n\nReused the outputs of {commit}."
+    yield from Save.__call__(
+        dataset=ds,
+        path=[op.join(ds.path, path) for path in paths],
+        recursive=True,
+        message=format_run_message(ds, message_entry, slurm_run_info),
+        return_type="generator",
+        result_renderer="disabled",
+        on_failure="ignore",
+    )
+    yield get_status_dict(
+        "slurm-schedule",
+        ds=ds,
+        status="ok",
+        message=(
+            "Reused the outputs of job %s from %s",
+            record["slurm_job_id"],
+            commit[:7],
+        ),
+        slurm_run_info=slurm_run_info,
+    )
+    return True
+
+
+def get_recorded_inputs(slurm_run_info):
+    """
+    Return what a run record declares as the inputs of its job.
+
+    These are the 'inputs' and 'extra_inputs' and, for an sbatch command, its
+    batch script, all relative to the 'pwd' of the record.
+    """
+    inputs = list(slurm_run_info.get("inputs") or [])
+    inputs += slurm_run_info.get("extra_inputs") or []
+    parsed = parse_sbatch_command(slurm_run_info.get("cmd", ""))
+    if parsed and parsed["script_index"] is not None:
+        inputs.append(parsed["args"][parsed["script_index"]])
+    return list(dict.fromkeys(inputs))
+
+
+def _has_wildcards(outputs):
+    """Return True if any of the outputs contains a glob character."""
+    wildcard_list = ["*", "?", "[", "]", "!", "^", "{", "}"]
+    return any(char in output for char in wildcard_list for output in outputs)
+
+
+def _stage_alt_dir_inputs(
+    ds, pwd, rel_pwd, alt_dir, inputs, extra_inputs, input_ids=None, stage_in_jobs=None
+):
+    """Copy the inputs to the alternative directory, if one is given.
+
+    With `datalad.slurm.transfer-partition`, the inputs are copied by a
+    stage-in job on that partition, see `submit_transfer_job`, which the job
+    has to wait for. Otherwise they are copied here by `stage_paths`, with
+    `datalad.slurm.staging-jobs` (default: 8) files at a time, and hardlinked
+    instead if `datalad.slurm.staging-hardlink` is true. With the "annex"
+    `datalad.slurm.staging-mode`, annexed files are copied from their annex
+    objects, see `get_annex_objects`.
+
+    Inputs whose identity in `input_ids` (see `get_input_ids`) is recorded
+    for them in the staging manifest of the alternative directory were
+    staged before and are not looked at again. Neither are inputs which are
+    already staged by one of the `stage_in_jobs`, the staging targets mapped
+    to the ID of their stage-in job, to which new stage-in jobs are added.
+
+    Returns
+    -------
+    tuple
+        (target_pwd, stage_in_job_ids), the directory to submit the job from
+        and the Slurm job IDs of the stage-in jobs to wait for.
+
+    Raises
+    ------
+    RuntimeError
+        If the stage-in job could not be submitted or any input could not be
+        staged.
+    """
+    if not alt_dir:
+        return pwd, []
+
+    target_pwd = op.join(alt_dir, rel_pwd)
+    paths = list(dict.fromkeys(list(inputs or []) + list(extra_inputs or [])))
+    if not paths:
+        return target_pwd, []
+    targets = {path: get_staging_target(rel_pwd, path) for path in paths}
+    content_ids = {
+        targets[path]: (input_ids or {}).get(path)
+        for path in paths
+        if (input_ids or {}).get(path)
+    }
+
+    con = None
+    staged = {}
+    if content_ids:
+        try:
+            con = connect_to_manifest(
+                alt_dir, get_db_busy_timeout(ds)
+            )
+            staged = get_staged(con, content_ids)
+        except (sqlite3.Error, ValueError) as e:
+            lgr.warning("Cannot read the staging manifest in '%s': %s", alt_dir, e)
+    unchanged = [
+        path
+        for path in paths
+        if targets[path] in content_ids
+        and staged.get(targets[path]) == content_ids[targets[path]]
+        # a cheap check that nobody cleaned up behind our back
+        and (glob.has_magic(path) or op.lexists(op.join(alt_dir, targets[path])))
+    ]
+    paths = [path for path in paths if path not in unchanged]
+
+    if ds.config.get("datalad.slurm.transfer-partition"):
+        # the stage-in job can still fail, so nothing is recorded as staged
+        if con:
+            con.close()
+        if stage_in_jobs is None:
+            stage_in_jobs = {}
+        stage_in_job_ids = list(
+            dict.fromkeys(
+                stage_in_jobs[targets[path]]
+                for path in paths
+                if targets[path] in stage_in_jobs
+            )
+        )
+        paths = [path for path in paths if targets[path] not in stage_in_jobs]
+        if not paths:
+            return target_pwd, stage_in_job_ids
+        options = ["--annex"] if _get_staging_mode(ds) == "annex" else []
+        if ds.config.getbool("datalad.slurm", "staging-hardlink", False):
+            options.append("--hardlink")
+        stage_in_job_id = submit_transfer_job(
+            ds, "stage", pwd, target_pwd, paths, alt_dir, options=options
+        )
+        stage_in_jobs.update((targets[path], stage_in_job_id) for path in paths)
+        print(
+            f"        submitted stage-in job {stage_in_job_id} for {len(paths)} "
+            f"inputs to alternative dir '{target_pwd}', {len(unchanged)} inputs "
+            "already staged"
+        )
+        return target_pwd, stage_in_job_ids + [stage_in_job_id]
+
+    max_workers = int(ds.config.get("datalad.slurm.staging-jobs", 8))
+    objects = (
+        get_annex_objects(pwd, paths, max_workers)
+        if paths and _get_staging_mode(ds) == "annex"
+        else None
+    )
+    stats = stage_paths(
+        pwd,
+        target_pwd,
+        paths,
+        max_workers=max_workers,
+        hardlink=ds.config.getbool("datalad.slurm", "staging-hardlink", False),
+        objects=objects,
+    )
+    print(
+        f"        staged {stats['files']} files ({format_size(stats['bytes'])}) "
+        f"to alternative dir '{target_pwd}' in {stats['seconds']:.1f}s, "
+        f"{stats['skipped']} files unchanged, {len(unchanged)} inputs "
+        "already staged"
+    )
+    for path, error in stats["errors"]:
+        lgr.warning("Cannot stage '%s' to '%s': %s", path, target_pwd, error)
+    if stats["errors"]:
+        if con:
+            con.close()
+        raise RuntimeError(
+            f"Cannot stage {len(stats['errors'])} paths to alternative dir "
+            f"'{target_pwd}', see the warnings above"
+        )
+
+    if con:
+        try:
+            if paths:
+                record_staged(
+                    con,
+                    {
+                        targets[path]: content_ids[targets[path]]
+                        for path in paths
+                        if targets[path] in content_ids
+                    },
+                )
+        except sqlite3.Error as e:
+            lgr.warning("Cannot update the staging manifest in '%s': %s", alt_dir, e)
+        finally:
+            con.close()
+
+    return target_pwd, []
+
+
+def submit_transfer_job(
+    ds, action, src_root, dst_root, paths, alt_dir, options=(), dependency=None
+):
+    """
+    Submit a Slurm job which stages inputs to or collects outputs from an alt-dir.
+
+    The job runs `python -m datalad_slurm.staging` (see `staging.main`) with
+    the `datalad.slurm.transfer-python` interpreter (default: the current
+    one) on the `datalad.slurm.transfer-partition`, e.g. of the data-mover
+    nodes. Further sbatch options, e.g. the account and time limit, can be
+    given in `datalad.slurm.transfer-sbatch-options`. The log of the job is
+    written to the top directory of the alternative directory.
+
+    Parameters
+    ----------
+    ds : Dataset
+        The dataset.
+    action : str
+        "stage" or "collect".
+    src_root, dst_root : str
+        The directories to transfer the `paths` between.
+    paths : list of str
+        The paths relative to `src_root`, may contain globs.
+    alt_dir : str
+        The alternative directory.
+    options : list of str, optional
+        Further options of the transfer.
+    dependency : str, optional
+        The sbatch dependency of the job.
+
+    Returns
+    -------
+    str
+        The Slurm job ID.
+
+    Raises
+    ------
+    RuntimeError
+        If the job could not be submitted.
+    """
+    name = "stage-in" if action == "stage" else "stage-out"
+    python = ds.config.get("datalad.slurm.transfer-python", sys.executable)
+    transfer = [
+        python,
+        "-m",
+        "datalad_slurm.staging",
+        action,
+        "-J",
+        str(ds.config.get("datalad.slurm.staging-jobs", 8)),
+        *options,
+        "--",
+        src_root,
+        dst_root,
+        *paths,
+    ]
+    command = [
+        "sbatch",
+        f"--partition={ds.config.get('datalad.slurm.transfer-partition')}",
+        f"--job-name=datalad-{name}",
+        f"--output={op.join(alt_dir, f'.datalad-slurm-{name}-%j.out')}",
+    ]
+    if dependency:
+        command.append(f"--dependency={dependency}")
+    command = " ".join(
+        [shlex.join(command)]
+        + [ds.config.get("datalad.slurm.transfer-sbatch-options", "")]
+        + [shlex.join([f"--wrap={shlex.join(transfer)}"])]
+    )
+    _, exc, job_id = _execute_slurm_command(command, src_root)
+    if not job_id:
+        raise RuntimeError(f"Cannot submit the {name} job: {exc or command}")
+    return job_id
+
+
+def _submit_stage_out_job(ds, alt_dir, slurm_run_info, job_info):
+    """Submit the job which moves the outputs of a job back from its alt-dir.
+
+    Only with `datalad.slurm.transfer-partition`. The stage-out job starts
+    once the job has ended, successfully or not, and slurm-finish waits for
+    it by its ID in `job_info`. If it can't be submitted, slurm-finish moves
+    the outputs back itself.
+    """
+    if not alt_dir or not ds.config.get("datalad.slurm.transfer-partition"):
+        return
+    paths = list(
+        dict.fromkeys(
+            ensure_list(slurm_run_info["outputs"])
+            + ensure_list(slurm_run_info["slurm_outputs"])
+        )
+    )
+    if not paths:
+        return
+    options = ["--verify", ds.config.get("datalad.slurm.copy-back-verify", "size")]
+    if ds.config.get("datalad.slurm.copy-back", "move") == "copy":
+        options.append("--retain")
+    try:
+        job_info["stage_out_job_id"] = submit_transfer_job(
+            ds,
+            "collect",
+            alt_dir,
+            ds.path,
+            paths,
+            alt_dir,
+            options=options,
+            dependency=f"afterany:{slurm_run_info['slurm_job_id']}",
+        )
+    except RuntimeError as e:
+        lgr.warning("%s, slurm-finish moves the outputs back instead", e)
+
+
+def _add_staging_refs(ds, alt_dir, slurm_job_id, rel_pwd, inputs, extra_inputs):
+    """Record in the staging manifest that a job uses its staged inputs."""
+    paths = list(inputs or []) + list(extra_inputs or [])
+    if not alt_dir or not paths:
+        return
+    try:
+        con = connect_to_manifest(
+            alt_dir, get_db_busy_timeout(ds)
+        )
+        try:
+            add_staging_refs(
+                con,
+                slurm_job_id,
+                {get_staging_target(rel_pwd, path) for path in paths},
+            )
+        finally:
+            con.close()
+    except (sqlite3.Error, ValueError) as e:
+        lgr.warning("Cannot update the staging manifest in '%s': %s", alt_dir, e)
+
+
+def _get_staging_mode(ds):
+    mode = ds.config.get("datalad.slurm.staging-mode", "copy")
+    if mode not in ("copy", "annex"):
+        raise ValueError(
+            f"Unknown datalad.slurm.staging-mode {mode!r}, use 'copy' or 'annex'"
+        )
+    return mode
+
+
+def _get_prep_assume_ready(ds, alt_dir, assume_ready):
+    """Return what the worktree preparation can assume to be ready.
+
+    Inputs which are staged from the annex objects are not needed in the
+    worktree, their content is fetched into the annex by the staging.
+    """
+    if not alt_dir or _get_staging_mode(ds) != "annex":
+        return assume_ready
+    return "both" if assume_ready in ("outputs", "both") else "inputs"
+
+
+def _add_slurm_job_info(
+    slurm_run_info,
+    ds_path,
+    slurm_job_id,
+    alt_dir,
+    command=None,
+    submit_pwd=None,
+    defer_job_info=False,
+    completion_marker=False,
+):
+    """Add the slurm job id and the slurm log and environment files to the run info.
+
+    With `defer_job_info`, the log files are not looked up but left to
+    slurm-finish. Only the file name patterns from the sbatch `command`
+    submitted in `submit_pwd` are returned to be kept in the database.
+    With `completion_marker`, the names of the completion markers the job
+    will leave are returned as well.
+
+    Returns
+    -------
+    dict
+        The extra columns for the job in the open jobs database.
+    """
+    job_info = {}
+    templates = None
+    if defer_job_info or completion_marker:
+        try:
+            templates = get_slurm_output_templates(command, submit_pwd)
+        except ValueError as e:
+            lgr.warning("%s, looking up the slurm output files now", e)
+            defer_job_info = False
+    if defer_job_info:
+        job_info["slurm_output_templates"] = json.dumps(templates)
+    if completion_marker and templates is not None:
+        job_info["completion_markers"] = json.dumps(
+            get_completion_marker_names(slurm_job_id, templates["array"])
+        )
+    if defer_job_info:
+        slurm_run_info["slurm_outputs"] = []
+    else:
+        # TODO: expand these paths
+        slurm_outputs, slurm_env_file = get_slurm_output_files(ds_path,slurm_job_id,alt_dir)
+        #slurm_run_info["outputs"].extend(slurm_outputs) ## TODO don't have slurm outputs twice, in "outputs" and in "slurm_outputs"
+        #slurm_run_info["outputs"].append(slurm_env_file)
+        slurm_run_info["slurm_outputs"] = slurm_outputs
+        slurm_run_info["slurm_outputs"].append(slurm_env_file)
+
+    # add the slurm job id to the run info
+    slurm_run_info["slurm_job_id"] = slurm_job_id
+    return job_info
+
+
+def check_output_conflict(dset, outputs, output_prefixes):
+    """
+    Check for conflicts between provided outputs and existing outputs in the database.
+
+    Parameters
+    ----------
+    dset : object
+        Dataset object containing repository information.
+    outputs : list of str
+        List of strings representing output paths to check.
+    output_prefixes : list of str
+        List of the prefixes of the output paths.
+
+    Returns
+    -------
+    tuple
+        (bool or None, bool or None)
+        Whether there is a conflict and whether the database could be accessed.
+    """
+    conflicts, status_ok = find_output_conflicts(dset, outputs, output_prefixes)
+    if not status_ok:
+        return None, None
+    conflicting_names, conflicting_prefixes = conflicts
+    return bool(conflicting_names or conflicting_prefixes), True
+
+
+def find_output_conflicts(dset, outputs, output_prefixes):
+    """
+    Find the outputs and prefixes which conflict with those of open jobs.
+
+    A name conflicts if it is locked as a name or as a prefix by an open job,
+    a prefix conflicts if it is locked as a name by an open job.
+
+    Parameters
+    ----------
+    dset : object
+        Dataset object containing repository information.
+    outputs : iterable of str
+        Output paths to check.
+    output_prefixes : iterable of str
+        Prefixes of the output paths to check.
+
+    Returns
+    -------
+    tuple
+        ((set, set) or None, bool or None)
+        The conflicting names and the conflicting prefixes, and whether the
+        database could be accessed.
+    """
+    # Connect to database
+    con, cur = connect_to_database(dset)
+    if not con or not cur:
+        return None, None
+
+    outputs = set(outputs)
+    output_prefixes = set(output_prefixes)
+    try:
+        # CURRENT NAMES against PRIOR PREFIXES and PRIOR NAMES
+        conflicting_names = _select_locked(
+            cur, "locked_prefixes", "prefix", outputs
+        ) | _select_locked(cur, "locked_names", "name", outputs)
+
+        # CURRENT PREFIXES against PRIOR NAMES
+        conflicting_prefixes = _select_locked(
+            cur, "locked_names", "name", output_prefixes
+        )
+
+    except sqlite3.Error:
+        return None, None
+    finally:
+        con.close()
+    return (conflicting_names, conflicting_prefixes), True
+
+
+def reserve_outputs(dset, jobs, check_outputs=True):
+    """
+    Check outputs for conflicts and lock them for jobs about to be submitted.
+
+    The check and the locking happen in a single ``BEGIN IMMEDIATE``
+    transaction, so two concurrent schedulers can never both lock the same
+    output. Until a job is recorded with `add_jobs_to_database`, its locks
+    are held under the negative reservation id. The reservations of jobs
+    which could not be submitted must be given back with
+    `release_reservations`.
+
+    Parameters
+    ----------
+    dset : object
+        Dataset object containing repository information.
+    jobs : list of tuple
+        One (outputs, prefixes) tuple per job.
+    check_outputs : bool, optional
+        If False, lock the outputs without checking them for conflicts.
+
+    Returns
+    -------
+    tuple
+        (list or None, bool or None)
+        Per job either its reservation id or, if its outputs conflict, a
+        description of what they conflict with. And whether the database
+        could be accessed.
+    """
+    con, cur = connect_to_database(dset)
+    if not con or not cur:
+        return None, None
+
+    con.isolation_level = None
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            _release_stale_reservations(cur)
+
+            if check_outputs:
+                all_names = set().union(*(set(outputs) for outputs, _ in jobs))
+                all_prefixes = set().union(*(set(prefixes) for _, prefixes in jobs))
+                conflicting_names = _select_locked(
+                    cur, "locked_prefixes", "prefix", all_names
+                ) | _select_locked(cur, "locked_names", "name", all_names)
+                conflicting_prefixes = _select_locked(
+                    cur, "locked_names", "name", all_prefixes
+                )
+
+            reservations = []
+            batch_names, batch_prefixes = set(), set()
+            for outputs, prefixes in jobs:
+                names = {output.rstrip("/") for output in outputs}
+                prefixes = set(prefixes)
+                if check_outputs:
+                    if names & conflicting_names or prefixes & conflicting_prefixes:
+                        reservations.append("previously scheduled jobs")
+                        continue
+                    if names & (batch_names | batch_prefixes) or prefixes & batch_names:
+                        reservations.append("other jobs of this batch")
+                        continue
+                batch_names |= names
+                batch_prefixes |= prefixes
+
+                cur.execute(
+                    "INSERT INTO reservations (host, pid, created) VALUES (?, ?, ?)",
+                    (socket.gethostname(), os.getpid(), time.time()),
+                )
+                reservation_id = cur.lastrowid
+                cur.executemany(
+                    "INSERT OR IGNORE INTO locked_names (slurm_job_id, name) "
+                    "VALUES (?, ?)",
+                    [(-reservation_id, name) for name in names],
+                )
+                cur.executemany(
+                    "INSERT OR IGNORE INTO locked_prefixes (slurm_job_id, prefix) "
+                    "VALUES (?, ?)",
+                    [(-reservation_id, prefix) for prefix in prefixes],
+                )
+                reservations.append(reservation_id)
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        cur.execute("COMMIT")
+    except sqlite3.Error:
+        return None, None
+    finally:
+        con.close()
+
+    return reservations, True
+
+
+def release_reservations(dset, reservation_ids):
+    """
+    Give back the output locks of jobs which were not submitted after all.
+
+    Parameters
+    ----------
+    dset : object
+        Dataset object containing repository information.
+    reservation_ids : list of int
+        Reservation ids as returned by `reserve_outputs`.
+
+    Returns
+    -------
+    bool or None
+        True on success, None if the database could not be accessed.
+    """
+    con, cur = connect_to_database(dset)
+    if not con or not cur:
+        return None
+    try:
+        _delete_reservations(cur, reservation_ids)
+        con.commit()
+    except sqlite3.Error:
+        return None
+    finally:
+        con.close()
+    return True
+
+
+def _delete_reservations(cur, reservation_ids):
+    ids = [(-reservation_id,) for reservation_id in reservation_ids]
+    cur.executemany("DELETE FROM locked_names WHERE slurm_job_id = ?", ids)
+    cur.executemany("DELETE FROM locked_prefixes WHERE slurm_job_id = ?", ids)
+    cur.executemany(
+        "DELETE FROM reservations WHERE reservation_id = ?",
+        [(reservation_id,) for reservation_id in reservation_ids],
+    )
+
+
+def _release_stale_reservations(cur):
+    """Drop the reservations of schedulers which died before recording their job.
+
+    These are the reservations of processes which no longer exist on this
+    host and, from any host, those which are older than a day.
+    """
+    host = socket.gethostname()
+    now = time.time()
+    cur.execute("SELECT reservation_id, host, pid, created FROM reservations")
+    stale = [
+        reservation_id
+        for reservation_id, res_host, pid, created in cur.fetchall()
+        if now - created > _STALE_RESERVATION_AGE
+        or (res_host == host and not _pid_alive(pid))
+    ]
+    if stale:
+        lgr.debug("Releasing stale output reservations %s", stale)
+        _delete_reservations(cur, stale)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _select_locked(cur, table, column, paths):
+    """Return those of `paths` which are locked in `column` of `table`.
+
+    Only the index entries for the given paths are looked up, so the cost
+    does not depend on the number of locked paths of other open jobs.
+    """
+    paths = list(paths)
+    found = set()
+    # stay below SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions
+    chunk_size = 500
+    for i in range(0, len(paths), chunk_size):
+        chunk = paths[i : i + chunk_size]
+        cur.execute(
+            f"SELECT DISTINCT {column} FROM {table} "
+            f"WHERE {column} IN ({', '.join('?' * len(chunk))})",
+            chunk,
+        )
+        found.update(row[0] for row in cur.fetchall())
+    return found
+
+
+def get_sub_paths(paths):
+    """
+    Extract sub-paths from directories.
+
+    Parameters
+    ----------
+    paths : list of str
+        List of directory paths.
+
+    Returns
+    -------
+    list of str
+        List of sub-paths extracted from the input paths.
+
+    Examples
+    --------
+    >>> get_sub_paths(['/a/b/c/d/'])
+    ['/a', '/a/b', '/a/b/c']
+    """
+    # Set to store unique sub-paths
+    all_sub_paths = set()
+
+    for path in paths:
+        # Remove trailing slash if present
+        path = path.rstrip("/")
+
+        # Split the path into components
+        components = path.split("/")
+
+        # Build sub-paths, excluding the full path
+        current_path = ""
+        for component in components[:-1]:  # Stop before the last component
+            current_path += component + "/"
+            all_sub_paths.add(current_path.rstrip("/"))
+
+    # Convert set to sorted list for consistent output
+    return sorted(list(all_sub_paths))
+
+
+def get_slurm_output_files(ds_root, job_id, alt_dir=None):
+    """
+    Get the relative paths to StdOut and StdErr files for a Slurm job.
+
+    All information comes from a single ``scontrol -o show job`` call, also
+    for array jobs. Array tasks which already started have a record of their
+    own. The pending tasks share one record whose paths contain Slurm's
+    NO_VAL in place of the task id, which is replaced with each task id.
+
+    Parameters
+    ----------
+    job_id : str
+        The Slurm job ID.
 
     Returns
     -------
@@ -914,10 +2660,10 @@ def get_slurm_output_files(ds_root, job_id, alt_dir=None):
     ValueError
         If required file paths cannot be found in scontrol output.
     """
-    # Run scontrol command and get output
+    # Run scontrol command and get output, one line per job record
     try:
         result = subprocess.run(
-            ["scontrol", "show", "job", str(job_id)],
+            ["scontrol", "-o", "show", "job", str(job_id)],
             capture_output=True,
             text=True,
             check=True,
@@ -927,31 +2673,13 @@ def get_slurm_output_files(ds_root, job_id, alt_dir=None):
             e.returncode, e.cmd, f"Failed to get job information: {e.output}"
         )
 
-    # Parse output to find StdOut and StdErr
-    parsed_data = parse_slurm_output(result.stdout)
-    if "ArrayJobId" in parsed_data:
-        array_task_id = parsed_data["ArrayTaskId"]
-        slurm_job_ids = generate_array_job_names(str(job_id), str(array_task_id))
-    else:
-        slurm_job_ids = [job_id]
-
-    slurm_out_paths = []
-    for i, slurm_job_id in enumerate(slurm_job_ids):
-        # Run scontrol command and get output
-        try:
-            result = subprocess.run(
-                ["scontrol", "show", "job", str(slurm_job_id)],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-        except subprocess.CalledProcessError as e:
-            raise subprocess.CalledProcessError(
-                e.returncode, e.cmd, f"Failed to get job information: {e.output}"
-            )
-
+    # (array task id or None, record, StdOut, StdErr) per job or array task
+    tasks = []
+    for line in result.stdout.splitlines():
+        if not line.strip():
+            continue
         # Parse output to find StdOut and StdErr
-        parsed_data = parse_slurm_output(result.stdout)
+        parsed_data = parse_slurm_output(line)
 
         stdout_path = parsed_data.get("StdOut")
         stderr_path = parsed_data.get("StdErr")
@@ -959,8 +2687,32 @@ def get_slurm_output_files(ds_root, job_id, alt_dir=None):
         if not stdout_path or not stderr_path:
             raise ValueError("Could not find StdOut or StdErr paths in scontrol output")
 
-        cwd = alt_dir if alt_dir else Path.cwd()
+        array_task_id = parsed_data.get("ArrayTaskId")
+        if "ArrayJobId" not in parsed_data or not array_task_id:
+            tasks.append((None, parsed_data, stdout_path, stderr_path))
+        elif array_task_id.isdigit():
+            tasks.append((int(array_task_id), parsed_data, stdout_path, stderr_path))
+        else:
+            # the record of all pending tasks
+            for name in generate_array_job_names(str(job_id), array_task_id):
+                task = name.rsplit("_", 1)[1]
+                tasks.append(
+                    (
+                        int(task),
+                        parsed_data,
+                        stdout_path.replace(_SLURM_NO_VAL, task),
+                        stderr_path.replace(_SLURM_NO_VAL, task),
+                    )
+                )
+
+    if not tasks:
+        raise ValueError(f"Could not find job {job_id} in scontrol output")
+    tasks.sort(key=lambda task: -1 if task[0] is None else task[0])
 
+    cwd = alt_dir if alt_dir else Path.cwd()
+
+    slurm_out_paths = []
+    for i, (_, parsed_data, stdout_path, stderr_path) in enumerate(tasks):
         stdout_path = Path(stdout_path)
         stderr_path = Path(stderr_path)
 
@@ -985,6 +2737,297 @@ def get_slurm_output_files(ds_root, job_id, alt_dir=None):
     return slurm_out_paths, rel_slurmenv
 
 
+def resolve_slurm_output_files(ds_root, job_id, templates, alt_dir=None):
+    """
+    Get the slurm log files of a job which was scheduled with deferred job info.
+
+    While Slurm still knows the job, this is the same as
+    `get_slurm_output_files`. Otherwise, the StdOut and StdErr file name
+    patterns recorded at submission time are expanded locally and the job
+    environment is taken from the accounting database.
+
+    Parameters
+    ----------
+    job_id : str
+        The Slurm job ID.
+    templates : dict
+        The file name patterns from `get_slurm_output_templates`.
+
+    Returns
+    -------
+    tuple
+        (list, str) The relative paths of the log files and of the job
+        environment file, like `get_slurm_output_files`.
+
+    Raises
+    ------
+    ValueError
+        If the file names cannot be determined.
+    """
+    try:
+        return get_slurm_output_files(ds_root, job_id, alt_dir)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        lgr.debug(
+            "scontrol has no information about job %s, using the recorded "
+            "file name patterns: %s",
+            job_id,
+            e,
+        )
+
+    if templates.get("array"):
+        tasks = [
+            name.rsplit("_", 1)[1]
+            for name in generate_array_job_names(str(job_id), templates["array"])
+        ]
+    else:
+        tasks = [None]
+
+    cwd = alt_dir if alt_dir else Path.cwd()
+
+    slurm_out_paths = []
+    for i, task in enumerate(tasks):
+        stdout_path, stderr_path = (
+            Path(templates["workdir"])
+            / expand_slurm_filename_pattern(
+                templates[stream], job_id, task, templates.get("job_name")
+            )
+            for stream in ("stdout", "stderr")
+        )
+        if i == 0:
+            slurm_env_file = stdout_path.parent / f"slurm-job-{job_id}.env.json"
+            with open(slurm_env_file, "w") as f:
+                json.dump(get_sacct_job_record(job_id), f, indent=2)
+            rel_slurmenv = os.path.relpath(slurm_env_file, cwd)
+
+        rel_stdout = os.path.relpath(stdout_path, cwd)
+        rel_stderr = os.path.relpath(stderr_path, cwd)
+        slurm_out_paths.append(rel_stdout)
+        if rel_stdout != rel_stderr:
+            slurm_out_paths.append(rel_stderr)
+
+    return slurm_out_paths, rel_slurmenv
+
+
+def get_sacct_job_record(job_id):
+    """
+    Get the accounting information of a job as a dictionary.
+
+    Parameters
+    ----------
+    job_id : str
+        The Slurm job ID.
+
+    Returns
+    -------
+    dict
+        The fields in `_SACCT_ENV_FIELDS` of the job (of the first task of an
+        array job). Empty if sacct knows nothing about the job.
+    """
+    try:
+        result = subprocess.run(
+            [
+                "sacct",
+                "-n",
+                "-X",
+                "--parsable2",
+                "-j",
+                str(job_id),
+                "-o",
+                ",".join(_SACCT_ENV_FIELDS),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        lgr.warning("Cannot get accounting information of job %s: %s", job_id, e.stderr)
+        return {}
+    lines = result.stdout.splitlines()
+    if not lines:
+        return {}
+    return dict(zip(_SACCT_ENV_FIELDS, lines[0].split("|")))
+
+
+def parse_sbatch_command(command):
+    """
+    Split an sbatch command line into its options and the batch script.
+
+    Parameters
+    ----------
+    command : str
+        The submission command.
+
+    Returns
+    -------
+    dict or None
+        None if the command is not a single sbatch call. Otherwise a dict with
+        'args' (the split command line), 'options' (long option name to value
+        for the options which take a value, the last one wins) and
+        'script_index' (the index of the batch script in 'args', or None if
+        there is none, e.g. for --wrap).
+    """
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if not args or op.basename(args[0]) != "sbatch":
+        return None
+
+    options = {}
+    script_index = None
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        if arg == "--":
+            script_index = i + 1 if i + 1 < len(args) else None
+            break
+        if arg.startswith("--"):
+            name, eq, value = arg[2:].partition("=")
+            if not eq and name not in _SBATCH_LONG_FLAGS:
+                i += 1
+                value = args[i] if i < len(args) else ""
+            options[name] = value
+        elif arg.startswith("-") and len(arg) > 1:
+            letter = arg[1]
+            if letter in _SBATCH_SHORT_WITH_VALUE:
+                value = arg[2:]
+                if not value:
+                    i += 1
+                    value = args[i] if i < len(args) else ""
+                options[_SBATCH_SHORT_NAMES.get(letter, letter)] = value
+        else:
+            script_index = i
+            break
+        i += 1
+
+    return dict(args=args, options=options, script_index=script_index)
+
+
+def get_slurm_output_templates(command, pwd):
+    """
+    Determine the StdOut and StdErr file name patterns of an sbatch call.
+
+    The options of the command line take precedence over the #SBATCH
+    directives of the batch script, which take precedence over the Slurm
+    defaults.
+
+    Parameters
+    ----------
+    command : str
+        The submission command.
+    pwd : str
+        The directory the command is submitted from.
+
+    Returns
+    -------
+    dict
+        With the keys 'workdir', 'stdout', 'stderr', 'array' and 'job_name'.
+
+    Raises
+    ------
+    ValueError
+        If the command is not a single sbatch call.
+    """
+    parsed = parse_sbatch_command(command)
+    if not parsed:
+        raise ValueError(
+            f"Cannot determine the output files of '{command}', "
+            "it is not a single sbatch call"
+        )
+
+    options = {}
+    job_name = "sbatch"
+    script_index = parsed["script_index"]
+    if script_index is not None:
+        script = parsed["args"][script_index]
+        job_name = op.basename(script)
+        options.update(_read_sbatch_directives(op.join(pwd, script)))
+    elif "wrap" in parsed["options"]:
+        job_name = "wrap"
+    options.update(parsed["options"])
+
+    array = options.get("array")
+    stdout = options.get("output") or ("slurm-%A_%a.out" if array else "slurm-%j.out")
+    return dict(
+        workdir=op.normpath(op.join(pwd, options.get("chdir", ""))),
+        stdout=stdout,
+        stderr=options.get("error") or stdout,
+        array=array,
+        job_name=options.get("job-name", job_name),
+    )
+
+
+def _read_sbatch_directives(script):
+    """Return the options of the #SBATCH lines at the top of a batch script."""
+    args = []
+    try:
+        with open(script) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    # sbatch stops at the first command
+                    break
+                if line.startswith("#SBATCH"):
+                    args.extend(shlex.split(line[len("#SBATCH") :], comments=True))
+    except (OSError, UnicodeDecodeError, ValueError):
+        return {}
+    parsed = parse_sbatch_command(shlex.join(["sbatch"] + args))
+    return parsed["options"] if parsed else {}
+
+
+def expand_slurm_filename_pattern(pattern, job_id, array_task_id=None, job_name=None):
+    """
+    Expand a file name pattern of sbatch --output/--error for a job or array task.
+
+    Parameters
+    ----------
+    pattern : str
+        The pattern, e.g. "slurm-%A_%a.out".
+    job_id : str
+        The Slurm job ID, the array job ID for array tasks.
+    array_task_id : str, optional
+        The array task ID.
+    job_name : str, optional
+        The job name.
+
+    Returns
+    -------
+    str
+        The expanded file name.
+
+    Raises
+    ------
+    ValueError
+        If the pattern needs information which is not known without asking
+        Slurm, e.g. the node name or the job id of an array task.
+
+    Examples
+    --------
+    >>> expand_slurm_filename_pattern("slurm-%A_%3a.out", "12345", "7")
+    'slurm-12345_007.out'
+    """
+    if "\\" in pattern:
+        # a backslash disables the pattern expansion
+        return pattern.replace("\\", "")
+
+    values = {"%": "%", "A": job_id, "u": getpass.getuser()}
+    if array_task_id is None:
+        values["j"] = job_id
+    else:
+        values["a"] = array_task_id
+    if job_name is not None:
+        values["x"] = job_name
+
+    def expand(match):
+        width, spec = match.groups()
+        if spec not in values:
+            raise ValueError(f"Cannot expand '%{spec}' in '{pattern}' without Slurm")
+        value = values[spec]
+        return value.zfill(int(width)) if width and value.isdigit() else value
+
+    return re.sub(r"%(\d*)(.)", expand, pattern)
+
+
 def parse_slurm_output(output):
     """
     Parse SLURM output into a dictionary, handling space-separated assignments.
@@ -1062,7 +3105,16 @@ def generate_array_job_names(job_id, job_task_id):
     return job_names
 
 
-def add_to_database(dset, slurm_run_info, message, outputs, prefixes, alt_dir):
+def add_to_database(
+    dset,
+    slurm_run_info,
+    message,
+    outputs,
+    prefixes,
+    alt_dir,
+    reservation_id=None,
+    job_info=None,
+):
     """
     Add a `datalad schedule` command to an sqlite database.
 
@@ -1087,6 +3139,12 @@ def add_to_database(dset, slurm_run_info, message, outputs, prefixes, alt_dir):
         A list of output names to be stored in the database.
     prefixes : list
         A list of prefix names to be stored in the database.
+    reservation_id : int, optional
+        The reservation from `reserve_outputs` whose locks are taken over
+        by the job.
+    job_info : dict, optional
+        Values of further columns of the open jobs table which are not part
+        of the run record.
 
     Returns
     -------
@@ -1094,119 +3152,193 @@ def add_to_database(dset, slurm_run_info, message, outputs, prefixes, alt_dir):
         Returns True if the command was successfully added to the database,
         None if the connection to the database could not be established.
     """
-    con, cur = connect_to_database(dset)
-    if not cur or not con:
-        return None
-
-    # create an empty table if it doesn't exist
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS open_jobs (
-    slurm_job_id INTEGER,
-    message TEXT,
-    chain TEXT CHECK (json_valid(chain)),
-    cmd TEXT,
-    dsid TEXT,
-    inputs TEXT CHECK (json_valid(inputs)),
-    extra_inputs TEXT CHECK (json_valid(extra_inputs)),
-    outputs TEXT CHECK (json_valid(outputs)),
-    slurm_outputs TEXT CHECK (json_valid(slurm_outputs)),
-    pwd TEXT,
-    alt_dir TEXT
-    )
-    """
+    return add_jobs_to_database(
+        dset,
+        [(slurm_run_info, message, outputs, prefixes, alt_dir, job_info or {})],
+        reservation_ids=[reservation_id],
     )
 
-    # convert the inputs to json
-    inputs_json = json.dumps(slurm_run_info["inputs"])
-
-    # convert the extra inputs to json
-    extra_inputs_json = json.dumps(slurm_run_info["extra_inputs"])
 
-    # convert the outputs to json
-    outputs_json = json.dumps(slurm_run_info["outputs"])
+# run record fields with a column of their own in the open jobs table, the
+# others are kept in its 'extra_info' column
+_RECORD_COLUMNS = (
+    "slurm_job_id",
+    "chain",
+    "cmd",
+    "dsid",
+    "inputs",
+    "extra_inputs",
+    "outputs",
+    "slurm_outputs",
+    "pwd",
+)
 
-    # convert the slurm outputs to json
-    slurm_outputs_json = json.dumps(slurm_run_info["slurm_outputs"])
 
-    # convert chain to json
-    chain_json = json.dumps(slurm_run_info["chain"])
+def add_jobs_to_database(dset, entries, reservation_ids=None):
+    """
+    Add several `datalad schedule` commands to the sqlite database in one transaction.
 
-    # add the most recent schedule command to the table
-    cur.execute(
-        """
-    INSERT INTO open_jobs (slurm_job_id,
-    message,
-    chain,
-    cmd,
-    dsid,
-    inputs,
-    extra_inputs,
-    outputs,
-    slurm_outputs,
-    pwd,
-    alt_dir)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            slurm_run_info["slurm_job_id"],
-            message,
-            chain_json,
-            slurm_run_info["cmd"],
-            slurm_run_info["dsid"],
-            inputs_json,
-            extra_inputs_json,
-            outputs_json,
-            slurm_outputs_json,
-            slurm_run_info["pwd"],
-            alt_dir if alt_dir else ""
-        ),
-    )
+    Parameters
+    ----------
+    dset : object
+        The dataset object.
+    entries : list of tuple
+        One (slurm_run_info, message, outputs, prefixes, alt_dir[, job_info])
+        tuple per job, see `add_to_database`.
+    reservation_ids : list, optional
+        Per job the reservation from `reserve_outputs` whose locks are taken
+        over by the job, or None.
 
-    # now create the tables with the locked_prefixes and locked_names
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS locked_prefixes (
-    slurm_job_id INTEGER,
-    prefix TEXT )
+    Returns
+    -------
+    bool or None
+        Returns True if the commands were successfully added to the database,
+        None if the connection to the database could not be established or
+        the commands could not be added. Nothing is added then, and the
+        reservations are left to the caller to release.
     """
-    )
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return None
 
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS locked_names (
-    slurm_job_id INTEGER,
-    name TEXT )
-    """
-    )
+    if reservation_ids is None:
+        reservation_ids = [None] * len(entries)
 
-    for output in outputs:
-        cur.execute(
-            """
-        INSERT INTO locked_names (slurm_job_id,
-        name)
-        VALUES (?, ?)
-        """,
-            (slurm_run_info["slurm_job_id"], output.rstrip("/")),
-        )
+    # all jobs were submitted just before
+    submit_time = time.time()
+
+    try:
+        for entry, reservation_id in zip(entries, reservation_ids):
+            slurm_run_info, message, outputs, prefixes, alt_dir, *job_info = entry
+            job_info = job_info[0] if job_info else {}
+
+            if reservation_id is not None:
+                # the locks of the reservation become the locks of the job
+                for table in ("locked_names", "locked_prefixes"):
+                    cur.execute(
+                        f"UPDATE {table} SET slurm_job_id = ? WHERE slurm_job_id = ?",
+                        (slurm_run_info["slurm_job_id"], -reservation_id),
+                    )
+                cur.execute(
+                    "DELETE FROM reservations WHERE reservation_id = ?",
+                    (reservation_id,),
+                )
 
-    if prefixes:
-        for prefix in prefixes:
+            # add the schedule command to the table,
+            # converting the list columns to json
             cur.execute(
                 """
-            INSERT INTO locked_prefixes (slurm_job_id,
-            prefix)
+            INSERT INTO open_jobs (slurm_job_id,
+            message,
+            chain,
+            cmd,
+            dsid,
+            inputs,
+            extra_inputs,
+            outputs,
+            slurm_outputs,
+            pwd,
+            alt_dir,
+            submit_time,
+            extra_info)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    slurm_run_info["slurm_job_id"],
+                    message,
+                    json.dumps(slurm_run_info["chain"]),
+                    slurm_run_info["cmd"],
+                    slurm_run_info["dsid"],
+                    json.dumps(slurm_run_info["inputs"]),
+                    json.dumps(slurm_run_info["extra_inputs"]),
+                    json.dumps(slurm_run_info["outputs"]),
+                    json.dumps(slurm_run_info["slurm_outputs"]),
+                    slurm_run_info["pwd"],
+                    alt_dir if alt_dir else "",
+                    submit_time,
+                    json.dumps(
+                        {
+                            k: v
+                            for k, v in slurm_run_info.items()
+                            if k not in _RECORD_COLUMNS
+                        }
+                    ),
+                ),
+            )
+            if job_info:
+                _update_open_job(cur, slurm_run_info["slurm_job_id"], job_info)
+
+            cur.executemany(
+                """
+            INSERT OR IGNORE INTO locked_names (slurm_job_id,
+            name)
             VALUES (?, ?)
             """,
-                (slurm_run_info["slurm_job_id"], prefix),
+                [
+                    (slurm_run_info["slurm_job_id"], output.rstrip("/"))
+                    for output in outputs
+                ],
             )
 
-    # save and close
-    con.commit()
-    con.close()
+            if prefixes:
+                cur.executemany(
+                    """
+                INSERT OR IGNORE INTO locked_prefixes (slurm_job_id,
+                prefix)
+                VALUES (?, ?)
+                """,
+                    [(slurm_run_info["slurm_job_id"], prefix) for prefix in prefixes],
+                )
+
+        con.commit()
+    except sqlite3.Error as e:
+        con.rollback()
+        lgr.error("Cannot add %d jobs to the database: %s", len(entries), e)
+        return None
+    finally:
+        con.close()
+
+    return True
+
+
+def update_open_job(dset, slurm_job_id, **columns):
+    """
+    Change columns of a job in the open jobs database.
+
+    Parameters
+    ----------
+    slurm_job_id : str
+        The Slurm job ID.
+    **columns
+        The new values by column name.
 
+    Returns
+    -------
+    bool or None
+        True on success, None if the connection to the database could not be
+        established.
+    """
+    con, cur = connect_to_database(dset)
+    if not cur or not con:
+        return None
+    try:
+        _update_open_job(cur, slurm_job_id, columns)
+        con.commit()
+    except sqlite3.Error as e:
+        lgr.error("Cannot update job %s in the database: %s", slurm_job_id, e)
+        return None
+    finally:
+        con.close()
     return True
 
 
+def _update_open_job(cur, slurm_job_id, columns):
+    assignments = ", ".join(f"{column} = ?" for column in columns)
+    cur.execute(
+        f"UPDATE open_jobs SET {assignments} WHERE slurm_job_id = ?",
+        (*columns.values(), slurm_job_id),
+    )
+
+
 def _none_to_empty_list(value):
     return [] if value is None else value
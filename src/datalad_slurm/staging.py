@@ -0,0 +1,667 @@
+"""Copy job inputs and outputs between a dataset and an alternative job directory"""
+
+__docformat__ = "restructuredtext"
+
+import argparse
+import errno
+import glob
+import hashlib
+import json
+import logging
+import os
+import os.path as op
+import shutil
+import sqlite3
+import stat
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+lgr = logging.getLogger("datalad.slurm.staging")
+
+# ioctl request of Linux to share the extents of a file (a reflink)
+FICLONE = 0x40049409
+
+# the staging manifest in the top directory of an alternative directory
+MANIFEST_NAME = ".datalad-slurm-staging.db"
+
+
+def stage_paths(
+    src_root, dst_root, paths, max_workers=8, hardlink=False, objects=None
+):
+    """
+    Copy files and directories to the same relative location in another tree.
+
+    Like `cp -r -L -u`, symlinks are followed and a file is only copied if
+    it is not in the target yet or has a different size or modification time
+    there. Directories are walked with `os.scandir` while a pool of threads
+    copies the files. A file is reflinked if the filesystem supports it,
+    otherwise copied with `copy_file_range` and as a last resort with
+    ordinary reads and writes.
+
+    Parameters
+    ----------
+    src_root : str
+        The directory the paths are relative to.
+    dst_root : str
+        The directory to copy the paths to.
+    paths : list of str
+        Paths relative to `src_root`, which may contain glob patterns.
+    max_workers : int, optional
+        The number of files copied at the same time.
+    hardlink : bool, optional
+        Hardlink the files instead of copying them, where possible. A job
+        which modifies its inputs in place then modifies the originals.
+    objects : dict, optional
+        Files to copy from elsewhere, e.g. annexed files from their annex
+        objects (see `get_annex_objects`), by their normalized path.
+
+    Returns
+    -------
+    dict
+        The number of 'files' copied, the number of unchanged files
+        'skipped', the 'bytes' copied, the 'seconds' it took and the
+        'errors', a list of (path, message) for what could not be copied.
+    """
+    start = time.monotonic()
+    stats = dict(files=0, skipped=0, bytes=0, seconds=0.0, errors=[])
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+        futures = []
+        for path in paths:
+            path = path.rstrip("/") or path
+            pattern = op.join(src_root, path)
+            matches = glob.glob(pattern) if glob.has_magic(path) else [pattern]
+            if not matches:
+                stats["errors"].append((path, "no such file or directory"))
+            for src in matches:
+                dst = op.normpath(op.join(dst_root, op.relpath(src, src_root)))
+                for src_file, dst_file, st in _walk(
+                    src, dst, objects or {}, stats["errors"]
+                ):
+                    if _is_unchanged(dst_file, st):
+                        stats["skipped"] += 1
+                        continue
+                    futures.append(
+                        (
+                            src_file,
+                            st,
+                            pool.submit(_copy_file, src_file, dst_file, st, hardlink),
+                        )
+                    )
+        for src_file, st, future in futures:
+            try:
+                future.result()
+            except OSError as e:
+                stats["errors"].append((src_file, e.strerror or str(e)))
+                continue
+            stats["files"] += 1
+            stats["bytes"] += st.st_size
+    stats["seconds"] = time.monotonic() - start
+    return stats
+
+
+def collect_paths(
+    src_root, dst_root, paths, max_workers=8, retain=False, verify="size"
+):
+    """
+    Move files and directories back from another tree.
+
+    This is the reverse of `stage_paths`, for the outputs of a job. Where
+    both trees are on the same filesystem, the paths are renamed, a whole
+    directory at once if it does not exist in the target yet. Otherwise, or
+    if the originals are to be retained, the files are copied by a pool of
+    threads and the originals are removed once all copies are verified.
+    Existing files in the target are replaced.
+
+    Parameters
+    ----------
+    src_root : str
+        The directory the paths are relative to.
+    dst_root : str
+        The directory to move the paths to.
+    paths : list of str
+        Paths relative to `src_root`, which may contain glob patterns.
+    max_workers : int, optional
+        The number of files copied at the same time.
+    retain : bool, optional
+        Copy the files and keep the originals.
+    verify : {"size", "checksum"}, optional
+        How a copy is verified, by its size or by its SHA-256 checksum.
+
+    Returns
+    -------
+    dict
+        The number of 'files' copied, of paths 'renamed', the 'bytes'
+        copied, the 'seconds' it took, the paths which were 'missing' in
+        `src_root` and the 'errors', a list of (path, message) for what
+        could not be moved or copied. Paths which are missing in `src_root`
+        but exist in `dst_root` were moved before and count as neither.
+    """
+    if verify not in ("size", "checksum"):
+        raise ValueError(f"Unknown verification {verify!r}")
+    start = time.monotonic()
+    stats = dict(files=0, renamed=0, bytes=0, seconds=0.0, missing=[], errors=[])
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+        futures = []
+        for path in paths:
+            path = path.rstrip("/") or path
+            pattern = op.join(src_root, path)
+            matches = glob.glob(pattern) if glob.has_magic(path) else [pattern]
+            if not matches or not op.lexists(matches[0]):
+                if not glob.has_magic(path) and op.lexists(op.join(dst_root, path)):
+                    continue
+                stats["missing"].append(path)
+                continue
+            for src in matches:
+                dst = op.normpath(op.join(dst_root, op.relpath(src, src_root)))
+                try:
+                    os.makedirs(op.dirname(dst), exist_ok=True)
+                    if not retain and _rename(src, dst):
+                        stats["renamed"] += 1
+                        continue
+                except OSError as e:
+                    stats["errors"].append((src, e.strerror or str(e)))
+                    continue
+                for src_file, dst_file, st in _walk(src, dst, {}, stats["errors"]):
+                    futures.append(
+                        (
+                            src_file,
+                            st,
+                            pool.submit(_collect_file, src_file, dst_file, st, verify),
+                        )
+                    )
+        collected = []
+        for src_file, st, future in futures:
+            try:
+                future.result()
+            except OSError as e:
+                stats["errors"].append((src_file, e.strerror or str(e)))
+                continue
+            collected.append(src_file)
+            stats["files"] += 1
+            stats["bytes"] += st.st_size
+    if not retain:
+        # only now, symlinks among the paths might point to other files
+        for src_file in collected:
+            try:
+                os.unlink(src_file)
+            except OSError as e:
+                stats["errors"].append((src_file, e.strerror or str(e)))
+        for path in paths:
+            pattern = op.join(src_root, path.rstrip("/") or path)
+            for src in glob.glob(pattern) if glob.has_magic(path) else [pattern]:
+                _remove_empty_dirs(src)
+    stats["seconds"] = time.monotonic() - start
+    return stats
+
+
+def _rename(src, dst):
+    """Rename `src` to `dst` if they are on the same filesystem.
+
+    Returns whether it was renamed. Symlinks are not renamed, since their
+    targets are to be copied.
+    """
+    if op.islink(src) or os.stat(src).st_dev != os.stat(op.dirname(dst)).st_dev:
+        return False
+    if op.isdir(src):
+        if op.lexists(dst):
+            if not op.isdir(dst) or op.islink(dst):
+                return False
+            # merge into the existing directory, entry by entry
+            with os.scandir(src) as entries:
+                for entry in list(entries):
+                    target = op.join(dst, entry.name)
+                    if not _rename(entry.path, target):
+                        return False
+            return True
+        os.rename(src, dst)
+        return True
+    if op.isdir(dst) and not op.islink(dst):
+        return False
+    os.replace(src, dst)
+    return True
+
+
+def _collect_file(src, dst, st, verify):
+    _copy_file(src, dst, st)
+    dst_st = os.stat(dst)
+    if dst_st.st_size != st.st_size or (
+        verify == "checksum" and _checksum(src) != _checksum(dst)
+    ):
+        raise OSError(errno.EIO, f"the copy in {dst} differs from the original")
+
+
+def _checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remove_empty_dirs(path):
+    if not op.isdir(path) or op.islink(path):
+        return
+    for root, dirs, files in os.walk(path, topdown=False):
+        try:
+            os.rmdir(root)
+        except OSError:
+            # not empty
+            pass
+
+
+def _walk(src, dst, objects, errors):
+    """Yield (source, target, stat of the source) for all files below `src`.
+
+    Files in `objects` are taken from the path given there. The target
+    directories are created on the way, including those above `dst`.
+    """
+    obj = objects.get(op.normpath(src))
+    try:
+        st = os.stat(obj or src)
+        is_dir = stat.S_ISDIR(st.st_mode)
+        os.makedirs(dst if is_dir else op.dirname(dst), exist_ok=True)
+    except OSError as e:
+        # e.g. a broken symlink of an annexed file without content
+        errors.append((src, e.strerror or str(e)))
+        return
+    if not is_dir:
+        yield obj or src, dst, st
+        return
+    try:
+        with os.scandir(src) as entries:
+            entries = list(entries)
+    except OSError as e:
+        errors.append((src, e.strerror or str(e)))
+        return
+    for entry in entries:
+        target = op.join(dst, entry.name)
+        if op.normpath(entry.path) in objects:
+            yield from _walk(entry.path, target, objects, errors)
+            continue
+        try:
+            is_dir = entry.is_dir()
+            st = entry.stat()
+        except OSError as e:
+            errors.append((entry.path, e.strerror or str(e)))
+            continue
+        if is_dir:
+            yield from _walk(entry.path, target, objects, errors)
+        else:
+            yield entry.path, target, st
+
+
+def get_annex_objects(src_root, paths, max_workers=8):
+    """
+    Find the annex objects of the annexed files among some paths.
+
+    Objects which are not present are fetched with `git annex get`, by their
+    keys, so that the files in the worktree are left alone. This way, also
+    the content of unlocked files and files on adjusted branches can be
+    staged straight from the annex.
+
+    Parameters
+    ----------
+    src_root : str
+        The directory the paths are relative to, inside of the repository.
+    paths : list of str
+        Paths relative to `src_root`, which may contain glob patterns.
+    max_workers : int, optional
+        The number of objects fetched at the same time.
+
+    Returns
+    -------
+    dict
+        The path of the annex object of each annexed file, by the normalized
+        path of the file. Empty if the paths are not in an annex repository.
+    """
+    expanded = []
+    for path in paths:
+        if glob.has_magic(path):
+            expanded += [
+                op.relpath(match, src_root)
+                for match in glob.glob(op.join(src_root, path))
+            ]
+        else:
+            expanded.append(path)
+    if not expanded:
+        return {}
+    try:
+        git_dir = subprocess.run(
+            ["git", "rev-parse", "--absolute-git-dir"],
+            cwd=src_root,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        # paths which are not annexed or do not exist are reported as errors
+        # but do not stop the others
+        found = subprocess.run(
+            ["git", "annex", "find", "--include=*", "--json", "--"] + expanded,
+            cwd=src_root,
+            capture_output=True,
+            text=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        lgr.debug("Cannot look up annexed files in %s: %s", src_root, e)
+        return {}
+
+    objects = {}
+    missing = {}
+    for line in found.splitlines():
+        try:
+            rec = json.loads(line)
+            key = rec["key"]
+        except (ValueError, KeyError, TypeError):
+            continue
+        # the mixed case hash directories are used unless the filesystem is
+        # case insensitive
+        candidates = [
+            op.join(git_dir, "annex", "objects", rec[hashdir] + key, key)
+            for hashdir in ("hashdirmixed", "hashdirlower")
+            if rec.get(hashdir)
+        ]
+        if not candidates:
+            continue
+        path = op.normpath(op.join(src_root, rec["file"]))
+        objects[path] = next((c for c in candidates if op.exists(c)), None)
+        if not objects[path]:
+            missing.setdefault(key, (candidates, []))[1].append(path)
+
+    if missing:
+        get = subprocess.run(
+            ["git", "annex", "get", "-J", str(max(max_workers, 1)), "--batch-keys"],
+            cwd=src_root,
+            input="".join(f"{key}\n" for key in missing),
+            capture_output=True,
+            text=True,
+        )
+        if get.returncode:
+            lgr.debug("git annex get failed: %s", get.stderr.strip())
+        for candidates, key_paths in missing.values():
+            obj = next((c for c in candidates if op.exists(c)), candidates[0])
+            for path in key_paths:
+                # a missing object is reported when it is staged
+                objects[path] = obj
+    return objects
+
+
+def _is_unchanged(dst, st):
+    try:
+        dst_st = os.stat(dst)
+    except OSError:
+        return False
+    return op.samestat(st, dst_st) or (
+        dst_st.st_size == st.st_size and dst_st.st_mtime_ns == st.st_mtime_ns
+    )
+
+
+def _copy_file(src, dst, st, hardlink=False):
+    # never write through an earlier hardlink into the original
+    if op.lexists(dst):
+        os.unlink(dst)
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            # e.g. a different filesystem
+            pass
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if not _reflink(fsrc, fdst):
+            _copy_data(fsrc, fdst)
+    os.chmod(dst, stat.S_IMODE(st.st_mode))
+    # the modification time tells later stagings that the file is unchanged
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _reflink(fsrc, fdst):
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        return False
+    return True
+
+
+def _copy_data(fsrc, fdst):
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                pass
+            return
+        except OSError as e:
+            if e.errno not in (
+                errno.EXDEV,
+                errno.ENOSYS,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+                errno.EBADF,
+            ):
+                raise
+            # start over without it
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+    shutil.copyfileobj(fsrc, fdst, 1 << 20)
+
+
+def format_size(size):
+    """Return a number of bytes in a human readable form, e.g. '1.5 GB'."""
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if size < 1000 or unit == "TB":
+            break
+        size /= 1000
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def get_staging_target(rel_pwd, path):
+    """Return where an input is staged, relative to the alternative directory."""
+    return op.normpath(op.join(rel_pwd or op.curdir, path.rstrip("/") or path))
+
+
+def connect_to_manifest(alt_dir, busy_timeout=60):
+    """
+    Open the staging manifest of an alternative directory.
+
+    The manifest records the content identity of every input staged in the
+    alternative directory, by its target path, and which jobs use it. It is
+    shared by all datasets and processes which stage there. Since
+    alternative directories are often on network filesystems, it does not
+    use a write-ahead log.
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+    con = sqlite3.connect(op.join(alt_dir, MANIFEST_NAME), timeout=busy_timeout)
+    con.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+    con.execute("PRAGMA journal_mode = delete")
+    con.execute(
+        """
+    CREATE TABLE IF NOT EXISTS staged (
+    target TEXT PRIMARY KEY,
+    content_id TEXT NOT NULL,
+    staged REAL NOT NULL
+    ) WITHOUT ROWID
+    """
+    )
+    con.execute(
+        """
+    CREATE TABLE IF NOT EXISTS refs (
+    target TEXT NOT NULL,
+    slurm_job_id INTEGER NOT NULL,
+    PRIMARY KEY (target, slurm_job_id)
+    ) WITHOUT ROWID
+    """
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS refs_slurm_job_id ON refs (slurm_job_id)")
+    return con
+
+
+def get_staged(con, targets):
+    """Return the content identities of the targets in the manifest."""
+    staged = {}
+    targets = list(targets)
+    # stay below the limit of SQLite for host parameters
+    for n in range(0, len(targets), 500):
+        chunk = targets[n : n + 500]
+        staged.update(
+            con.execute(
+                "SELECT target, content_id FROM staged WHERE target IN ({})".format(
+                    ", ".join("?" * len(chunk))
+                ),
+                chunk,
+            )
+        )
+    return staged
+
+
+def record_staged(con, content_ids):
+    """Record the content identities of staged targets in the manifest."""
+    now = time.time()
+    con.executemany(
+        "INSERT OR REPLACE INTO staged (target, content_id, staged) VALUES (?, ?, ?)",
+        [(target, content_id, now) for target, content_id in content_ids.items()],
+    )
+    con.commit()
+
+
+def add_staging_refs(con, slurm_job_id, targets):
+    """Record that a job uses the staged targets."""
+    con.executemany(
+        "INSERT OR IGNORE INTO refs (target, slurm_job_id) VALUES (?, ?)",
+        [(target, int(slurm_job_id)) for target in targets],
+    )
+    con.commit()
+
+
+def release_staging_refs(alt_dir, con, slurm_job_id, cleanup=False):
+    """
+    Drop the references of a job to its staged inputs.
+
+    Parameters
+    ----------
+    alt_dir : str
+        The alternative directory.
+    con : sqlite3.Connection
+        The staging manifest of the alternative directory.
+    slurm_job_id : int or str
+        The job.
+    cleanup : bool, optional
+        Remove the targets which no other job uses anymore from the
+        alternative directory and the manifest.
+
+    Returns
+    -------
+    list of str
+        The targets which were removed.
+    """
+    slurm_job_id = int(slurm_job_id)
+    targets = [
+        row[0]
+        for row in con.execute(
+            "SELECT target FROM refs WHERE slurm_job_id = ?", (slurm_job_id,)
+        )
+    ]
+    con.execute("DELETE FROM refs WHERE slurm_job_id = ?", (slurm_job_id,))
+    removed = []
+    if cleanup:
+        for target in targets:
+            if con.execute(
+                "SELECT 1 FROM refs WHERE target = ? LIMIT 1", (target,)
+            ).fetchone():
+                continue
+            con.execute("DELETE FROM staged WHERE target = ?", (target,))
+            if op.isabs(target) or target.split(op.sep)[0] in (op.pardir, op.curdir):
+                # never remove anything outside of the alternative directory
+                continue
+            pattern = op.join(alt_dir, target)
+            for path in glob.glob(pattern) if glob.has_magic(target) else [pattern]:
+                if op.isdir(path) and not op.islink(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif op.lexists(path):
+                    os.unlink(path)
+            removed.append(target)
+    con.commit()
+    return removed
+
+
+def main(argv=None):
+    """
+    Stage or collect paths from the command line.
+
+    This lets the transfers run off the login node, e.g. in a Slurm job::
+
+        python -m datalad_slurm.staging collect ALT_DIR DATASET PATH...
+
+    The statistics are printed as JSON. The exit code is 1 if anything could
+    not be transferred.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m datalad_slurm.staging",
+        description="Copy job inputs to an alternative directory (stage) or "
+        "move job outputs back from it (collect).",
+    )
+    parser.add_argument("action", choices=("stage", "collect"))
+    parser.add_argument("src_root", help="directory the paths are relative to")
+    parser.add_argument("dst_root", help="directory to transfer the paths to")
+    parser.add_argument("paths", nargs="+", help="paths, may contain globs")
+    parser.add_argument(
+        "-J", "--jobs", type=int, default=8, help="files transferred at a time"
+    )
+    parser.add_argument(
+        "--hardlink", action="store_true", help="stage: hardlink instead of copy"
+    )
+    parser.add_argument(
+        "--annex",
+        action="store_true",
+        help="stage: copy annexed files from their annex objects",
+    )
+    parser.add_argument(
+        "--retain", action="store_true", help="collect: keep the originals"
+    )
+    parser.add_argument(
+        "--verify",
+        choices=("size", "checksum"),
+        default="size",
+        help="collect: how copies are verified",
+    )
+    args = parser.parse_args(argv)
+
+    if args.action == "stage":
+        stats = stage_paths(
+            args.src_root,
+            args.dst_root,
+            args.paths,
+            max_workers=args.jobs,
+            hardlink=args.hardlink,
+            objects=(
+                get_annex_objects(args.src_root, args.paths, args.jobs)
+                if args.annex
+                else None
+            ),
+        )
+    else:
+        stats = collect_paths(
+            args.src_root,
+            args.dst_root,
+            args.paths,
+            max_workers=args.jobs,
+            retain=args.retain,
+            verify=args.verify,
+        )
+    json.dump(stats, sys.stdout)
+    print()
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
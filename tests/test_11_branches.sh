@@ -103,9 +103,17 @@ done
 
 datalad slurm-finish --list-open-jobs
 
+BRANCH=`git branch --show-current`
+
 echo "finishing completed jobs:"
 datalad slurm-finish --branches
 
+# the job branches are committed without switching the checked out branch
+if [[ `git branch --show-current` != $BRANCH ]] ; then
+    echo "Error: checked out branch changed from $BRANCH"
+    exit -1
+fi
+
 #echo " ### git log in this repo ### "
 #echo ""
 #git log
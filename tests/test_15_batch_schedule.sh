@@ -0,0 +1,103 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test datalad 'slurm-schedule --from-file' functionality
+#   - create some job dirs and job scripts and 'commit' them
+#   - write one job specification per job dir into a JSON lines file,
+#     plus one more job which conflicts with the first one
+#   - schedule all of them with a single 'datalad slurm-schedule --from-file'
+#   - wait until all of them are finished, then run 'datalad slurm-finish'
+#
+# Expected results: the conflicting job is reported as impossible,
+# all others should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-15_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+
+# make the slurm batch script
+
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+# Create the script
+cat << EOF2 > $TESTDIR/slurm.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest15"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.slurm-%j.out
+echo "started"
+OUTPUT="output_test.txt"
+# simulate some text output
+for i in \`seq 1 10\`; do
+    echo \$i | tee -a \$OUTPUT
+    sleep 1s
+done
+# simulate some binary output which will become an annex file
+bzip2 -k \$OUTPUT
+echo "ended"
+EOF2
+
+# Make the script executable
+chmod u+x $TESTDIR/slurm.template.sh
+
+cd $TESTDIR
+
+TARGETS=`seq 1 20`
+
+rm -f ../specs-test-15.jsonl
+for i in $TARGETS ; do
+
+    DIR="test_15_output_dir_"$i
+    mkdir -p $DIR
+
+    cp slurm.template.sh $DIR/slurm.sh
+
+    echo "{\"cmd\": \"sbatch --chdir $DIR slurm.sh\", \"inputs\": [\"$DIR/slurm.sh\"], \"outputs\": [\"$DIR\"]}" >> ../specs-test-15.jsonl
+done
+
+# conflicts with the first job
+echo "{\"cmd\": \"sbatch --chdir test_15_output_dir_1 slurm.sh\", \"outputs\": [\"test_15_output_dir_1/output_test.txt\"]}" >> ../specs-test-15.jsonl
+
+datalad save -m "add test job dirs and scripts"
+
+datalad slurm-schedule --on-failure ignore --from-file ../specs-test-15.jsonl
+
+while [[ 0 != `squeue -u $USER | grep "DLtest15" | wc -l` ]] ; do
+
+    echo "    ... wait for jobs to finish"
+    sleep 30s
+done
+
+datalad slurm-finish --list-open-jobs
+
+echo "finishing completed jobs:"
+datalad slurm-finish
@@ -0,0 +1,102 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Benchmark the output conflict check of 'datalad slurm-schedule'
+#   - fill the open jobs database of a fresh dataset with a growing number of
+#     synthetic open jobs (up to 100k), each with a few locked outputs
+#   - after every step, time the conflict check for a new job which does not
+#     conflict and for one which conflicts with the latest open job
+#
+# This does not need Slurm, it only exercises the database.
+#
+# Expected results: should run without any errors, the conflict check time
+# in timing_conflict_check.txt should stay flat with the number of open jobs
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+# optional second argument for how many extra output specs each job has
+NUMOUTEXTRA=$2
+if [[ -z $NUMOUTEXTRA ]] ; then
+
+    NUMOUTEXTRA=2
+fi
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-16_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+cd $TESTDIR
+
+python - $NUMOUTEXTRA <<EOF2
+import sys
+import time
+
+from datalad.api import Dataset
+from datalad_slurm.schedule import (
+    add_jobs_to_database,
+    check_output_conflict,
+    get_sub_paths,
+)
+
+num_extra = int(sys.argv[1])
+ds = Dataset(".")
+
+
+def job(i):
+    outputs = [f"{i % 30}/test_16_output_dir_{i}/output_test.txt"] + [
+        f"{i % 30}/test_16_output_dir_{i}/output_test.hash.{e}"
+        for e in range(num_extra)
+    ]
+    slurm_run_info = dict(
+        slurm_job_id=i,
+        chain=[],
+        cmd="sbatch slurm.sh",
+        dsid=ds.id,
+        inputs=[],
+        extra_inputs=[],
+        outputs=outputs,
+        slurm_outputs=[],
+        pwd=".",
+    )
+    return slurm_run_info, None, outputs, get_sub_paths(outputs), None
+
+
+with open("../timing_conflict_check.txt", "w") as f:
+    f.write("num_jobs time_no_conflict time_conflict\n")
+    num_jobs = 0
+    for target in [1000, 2000, 5000, 10000, 20000, 50000, 100000]:
+        add_jobs_to_database(ds, [job(i) for i in range(num_jobs + 1, target + 1)])
+        num_jobs = target
+
+        new_outputs = [f"new/test_16_output_dir_{target}/output_test.txt"]
+        start = time.time()
+        conflict, _ = check_output_conflict(
+            ds, new_outputs, get_sub_paths(new_outputs)
+        )
+        time_no_conflict = time.time() - start
+        assert not conflict
+
+        _, _, old_outputs, old_prefixes, _ = job(target)
+        start = time.time()
+        conflict, _ = check_output_conflict(ds, old_outputs, old_prefixes)
+        time_conflict = time.time() - start
+        assert conflict
+
+        print(f"{num_jobs} open jobs: {time_no_conflict:.4f}s / {time_conflict:.4f}s")
+        f.write(f"{num_jobs} {time_no_conflict:.6f} {time_conflict:.6f}\n")
+EOF2
+
+echo ""
+echo "done, timings are in $D/timing_conflict_check.txt"
@@ -0,0 +1,135 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test datalad 'slurm-schedule --defer-job-info'
+#   - create some job dirs and job scripts and 'commit' them, half of them
+#     array jobs with the slurm log file names set in the job script
+#   - 'datalad slurm-schedule --defer-job-info' all jobs from their job dirs
+#   - wait until all of them are finished, then run 'datalad slurm-finish'
+#   - check that the slurm log files and the job environment files were
+#     committed, although they were not looked up at submission time
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-17_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+cat << EOF2 > $TESTDIR/slurm.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest17"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+echo "started"
+OUTPUT="output_test_17.txt"
+for i in \$(seq 1 20); do
+   echo \$i | tee -a \$OUTPUT
+   sleep 1s
+done
+echo "ended"
+EOF2
+
+cat << EOF2 > $TESTDIR/slurm.array.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest17"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.%x-%A_%03a.out
+#SBATCH --array=1-5:2
+echo "started"
+OUTPUT="output_test_array_"\$SLURM_ARRAY_TASK_ID".txt"
+for i in \$(seq 1 20); do
+   echo \$i | tee -a \$OUTPUT
+   sleep 1s
+done
+echo "ended"
+EOF2
+
+cd $TESTDIR
+
+TARGETS=`seq 1 6`
+
+for i in $TARGETS ; do
+
+    DIR="test_17_output_dir_"$i
+    mkdir -p $DIR
+
+    if (( i % 2 )) ; then
+        cp slurm.template.sh $DIR/slurm.sh
+    else
+        cp slurm.array.template.sh $DIR/slurm.sh
+    fi
+
+done
+
+datalad save -m "add test job dirs and scripts"
+
+for i in $TARGETS ; do
+
+    DIR="test_17_output_dir_"$i
+
+    cd $DIR
+    datalad slurm-schedule --defer-job-info -o $PWD sbatch slurm.sh
+    cd ..
+
+done
+
+while [[ 0 != `squeue -u $USER | grep "DLtest17" | wc -l` ]] ; do
+
+    echo "    ... wait for jobs to finish"
+    sleep 30s
+done
+
+datalad slurm-finish
+
+echo -e "\n #### Open jobs after 'datalad slurm-finish':\n"
+datalad slurm-finish --list-open-jobs
+
+for i in $TARGETS ; do
+
+    DIR="test_17_output_dir_"$i
+
+    if [[ -z `git ls-files $DIR/slurm-job-*.env.json` ]] ; then
+        echo "Error: no job environment file committed in $DIR"
+        exit -1
+    fi
+    if [[ -z `git ls-files "$DIR/*.out"` ]] ; then
+        echo "Error: no slurm log files committed in $DIR"
+        exit -1
+    fi
+
+done
+
+echo "done"
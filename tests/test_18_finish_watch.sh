@@ -0,0 +1,127 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test datalad 'slurm-finish --watch'
+#   - create some job dirs and job scripts of different run times and
+#     'commit' them, half of them array jobs
+#   - 'datalad slurm-schedule' all jobs from their job dirs
+#   - run 'datalad slurm-finish --watch' right away, which has to finish
+#     every job after it ended and return when no open jobs are left
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-18_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+cat << EOF2 > $TESTDIR/slurm.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest18"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+RUNTIME=RUNTIME_PLACEHOLDER
+echo "started"
+OUTPUT="output_test_18.txt"
+for i in \$(seq 1 \$RUNTIME); do
+   echo \$i | tee -a \$OUTPUT
+   sleep 1s
+done
+echo "ended"
+EOF2
+
+cat << EOF2 > $TESTDIR/slurm.array.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest18"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.%x-%A_%03a.out
+#SBATCH --array=1-5:2
+RUNTIME=RUNTIME_PLACEHOLDER
+echo "started"
+OUTPUT="output_test_array_"\$SLURM_ARRAY_TASK_ID".txt"
+for i in \$(seq 1 \$RUNTIME); do
+   echo \$i | tee -a \$OUTPUT
+   sleep 1s
+done
+echo "ended"
+EOF2
+
+cd $TESTDIR
+
+TARGETS=`seq 1 6`
+
+for i in $TARGETS ; do
+
+    DIR="test_18_output_dir_"$i
+    mkdir -p $DIR
+
+    if (( i % 2 )) ; then
+        cp slurm.template.sh $DIR/slurm.sh
+    else
+        cp slurm.array.template.sh $DIR/slurm.sh
+    fi
+    sed -i "s/RUNTIME_PLACEHOLDER/$(( i * 10 ))/" $DIR/slurm.sh
+
+done
+
+datalad save -m "add test job dirs and scripts"
+
+for i in $TARGETS ; do
+
+    DIR="test_18_output_dir_"$i
+
+    cd $DIR
+    datalad slurm-schedule -o $PWD sbatch slurm.sh
+    cd ..
+
+done
+
+datalad slurm-finish --watch
+
+if [[ 0 != `squeue -u $USER | grep "DLtest18" | wc -l` ]] ; then
+    echo "Error: 'datalad slurm-finish --watch' returned before all jobs ended"
+    exit -1
+fi
+
+echo -e "\n #### Open jobs after 'datalad slurm-finish --watch':\n"
+datalad slurm-finish --list-open-jobs
+
+FINISHED=`git log --oneline | grep "DATALAD SLURM RUN" | wc -l`
+if [[ 6 != $FINISHED ]] ; then
+    echo "Error: expected 6 finished jobs, found $FINISHED"
+    exit -1
+fi
+
+echo "done"
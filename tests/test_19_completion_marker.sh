@@ -0,0 +1,143 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test datalad 'slurm-schedule --completion-marker' with 'slurm-finish --watch'
+#   - create some job dirs and job scripts of different run times and
+#     'commit' them, half of them array jobs, one of them failing
+#   - 'datalad slurm-schedule --completion-marker' all jobs from their job dirs
+#   - check that the #SBATCH options of the job scripts apply to the wrapped jobs
+#   - run 'datalad slurm-finish --watch --close-failed-jobs' right away,
+#     which has to finish every job after it left its completion markers
+#   - check that no completion markers are left behind
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-19_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+cat << EOF2 > $TESTDIR/slurm.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest19"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+RUNTIME=RUNTIME_PLACEHOLDER
+echo "started"
+OUTPUT="output_test_19.txt"
+for i in \$(seq 1 \$RUNTIME); do
+   echo \$i | tee -a \$OUTPUT
+   sleep 1s
+done
+echo "ended"
+EOF2
+
+cat << EOF2 > $TESTDIR/slurm.array.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest19"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.%x-%A_%03a.out
+#SBATCH --array=1-5:2
+RUNTIME=RUNTIME_PLACEHOLDER
+echo "started"
+OUTPUT="output_test_array_"\$SLURM_ARRAY_TASK_ID".txt"
+for i in \$(seq 1 \$RUNTIME); do
+   echo \$i | tee -a \$OUTPUT
+   sleep 1s
+done
+echo "ended"
+EOF2
+
+cd $TESTDIR
+
+TARGETS=`seq 1 6`
+
+for i in $TARGETS ; do
+
+    DIR="test_19_output_dir_"$i
+    mkdir -p $DIR
+
+    if (( i % 2 )) ; then
+        cp slurm.template.sh $DIR/slurm.sh
+    else
+        cp slurm.array.template.sh $DIR/slurm.sh
+    fi
+    sed -i "s/RUNTIME_PLACEHOLDER/$(( i * 10 ))/" $DIR/slurm.sh
+    if [[ 1 == $i ]] ; then
+        echo "exit 1" >> $DIR/slurm.sh
+    fi
+
+done
+
+datalad save -m "add test job dirs and scripts"
+
+for i in $TARGETS ; do
+
+    DIR="test_19_output_dir_"$i
+
+    cd $DIR
+    datalad slurm-schedule --completion-marker -o $PWD sbatch slurm.sh
+    cd ..
+
+done
+
+if [[ 6 != `squeue -u $USER -h -o "%j %A" | grep "^DLtest19 " | sort -u | wc -l` ]] ; then
+    echo "Error: the wrapped jobs lack the #SBATCH options of their job scripts"
+    exit -1
+fi
+
+datalad slurm-finish --watch --close-failed-jobs
+
+if [[ 0 != `squeue -u $USER | grep "DLtest19" | wc -l` ]] ; then
+    echo "Error: 'datalad slurm-finish --watch' returned before all jobs ended"
+    exit -1
+fi
+
+echo -e "\n #### Open jobs after 'datalad slurm-finish --watch':\n"
+datalad slurm-finish --list-open-jobs
+
+if [[ -n `ls .git/datalad-slurm/markers` ]] ; then
+    echo "Error: completion markers left behind:"
+    ls .git/datalad-slurm/markers
+    exit -1
+fi
+
+FINISHED=`git log --oneline | grep "DATALAD SLURM RUN" | wc -l`
+if [[ 5 != $FINISHED ]] ; then
+    echo "Error: expected 5 finished jobs, found $FINISHED"
+    exit -1
+fi
+
+echo "done"
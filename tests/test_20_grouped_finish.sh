@@ -0,0 +1,130 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test datalad 'slurm-finish --group-size'
+#   - create some job dirs and job scripts and 'commit' them
+#   - schedule all of them with a single 'datalad slurm-schedule --from-file'
+#   - wait until all of them are finished, then finish them with
+#     'datalad slurm-finish --group-size 10'
+#   - check that there is one commit per group of 10 jobs
+#   - reschedule all jobs from these commits, and finish them again with
+#     'datalad slurm-finish --single-commit'
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-20_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+
+# make the slurm batch script
+
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+# Create the script
+cat << EOF2 > $TESTDIR/slurm.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest20"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.slurm-%j.out
+echo "started"
+OUTPUT="output_test.txt"
+# simulate some text output
+for i in \`seq 1 10\`; do
+    echo \$i | tee -a \$OUTPUT
+    sleep 1s
+done
+# simulate some binary output which will become an annex file
+bzip2 -k \$OUTPUT
+echo "ended"
+EOF2
+
+# Make the script executable
+chmod u+x $TESTDIR/slurm.template.sh
+
+cd $TESTDIR
+
+TARGETS=`seq 1 25`
+
+rm -f ../specs-test-20.jsonl
+for i in $TARGETS ; do
+
+    DIR="test_20_output_dir_"$i
+    mkdir -p $DIR
+
+    cp slurm.template.sh $DIR/slurm.sh
+
+    echo "{\"cmd\": \"sbatch --chdir $DIR slurm.sh\", \"inputs\": [\"$DIR/slurm.sh\"], \"outputs\": [\"$DIR\"]}" >> ../specs-test-20.jsonl
+done
+
+datalad save -m "add test job dirs and scripts"
+
+datalad slurm-schedule --from-file ../specs-test-20.jsonl
+
+while [[ 0 != `squeue -u $USER | grep "DLtest20" | wc -l` ]] ; do
+
+    echo "    ... wait for jobs to finish"
+    sleep 30s
+done
+
+echo "finishing completed jobs in groups of 10:"
+datalad slurm-finish --group-size 10
+
+COMMITS=`git log --oneline | grep "DATALAD SLURM RUN" | wc -l`
+if [[ 3 != $COMMITS ]] ; then
+    echo "Error: expected 3 commits for 25 jobs, found $COMMITS"
+    exit -1
+fi
+
+echo "rescheduling all jobs:"
+datalad slurm-reschedule --since=
+
+if [[ 25 != `datalad slurm-finish --list-open-jobs | grep -c "^[0-9]"` ]] ; then
+    echo "Error: the jobs were not rescheduled individually"
+    exit -1
+fi
+
+while [[ 0 != `squeue -u $USER | grep "DLtest20" | wc -l` ]] ; do
+
+    echo "    ... wait for jobs to finish"
+    sleep 30s
+done
+
+echo "finishing rescheduled jobs in a single commit:"
+datalad slurm-finish --single-commit
+
+COMMITS=`git log --oneline | grep "DATALAD SLURM RUN" | wc -l`
+if [[ 4 != $COMMITS ]] ; then
+    echo "Error: expected 4 commits, found $COMMITS"
+    exit -1
+fi
+
+echo "done"
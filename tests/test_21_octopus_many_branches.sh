@@ -0,0 +1,118 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test datalad 'slurm-finish --octopus' with many jobs
+#   - create some job dirs and job scripts and 'commit' them
+#   - schedule all of them with a single 'datalad slurm-schedule --from-file'
+#   - wait until all of them are finished, then run
+#     'datalad slurm-finish --octopus' with a merge fan-in of 4, which
+#     needs several levels of merge commits
+#   - check that no merge has more than 4 (+ HEAD) parents, that all outputs are
+#     in the working tree and that no job branches are left
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-21_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+
+# make the slurm batch script
+
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+# Create the script
+cat << EOF2 > $TESTDIR/slurm.template.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest21"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.slurm-%j.out
+echo "started"
+OUTPUT="output_test.txt"
+# simulate some text output
+for i in \`seq 1 10\`; do
+    echo \$i | tee -a \$OUTPUT
+    sleep 1s
+done
+# simulate some binary output which will become an annex file
+bzip2 -k \$OUTPUT
+echo "ended"
+EOF2
+
+# Make the script executable
+chmod u+x $TESTDIR/slurm.template.sh
+
+cd $TESTDIR
+
+TARGETS=`seq 1 40`
+
+rm -f ../specs-test-21.jsonl
+for i in $TARGETS ; do
+
+    DIR="test_21_output_dir_"$i
+    mkdir -p $DIR
+
+    cp slurm.template.sh $DIR/slurm.sh
+
+    echo "{\"cmd\": \"sbatch --chdir $DIR slurm.sh\", \"inputs\": [\"$DIR/slurm.sh\"], \"outputs\": [\"$DIR\"]}" >> ../specs-test-21.jsonl
+done
+
+datalad save -m "add test job dirs and scripts"
+
+datalad slurm-schedule --from-file ../specs-test-21.jsonl
+
+while [[ 0 != `squeue -u $USER | grep "DLtest21" | wc -l` ]] ; do
+
+    echo "    ... wait for jobs to finish"
+    sleep 30s
+done
+
+echo "finishing completed jobs:"
+datalad -c datalad.slurm.merge-fan-in=4 slurm-finish --octopus
+
+if [[ -n `git log --min-parents=6 --format=%H` ]] ; then
+    echo "Error: found a merge of more than 4 heads into a branch"
+    exit -1
+fi
+
+for i in $TARGETS ; do
+    if [[ ! -f "test_21_output_dir_"$i/output_test.txt ]] ; then
+        echo "Error: outputs of job $i are missing"
+        exit -1
+    fi
+done
+
+if [[ -n `git branch --list "slurm-job-branch-*"` ]] ; then
+    echo "Error: job branches left behind"
+    exit -1
+fi
+
+echo "done"
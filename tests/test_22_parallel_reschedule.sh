@@ -0,0 +1,127 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test 'datalad slurm-reschedule --parallel' on a small pipeline
+#   - schedule and finish two independent 'prepare' jobs one after another,
+#     then a 'combine' job reading both of their outputs
+#   - reschedule the whole range with --parallel
+#   - the 'prepare' jobs must be submitted without a dependency, the
+#     'combine' job with --dependency=afterok on both of them
+#   - wait until all of them are finished, then run 'datalad slurm-finish'
+#   - reschedule again with --only-changed, which must not submit anything
+#     since no inputs changed
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+B=`dirname $0`
+
+echo "from src dir "$B
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-22_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+cat << EOF > $TESTDIR/prepare.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest22"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.slurm-%j.out
+mkdir -p \$1
+sleep 20s
+seq 1 50 > \$1/data.txt
+EOF
+
+cat << EOF > $TESTDIR/combine.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest22"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.slurm-%j.out
+mkdir -p combined
+cat prepared_a/data.txt prepared_b/data.txt > combined/data.txt
+EOF
+
+chmod u+x $TESTDIR/prepare.sh $TESTDIR/combine.sh
+
+cd $TESTDIR
+
+datalad save -m "add test job scripts"
+
+wait_for_jobs() {
+    while [[ 0 != `squeue -u $USER | grep "DLtest22" | wc -l` ]] ; do
+
+        echo "    ... wait for jobs to finish"
+        sleep 1m
+    done
+}
+
+for i in a b ; do
+
+    datalad slurm-schedule -o prepared_$i sbatch prepare.sh prepared_$i
+    wait_for_jobs
+    datalad slurm-finish
+
+done
+
+datalad slurm-schedule -i prepared_a -i prepared_b -o combined sbatch combine.sh
+wait_for_jobs
+datalad slurm-finish
+
+# all three jobs are submitted right away, the last one waits for the others
+echo "rescheduling the pipeline in parallel:"
+datalad slurm-reschedule --parallel --since= | tee $D/reschedule-22.log
+
+if [[ 1 != `grep -c "dependency=afterok" $D/reschedule-22.log` ]] ; then
+    echo "Error: expected exactly one job with a dependency"
+    exit -1
+fi
+
+wait_for_jobs
+
+echo "finishing rescheduled jobs"
+datalad slurm-finish
+
+datalad slurm-finish --list-open-jobs
+
+# nothing changed since, so nothing is rescheduled
+echo "rescheduling changed jobs only (should submit nothing):"
+datalad slurm-reschedule --only-changed --parallel --since= | tee $D/reschedule-22.log
+
+if [[ 0 != `grep -c "slurm-schedule(" $D/reschedule-22.log` ]] ; then
+    echo "Error: jobs with unchanged inputs were rescheduled"
+    exit -1
+fi
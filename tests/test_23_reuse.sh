@@ -0,0 +1,108 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test 'datalad slurm-schedule --reuse'
+#   - schedule and finish a job
+#   - remove its outputs and schedule the same job again with --reuse, the
+#     outputs must come back without a job being submitted
+#   - change the input and schedule again with --reuse, now a job must be
+#     submitted
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+echo "start"
+
+B=`dirname $0`
+
+echo "from src dir "$B
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-23_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+cat << EOF > $TESTDIR/slurm.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest23"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.slurm-%j.out
+mkdir -p results
+sleep 20s
+wc -l input.txt > results/count.txt
+EOF
+
+chmod u+x $TESTDIR/slurm.sh
+
+cd $TESTDIR
+
+seq 1 50 > input.txt
+
+datalad save -m "add test job script and input"
+
+wait_for_jobs() {
+    while [[ 0 != `squeue -u $USER | grep "DLtest23" | wc -l` ]] ; do
+
+        echo "    ... wait for jobs to finish"
+        sleep 1m
+    done
+}
+
+datalad slurm-schedule -i input.txt -o results sbatch slurm.sh
+wait_for_jobs
+datalad slurm-finish
+
+git rm -r -q results
+git commit -q -m "remove the results"
+
+# the same job on the same input, nothing is submitted
+datalad slurm-schedule --reuse -i input.txt -o results sbatch slurm.sh
+
+if [ ! -f results/count.txt ]; then
+    echo "Error: the outputs were not reused"
+    exit -1
+fi
+if [[ 0 != `squeue -u $USER | grep "DLtest23" | wc -l` ]] ; then
+    echo "Error: a job was submitted although the outputs were reused"
+    exit -1
+fi
+
+# a changed input needs a new job
+seq 1 60 > input.txt
+datalad save -m "change the input"
+
+datalad slurm-schedule --reuse -i input.txt -o results sbatch slurm.sh
+wait_for_jobs
+datalad slurm-finish
+
+if [[ "60 input.txt" != `cat results/count.txt` ]] ; then
+    echo "Error: the job was not run on the changed input"
+    exit -1
+fi
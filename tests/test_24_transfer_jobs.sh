@@ -0,0 +1,102 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test the stage-in and stage-out jobs of 'datalad slurm-schedule --alt-dir'
+#   - set datalad.slurm.transfer-partition to the partition of the test jobs
+#   - schedule a job in an alternative directory, its inputs are staged by a
+#     stage-in job which the job depends on, its outputs are moved back by a
+#     stage-out job
+#   - wait for all jobs, then 'datalad slurm-finish' commits the outputs
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for test repository given, abort"
+    echo ""
+    echo "... call as $0 <test-dir> <alt-dir>"
+
+    exit -1
+fi
+
+D=$1
+
+if [[ -z $2 ]] ; then
+
+    echo "no alternative directory for test repository given, abort"
+    echo ""
+    echo "... call as $0 <test-dir> <alt-dir>"
+
+    exit -1
+fi
+
+A=$2/"datalad-slurm-test-24_"`date -Is|tr -d ":"`
+mkdir -p $A
+
+echo "start"
+
+B=`dirname $0`
+
+echo "from src dir "$B
+
+## create a test repo
+
+TESTDIR=$D/"datalad-slurm-test-24_"`date -Is|tr -d ":"`
+
+datalad create -c text2git $TESTDIR
+
+
+### generic part for all the tests ending here, specific parts follow ###
+
+if [ ! -f "slurm_config.txt" ]; then
+    echo "Error: slurm_config.txt must exist"
+    echo "Please see slurm_config_sample.txt for a template"
+    exit -1
+fi
+
+source slurm_config.txt
+
+cat << EOF > $TESTDIR/slurm.sh
+#!/bin/bash
+#SBATCH --job-name="DLtest24"         # name of the job
+#SBATCH --partition=$partition
+#SBATCH -A $account
+#SBATCH --time=0:05:00                # walltime (up to 96 hours)
+#SBATCH --ntasks=1                    # number of nodes
+#SBATCH --cpus-per-task=1             # number of tasks per node
+#SBATCH --output=log.slurm-%j.out
+mkdir -p results
+wc -l data/input.txt > results/count.txt
+EOF
+
+chmod u+x $TESTDIR/slurm.sh
+
+cd $TESTDIR
+
+mkdir -p data
+seq 1 50 > data/input.txt
+
+datalad save -m "add test job script and input"
+
+git config datalad.slurm.transfer-partition $partition
+git config datalad.slurm.transfer-sbatch-options "-A $account --time=0:05:00"
+
+datalad slurm-schedule -i slurm.sh -i data -o results --alt-dir $A sbatch slurm.sh
+
+while [[ 0 != `squeue -u $USER | grep -E "DLtest24|datalad-stage" | wc -l` ]] ; do
+
+    echo "    ... wait for jobs to finish"
+    sleep 30s
+done
+
+datalad slurm-finish
+
+if [[ "50 data/input.txt" != `cat results/count.txt` ]] ; then
+    echo "Error: the outputs were not moved back from the alternative directory"
+    exit -1
+fi
+if [ -e $A/results/count.txt ]; then
+    echo "Error: the outputs were not removed from the alternative directory"
+    exit -1
+fi
@@ -0,0 +1,62 @@
+#!/usr/bin/env bash
+
+set -e # abort on errors
+
+# Test the staging of job inputs into an alternative directory
+#   - create nested input files and directories like test_13_alt_dir.sh
+#   - stage them into an empty alternative directory, whose subdirectories
+#     have to be created on the way
+#   - stage them again, now all files are unchanged
+#   - staging a missing input has to fail
+#
+# This does not need Slurm, it only exercises the staging.
+#
+# Expected results: should run without any errors
+
+if [[ -z $1 ]] ; then
+
+    echo "no temporary directory for tests given, abort"
+    echo ""
+    echo "... call as $0 <dir>"
+
+    exit -1
+fi
+
+D=$1
+
+## create a test directory and an empty alternative directory
+
+TESTDIR=$D/"datalad-slurm-test-25_"`date -Is|tr -d ":"`
+A=$TESTDIR/alt
+
+mkdir -p $TESTDIR/src $A
+
+cd $TESTDIR/src
+
+echo "aaa">aaa.txt
+mkdir -p bbb
+echo "ccc">bbb/ccc.txt
+mkdir -p ddd/eee
+echo "fff">ddd/eee/fff.txt
+mkdir -p ggg/hhh/iii/
+echo "jjj">ggg/hhh/iii/jjj.txt
+
+python -m datalad_slurm.staging stage $TESTDIR/src $A/rel/dir aaa.txt bbb/ccc.txt ddd/eee/fff.txt ggg/hhh/ 'g*/h*/i*/*.txt'
+
+for f in aaa.txt bbb/ccc.txt ddd/eee/fff.txt ggg/hhh/iii/jjj.txt ; do
+
+    if ! cmp -s $f $A/rel/dir/$f ; then
+        echo "Error: $f was not staged"
+        exit -1
+    fi
+done
+
+echo "staging again, all files are unchanged:"
+python -m datalad_slurm.staging stage $TESTDIR/src $A/rel/dir aaa.txt bbb/ccc.txt ddd/eee/fff.txt ggg/hhh/
+
+if python -m datalad_slurm.staging stage $TESTDIR/src $A/rel/dir zzz/missing.txt ; then
+    echo "Error: staging a missing input did not fail"
+    exit -1
+fi
+
+echo "done"